@@ -0,0 +1,572 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark utility that measures the hot paths of the bag, order and
+catalog flows of Budy against a synthetic data set.
+
+Seeds a catalog of products (with brands, colors, categories and
+sized measurements) into an in-memory TinyDB database and then times
+each of the benchmarked operations: adding products to a bag, refreshing
+a bag, converting a bag into an order, paying an order, listing the
+catalog (running the `_build` of every product) and generating the
+simple product and complex order CSV exports.
+
+For each of the operations the wall time (per iteration), the number
+of database queries (per iteration) and the peak memory allocated by
+a single iteration are reported, optionally compared against a stored
+baseline so that regressions may be detected (non-zero exit code).
+
+The query counts are deterministic for a given set of options, so
+they are the only values stored in the (versioned) baseline and are
+compared without tolerance. The wall time and peak memory depend on
+the machine the benchmark runs on, they are only stored (`--timings`)
+and compared in a local baseline saved on the same machine before
+any change is measured.
+
+The database is always in-memory so no existing data is touched.
+
+Run from the project root (with Budy installed, eg: `pip install -e .`,
+or with the sources in the path) with:
+    PYTHONPATH=src python scripts/benchmark.py [options]
+
+Options:
+    --products=N        Number of products in the catalog (default: 200)
+    --lines=N           Number of lines per bag/order (default: 10)
+    --iterations=N      Number of iterations per operation (default: 5)
+    --seed=N            Seed for the pseudo random generator
+                        (default: 42)
+    --baseline=PATH     Path to the baseline file (default:
+                        scripts/benchmark.json)
+    --save              Save the results as the new baseline
+    --timings           Also save the wall time and peak memory in
+                        the baseline (local, same machine baselines)
+    --compare           Compare the results against the baseline
+    --tolerance=R       Allowed (relative) increase of wall time and
+                        peak memory over the baseline (default: 0.25)
+    --verbose, -v       Enable verbose output
+
+Examples:
+    PYTHONPATH=src python scripts/benchmark.py -v
+    PYTHONPATH=src python scripts/benchmark.py --save
+    PYTHONPATH=src python scripts/benchmark.py --compare
+    PYTHONPATH=src python scripts/benchmark.py --products=1000 --lines=25 -v
+    PYTHONPATH=src python scripts/benchmark.py --save --timings \
+        --baseline=/tmp/benchmark.json
+    PYTHONPATH=src python scripts/benchmark.py --compare --tolerance=0.5 \
+        --baseline=/tmp/benchmark.json
+
+Requires:
+    Python 3.10+
+"""
+
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from csv import writer
+from io import StringIO
+from json import dump, load
+from logging import ERROR
+from os.path import dirname, exists, join
+from random import Random
+from sys import exit
+from time import perf_counter
+from tracemalloc import get_traced_memory, reset_peak, start, stop
+from traceback import print_exc
+from typing import Any, Callable
+
+from appier import conf_s
+from appier.data import Collection
+
+from budy import (
+    Address,
+    Bag,
+    Brand,
+    BudyAccount,
+    BudyApp,
+    Category,
+    Color,
+    Measurement,
+    Order,
+    Product,
+)
+
+BASELINE = join(dirname(__file__), "benchmark.json")
+""" The default path to the baseline file, stored side by side
+with the benchmark script so that it may be versioned """
+
+
+class Benchmark:
+    """
+    Benchmark runner that seeds a synthetic catalog and measures
+    the wall time, query count and peak memory of the hot paths.
+    """
+
+    GENDERS: tuple[str, ...] = ("Male", "Female", "Child", "Both")
+    """ The genders randomly assigned to the generated products """
+
+    SIZES: tuple[int, ...] = (36, 38, 40, 42, 44)
+    """ The sizes of the measurements created for each product """
+
+    GROUPS: int = 8
+    """ The number of brands, colors and categories created, shared
+    (randomly) by the products of the catalog """
+
+    def __init__(
+        self,
+        products_count: int = 200,
+        lines_count: int = 10,
+        iterations: int = 5,
+        seed: int = 42,
+        verbose: bool = True,
+    ) -> None:
+        """
+        Initializes the benchmark runner.
+
+        :param products_count: The number of products in the catalog.
+        :param lines_count: The number of lines of each bag/order.
+        :param iterations: The number of iterations of each operation.
+        :param seed: The seed for the pseudo random generator, so that
+        successive runs use the same data set (and query counts).
+        :param verbose: Whether to print verbose output.
+        """
+
+        self.products_count = products_count
+        self.lines_count = min(lines_count, products_count)
+        self.iterations = iterations
+        self.random = Random(seed)
+        self.verbose = verbose
+        self.app: BudyApp | None = None
+        self.products: list[Product] = []
+        self.account: BudyAccount | None = None
+        self.address: Address | None = None
+        self.queries: Counter[str] = Counter()
+        self.results: dict[str, dict[str, Any]] = {}
+
+    def log(self, message: str, level: str = "INFO") -> None:
+        """
+        Logs a message if verbose mode is enabled.
+
+        :param message: The message to log.
+        :param level: The level of the message.
+        """
+
+        if not self.verbose:
+            return
+        for part in message.split("\n"):
+            print(f"[{level}] {part}")
+
+    def init_app(self) -> None:
+        """
+        Initializes the underlying Budy application against an
+        in-memory TinyDB database and instruments the data layer
+        so that the queries issued by each operation are counted.
+        """
+
+        self.log("Initializing Budy application...")
+        conf_s("ADAPTER", "tiny")
+        conf_s("TINY_STORAGE", "memory")
+        self.app = BudyApp(level=ERROR)
+        self._instrument()
+        self.log("Budy application initialized successfully")
+
+    def stop_app(self) -> None:
+        """
+        Unloads the Budy application, ensuring that any open
+        resources (scheduler, database connection) are released.
+        """
+
+        if self.app is None:
+            return
+        self.app.unload()
+        self.app = None
+
+    def seed(self) -> None:
+        """
+        Seeds the synthetic catalog, with every product having a
+        brand, a color, a category and a measurement per size, the
+        account and address used by the bags and orders are created too.
+        """
+
+        self.log("=" * 60)
+        self.log("Seeding Catalog")
+        self.log("=" * 60)
+
+        brands, colors, categories = [], [], []
+        for index in range(self.GROUPS):
+            brand = Brand(name=f"brand-{index}")
+            brand.save()
+            brands.append(brand)
+            color = Color(name=f"color-{index}")
+            color.save()
+            colors.append(color)
+            category = Category(name=f"category-{index}")
+            category.save()
+            categories.append(category)
+
+        for index in range(self.products_count):
+            product = Product(
+                product_id=f"BENCH-{index:06d}",
+                short_description=f"Benchmark Product {index}",
+                gender=self.random.choice(self.GENDERS),
+                price=float(self.random.randint(10, 200)),
+                quantity_hand=float(len(self.SIZES) * 1000),
+            )
+            product.brand = self.random.choice(brands)
+            product.colors = [self.random.choice(colors)]
+            product.categories = [self.random.choice(categories)]
+            product.save()
+            for size in self.SIZES:
+                measurement = Measurement(
+                    product=product,
+                    name="size",
+                    value=size,
+                    value_s=str(size),
+                    price=product.price,
+                    quantity_hand=1000.0,
+                )
+                measurement.save()
+                product.measurements.append(measurement)
+            product.save()
+            self.products.append(product)
+
+        self.account = BudyAccount(
+            name="Benchmark Customer",
+            username="benchmark",
+            email="benchmark@budy.test",
+            password="benchmark",
+            password_confirm="benchmark",
+        )
+        self.account.save()
+
+        self.address = Address(
+            first_name="Benchmark",
+            last_name="Customer",
+            address="Rua Benchmark",
+            city="Lisboa",
+            postal_code="1000-001",
+            country="PT",
+            phone_number="+351910000000",
+        )
+        self.address.save()
+
+        self.log(f"  + Created {len(self.products)} product(s)")
+
+    def run(self) -> None:
+        """
+        Runs each of the benchmarked operations, storing the
+        measured values in the results dictionary.
+        """
+
+        self.log("\n" + "=" * 60)
+        self.log("Running Benchmarks")
+        self.log("=" * 60)
+
+        self.measure("bag.add_product_s", self._fill_bag, self._new_bag)
+        self.measure("bag.refresh_s", lambda bag: bag.refresh_s(force=True), self._bag)
+        self.measure("bag.to_order_s", lambda bag: bag.to_order_s(), self._bag)
+        self.measure("order.pay_s", self._pay, self._order)
+        self.measure("product.list", lambda _: self._list_products())
+        self.measure("product.simple_csv", lambda _: self._simple_csv())
+        self.measure("order.complex_csv", lambda _: self._complex_csv())
+
+    def measure(
+        self,
+        name: str,
+        operation: Callable[[Any], Any],
+        prepare: Callable[[], Any] | None = None,
+    ) -> None:
+        """
+        Measures the provided operation for the configured number of
+        iterations, the (optional) prepare callable is run before each
+        iteration and is excluded from the measurement, its result is
+        passed to the operation.
+
+        The peak memory is measured in an extra iteration as tracing
+        the allocations would otherwise distort the wall time.
+
+        :param name: The name of the operation, used in the report.
+        :param operation: The callable that is going to be measured.
+        :param prepare: The callable that builds the operation state.
+        """
+
+        times: list[float] = []
+        queries = 0
+        for _index in range(self.iterations):
+            state = prepare() if prepare else None
+            self.queries.clear()
+            start_t = perf_counter()
+            operation(state)
+            times.append(perf_counter() - start_t)
+            queries += sum(self.queries.values())
+
+        state = prepare() if prepare else None
+        start()
+        try:
+            reset_peak()
+            operation(state)
+            _current, peak = get_traced_memory()
+        finally:
+            stop()
+
+        result = dict(
+            wall=sum(times) / len(times),
+            wall_min=min(times),
+            wall_max=max(times),
+            queries=queries // self.iterations,
+            memory=peak,
+        )
+        self.results[name] = result
+        self.log(
+            f"  + {name:<20} {result['wall'] * 1000.0:10.2f} ms "
+            f"{result['queries']:8d} queries {peak / 1024.0:10.1f} KiB"
+        )
+
+    def compare(self, baseline: dict[str, Any], tolerance: float) -> list[str]:
+        """
+        Compares the current results against the provided baseline,
+        returning the description of each of the regressions found.
+
+        :param baseline: The baseline results to compare against.
+        :param tolerance: The allowed relative increase of both the
+        wall time and the peak memory (only compared in case they are
+        present in the baseline), queries have no tolerance.
+        :return: The list of regressions, empty if there are none.
+        """
+
+        regressions = []
+        options = baseline.get("options", {})
+        if not options == self.options:
+            regressions.append(
+                f"options differ from baseline ({options} != {self.options})"
+            )
+            return regressions
+
+        for name, result in self.results.items():
+            base = baseline.get("results", {}).get(name, None)
+            if base is None:
+                continue
+            for key, factor in (
+                ("wall", 1.0 + tolerance),
+                ("memory", 1.0 + tolerance),
+                ("queries", 1.0),
+            ):
+                if key not in base:
+                    continue
+                if result[key] <= base[key] * factor:
+                    continue
+                regressions.append(
+                    f"{name} {key} increased from {base[key]} to {result[key]}"
+                )
+        return regressions
+
+    @property
+    def options(self) -> dict[str, int]:
+        """
+        The options that define the data set of the benchmark, the
+        results are only comparable for the same set of options.
+        """
+
+        return dict(
+            products=self.products_count,
+            lines=self.lines_count,
+            iterations=self.iterations,
+        )
+
+    def _instrument(self) -> None:
+        """
+        Wraps the logging method of the data layer collections, called
+        by every operation they run, so that queries are counted.
+        """
+
+        log = Collection.log
+        queries = self.queries
+
+        def _log(collection: Collection, operation: str, *args, **kwargs) -> None:
+            queries[operation] += 1
+            log(collection, operation, *args, **kwargs)
+
+        Collection.log = _log
+
+    def _fill_bag(self, bag: Bag) -> Bag:
+        products = self.random.sample(self.products, self.lines_count)
+        for product in products:
+            size = self.random.choice(self.SIZES)
+            bag.add_product_s(
+                product, quantity=1.0, size=size, size_s=str(size), scale=1
+            )
+        return bag
+
+    def _new_bag(self) -> Bag:
+        bag = Bag(account=self.account)
+        bag.save()
+        return bag
+
+    def _bag(self) -> Bag:
+        return self._fill_bag(self._new_bag())
+
+    def _order(self) -> Order:
+        order = self._bag().to_order_s()
+        order.shipping_address = self.address
+        order.billing_address = self.address
+        order.email = "benchmark@budy.test"
+        order.save()
+        return order
+
+    def _pay(self, order: Order) -> None:
+        def _pay_benchmark(payment_data: dict[str, Any]) -> bool:
+            order.payment_data = dict(engine="benchmark")
+            return True
+
+        order.pay_s(
+            payment_data=dict(type="benchmark"), payment_function=_pay_benchmark
+        )
+
+    def _list_products(self) -> list[dict[str, Any]]:
+        return Product.find_e(
+            find_t="right", eager=("images", "brand"), map=True, limit=0
+        )
+
+    def _simple_csv(self) -> str:
+        controller = self.app.get_controller("ProductAPIController")
+        return self._write_csv(controller._simple_rows(dict(limit=0)))
+
+    def _complex_csv(self) -> str:
+        controller = self.app.get_controller("OrderAPIController")
+        return self._write_csv(
+            controller._complex_rows(dict(limit=0, sort=[("id", -1)], paid=True))
+        )
+
+    def _write_csv(self, rows: Any) -> str:
+        buffer = StringIO()
+        writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+
+def parse_args() -> Namespace:
+    """
+    Parses command line arguments.
+    """
+
+    parser = ArgumentParser(
+        description="Benchmark the bag, order and catalog hot paths of Budy"
+    )
+    parser.add_argument(
+        "--products",
+        type=int,
+        default=200,
+        help="Number of products in the catalog (default: 200)",
+    )
+    parser.add_argument(
+        "--lines",
+        type=int,
+        default=10,
+        help="Number of lines per bag/order (default: 10)",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=5,
+        help="Number of iterations per operation (default: 5)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Seed for the pseudo random generator (default: 42)",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE,
+        help="Path to the baseline file (default: scripts/benchmark.json)",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save the results as the new baseline"
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Also save the wall time and peak memory (same machine baselines)",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Compare the results against the baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed increase of wall time and peak memory (default: 0.25)",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Enable verbose output"
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    """
+    Main entry point for the CLI.
+    """
+
+    args = parse_args()
+    benchmark = Benchmark(
+        products_count=args.products,
+        lines_count=args.lines,
+        iterations=args.iterations,
+        seed=args.seed,
+        verbose=args.verbose,
+    )
+
+    try:
+        benchmark.init_app()
+        benchmark.seed()
+        benchmark.run()
+    except Exception as exception:
+        benchmark.log(f"Error running benchmark: {exception}", "ERROR")
+        print_exc()
+        exit(1)
+    finally:
+        benchmark.stop_app()
+
+    # the wall time and peak memory are only saved in the baseline when
+    # requested, as they are not comparable across different machines
+    keys = ("queries", "wall", "wall_min", "wall_max", "memory")
+    keys = keys if args.timings else ("queries",)
+    results = dict(
+        (name, dict((key, result[key]) for key in keys))
+        for name, result in benchmark.results.items()
+    )
+    report = dict(options=benchmark.options, results=results)
+    print(f"{'operation':<20} {'wall (ms)':>10} {'queries':>8} {'memory (KiB)':>12}")
+    for name, result in benchmark.results.items():
+        print(
+            f"{name:<20} {result['wall'] * 1000.0:10.2f} "
+            f"{result['queries']:8d} {result['memory'] / 1024.0:12.1f}"
+        )
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            dump(report, file, indent=4, sort_keys=True)
+            file.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+
+    if not args.compare:
+        exit(0)
+
+    if not exists(args.baseline):
+        print(f"No baseline found at {args.baseline}")
+        exit(1)
+
+    with open(args.baseline) as file:
+        baseline = load(file)
+    regressions = benchmark.compare(baseline, args.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if not regressions:
+        print("No regressions found against the baseline")
+    exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -28,7 +28,10 @@ __copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
 __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
+import time
 import logging
+import multiprocessing
+import multiprocessing.pool
 
 
 class Bot(object):
@@ -41,3 +44,68 @@ class Bot(object):
             return self.owner.logger
         else:
             return logging.getLogger()
+
+    def build_pool(self, workers):
+        """
+        Builds a bounded pool of worker threads that may be used to
+        run (IO bound) operations concurrently, in case the number
+        of workers is not greater than one no pool is created and
+        the operations are run sequentially.
+
+        :type workers: int
+        :param workers: The maximum number of worker threads that
+        are going to be used concurrently.
+        :rtype: ThreadPool
+        :return: The pool of threads or an invalid value in case the
+        operations should be run sequentially.
+        """
+
+        if workers <= 1:
+            return None
+        return multiprocessing.pool.ThreadPool(processes=workers)
+
+    def build_process_pool(self, processes):
+        """
+        Builds a pool of worker processes that may be used to run
+        CPU bound operations (eg: image encoding) in parallel, the
+        operations must be module level functions (pickling).
+
+        The processes are started with the spawn method (when available)
+        as forking a process that is running threads is not safe.
+
+        :type processes: int
+        :param processes: The number of processes in the pool.
+        :rtype: Pool
+        :return: The pool of processes or an invalid value in case
+        the operations should be run locally.
+        """
+
+        if processes <= 1:
+            return None
+        get_context = getattr(multiprocessing, "get_context", None)
+        context = get_context("spawn") if get_context else multiprocessing
+        return context.Pool(processes=processes)
+
+    def destroy(self):
+        """
+        Releases the resources (eg: process pools) held by the bot,
+        should be called once the bot is no longer going to be used.
+        """
+
+        pass
+
+    def destroy_pool(self, pool):
+        if not pool:
+            return
+        pool.close()
+        pool.join()
+
+    def map(self, method, items, pool=None):
+        if not pool or len(items) <= 1:
+            return [method(item) for item in items]
+        return pool.map(method, items)
+
+    def timed(self, method, *args, **kwargs):
+        start = time.time()
+        result = method(*args, **kwargs)
+        return result, time.time() - start
@@ -28,6 +28,8 @@ __copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
 __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
+import time
+import threading
 import traceback
 
 import appier
@@ -40,6 +42,19 @@ RECORDS = 100
 """ The default value for the number of records that are
 going to be retrieved per each HTTP request """
 
+WORKERS = 4
+""" The default number of worker threads that are going
+to be used for the concurrent upsert of the products """
+
+PROCESSES = 2
+""" The default number of processes that are going to be
+used for the (CPU bound) generation of the media thumbnails """
+
+FULL_INTERVAL = 86400
+""" The default interval (in seconds) between full syncs
+(reconciliation) of the products in database, between them
+only the merchandise modified since the last sync is synced """
+
 
 class OmniBot(base.Bot):
     def __init__(self, *args, **kwargs):
@@ -47,9 +62,19 @@ class OmniBot(base.Bot):
         self.enabled = appier.conf("OMNI_BOT_ENABLED", False, cast=bool)
         self.store = appier.conf("OMNI_BOT_STORE", None, cast=int)
         self.records = appier.conf("OMNI_BOT_RECORDS", RECORDS)
+        self.workers = appier.conf("OMNI_BOT_WORKERS", WORKERS, cast=int)
+        self.processes = appier.conf("OMNI_BOT_PROCESSES", PROCESSES, cast=int)
+        self.full_interval = appier.conf(
+            "OMNI_BOT_FULL_INTERVAL", FULL_INTERVAL, cast=int
+        )
         self.enabled = kwargs.get("enabled", self.enabled)
         self.store = kwargs.get("store", self.store)
         self.records = kwargs.get("records", self.records)
+        self.workers = kwargs.get("workers", self.workers)
+        self.processes = kwargs.get("processes", self.processes)
+        self.full_interval = kwargs.get("full_interval", self.full_interval)
+        self.lock = threading.RLock()
+        self.process_pool = None
         self.api = None
 
     def tick(self):
@@ -59,11 +84,17 @@ class OmniBot(base.Bot):
         self.fix_products()
         self.gc_products()
 
-    def sync_products(self):
-        self.logger.info("Starting Omni sync ...")
+    def sync_products(self, full=None):
+        full = self.is_full() if full == None else full
+        self.logger.info("Starting Omni sync (%s) ..." % ("full" if full else "delta"))
         self.sync_products_store()
-        self.sync_products_db()
-        self.sync_measurements_db()
+        if full:
+            self.sync_products_db()
+            self.sync_measurements_db()
+            budy.Product._ensure_min("omni_full", int(time.time()))
+        else:
+            self.sync_products_delta()
+            self.sync_measurements_delta()
         self.logger.info("Ended Omni sync")
 
     def fix_products(self):
@@ -81,62 +112,84 @@ class OmniBot(base.Bot):
         self.logger.info("Starting syncing of products from store ...")
 
         api = self.get_api()
+        pool = self.build_pool(self.workers)
         offset = 0
 
-        while True:
-            kwargs = {
-                "filter_string": "",
-                "start_record": offset,
-                "number_records": self.records,
-                "filters[]": ["sellable:equals:2"],
-            }
-            merchandise = api.list_store_merchandise(store_id=self.store, **kwargs)
-            if not merchandise:
-                break
-            offset += len(merchandise)
-
-            for merchandise in merchandise:
-                _class = merchandise["_class"]
-                is_product = _class in ("Product",)
-                is_sub_product = _class in ("SubProduct",)
-                is_valid = is_product or is_sub_product
-                if not is_valid:
+        # creates the maps that are going to store the counters and the
+        # timings (in seconds) for each of the phases of the sync
+        counters = dict(pages=0, products=0, sub_products=0, errors=0)
+        timings = dict(merchandise=0.0, inventory=0.0, upsert=0.0)
+
+        try:
+            while True:
+                kwargs = {
+                    "filter_string": "",
+                    "start_record": offset,
+                    "number_records": self.records,
+                    "filters[]": ["sellable:equals:2"],
+                }
+                merchandise, elapsed = self.timed(
+                    api.list_store_merchandise, store_id=self.store, **kwargs
+                )
+                timings["merchandise"] += elapsed
+                if not merchandise:
+                    break
+                offset += len(merchandise)
+                counters["pages"] += 1
+
+                # splits the page of merchandise into products and sub products
+                # (other types of merchandise are ignored) and then retrieves the
+                # inventory lines of the complete page in a single remote call
+                products = [item for item in merchandise if item["_class"] == "Product"]
+                sub_products = [
+                    item for item in merchandise if item["_class"] == "SubProduct"
+                ]
+                if not products and not sub_products:
                     continue
-                inventory_lines = api.list_inventory_lines(
-                    store_id=self.store,
-                    number_records=1,
-                    **{
-                        "filter_string": "",
-                        "filters[]": [
-                            "functional_unit:equals:%d" % self.store,
-                            "merchandise:equals:%d" % merchandise["object_id"],
-                        ],
-                    }
+                inventory, elapsed = self.timed(
+                    self.get_inventory_page, products + sub_products
                 )
-                inventory_line = inventory_lines[0]
-                inventory_lines = api.list_inventory_lines(
-                    store_id=self.store,
-                    number_records=-1,
-                    **{
-                        "filter_string": "",
-                        "filters[]": [
-                            "functional_unit:not_equals:%d" % self.store,
-                            "merchandise:equals:%d" % merchandise["object_id"],
-                        ],
-                    }
+                timings["inventory"] += elapsed
+
+                # runs the upsert of the products and then of the sub products
+                # on the pool of workers, notice that the products go first so
+                # that the parent products of the sub products already exist
+                start = time.time()
+                results = self.map(
+                    lambda item: self.sync_product_safe(
+                        item, **inventory[item["object_id"]]
+                    ),
+                    products,
+                    pool=pool,
                 )
-                if is_product:
-                    self.sync_product_safe(
-                        merchandise,
-                        inventory_line=inventory_line,
-                        inventory_lines=inventory_lines,
-                    )
-                else:
-                    self.sync_sub_product_safe(
-                        merchandise,
-                        inventory_line=inventory_line,
-                        inventory_lines=inventory_lines,
-                    )
+                counters["products"] += results.count(True)
+                counters["errors"] += results.count(False)
+                results = self.map(
+                    lambda item: self.sync_sub_product_safe(
+                        item, **inventory[item["object_id"]]
+                    ),
+                    sub_products,
+                    pool=pool,
+                )
+                counters["sub_products"] += results.count(True)
+                counters["errors"] += results.count(False)
+                timings["upsert"] += time.time() - start
+        finally:
+            self.destroy_pool(pool)
+
+        self.logger.info(
+            "Synced %d products and %d sub products (%d errors) in %d pages ..."
+            % (
+                counters["products"],
+                counters["sub_products"],
+                counters["errors"],
+                counters["pages"],
+            )
+        )
+        self.logger.info(
+            "Spent %.2fs listing merchandise, %.2fs listing inventory and %.2fs upserting ..."
+            % (timings["merchandise"], timings["inventory"], timings["upsert"])
+        )
 
         self.logger.info("Ended syncing of products from store")
 
@@ -145,6 +198,8 @@ class OmniBot(base.Bot):
 
         api = self.get_api()
         products = budy.Product.find()
+        watermark = 0
+        failed = None
 
         self.logger.info("Syncing %d products in database ..." % len(products))
 
@@ -161,7 +216,15 @@ class OmniBot(base.Bot):
             merchandise.pop("stock_on_hand", None)
             merchandise.pop("retail_price", None)
             merchandise.pop("price", None)
-            self.sync_product_safe(merchandise)
+            modify_date = merchandise.get("modify_date", 0)
+            if not self.sync_product_safe(merchandise):
+                failed = modify_date if failed == None else min(failed, modify_date)
+                continue
+            watermark = max(watermark, modify_date)
+
+        budy.Product._ensure_min(
+            "omni_modify_date", self._get_watermark(watermark, failed)
+        )
 
         self.logger.info("Ended syncing of products in database")
 
@@ -170,6 +233,8 @@ class OmniBot(base.Bot):
 
         api = self.get_api()
         measurements = budy.Measurement.find()
+        watermark = 0
+        failed = None
 
         self.logger.info("Syncing %d measurements in database ..." % len(measurements))
 
@@ -186,54 +251,154 @@ class OmniBot(base.Bot):
             merchandise.pop("stock_on_hand", None)
             merchandise.pop("retail_price", None)
             merchandise.pop("price", None)
-            self.sync_sub_product_safe(merchandise)
+            modify_date = merchandise.get("modify_date", 0)
+            if not self.sync_sub_product_safe(merchandise):
+                failed = modify_date if failed == None else min(failed, modify_date)
+                continue
+            watermark = max(watermark, modify_date)
+
+        budy.Measurement._ensure_min(
+            "omni_modify_date", self._get_watermark(watermark, failed)
+        )
 
         self.logger.info("Ended syncing of measurements in database")
 
-    def fix_products_db(self):
-        products = budy.Product.find()
+    def sync_products_delta(self):
+        self.logger.info("Starting delta syncing of products in database ...")
 
-        self.logger.info("Fixing %d products in database ..." % len(products))
+        api = self.get_api()
+        watermark = budy.Product._get_counter("omni_modify_date", 0)
+        object_ids = self._get_object_ids(budy.Product)
 
-        for product in products:
+        self.logger.info("Syncing products modified since %d ..." % watermark)
+
+        count = 0
+        failed = None
+
+        for merchandise in self._iter_modified(api.list_products, watermark):
+            modify_date = merchandise.get("modify_date", 0)
+            if not merchandise["object_id"] in object_ids:
+                watermark = max(watermark, modify_date)
+                continue
+            merchandise.pop("stock_on_hand", None)
+            merchandise.pop("retail_price", None)
+            merchandise.pop("price", None)
+            if not self.sync_product_safe(merchandise):
+                failed = modify_date if failed == None else min(failed, modify_date)
+                continue
+            watermark = max(watermark, modify_date)
+            count += 1
+
+        budy.Product._ensure_min(
+            "omni_modify_date", self._get_watermark(watermark, failed)
+        )
+
+        self.logger.info("Ended delta syncing of %d products in database" % count)
+
+    def sync_measurements_delta(self):
+        self.logger.info("Starting delta syncing of measurements in database ...")
+
+        api = self.get_api()
+        watermark = budy.Measurement._get_counter("omni_modify_date", 0)
+        object_ids = self._get_object_ids(budy.Measurement)
+
+        self.logger.info("Syncing measurements modified since %d ..." % watermark)
+
+        count = 0
+        failed = None
+
+        for merchandise in self._iter_modified(api.list_sub_products, watermark):
+            modify_date = merchandise.get("modify_date", 0)
+            if not merchandise["object_id"] in object_ids:
+                watermark = max(watermark, modify_date)
+                continue
+            merchandise.pop("stock_on_hand", None)
+            merchandise.pop("retail_price", None)
+            merchandise.pop("price", None)
+            if not self.sync_sub_product_safe(merchandise):
+                failed = modify_date if failed == None else min(failed, modify_date)
+                continue
+            watermark = max(watermark, modify_date)
+            count += 1
+
+        budy.Measurement._ensure_min(
+            "omni_modify_date", self._get_watermark(watermark, failed)
+        )
+
+        self.logger.info("Ended delta syncing of %d measurements in database" % count)
+
+    def fix_products_db(self):
+        watermark = budy.Product._get_counter("omni_fix", 0)
+        start = int(time.time())
+        count = 0
+
+        self.logger.info("Fixing products modified since %d ..." % watermark)
+
+        # only the products modified since the previous fix are checked, as
+        # the saves already rebuild the derived fields only the aggregates
+        # (that depend on the measurements) are verified, with field level
+        # writes that do not touch the modified date (no re-fixing)
+        kwargs = (
+            dict(modified={"$gte": watermark}) if budy.Product._is_mongo() else dict()
+        )
+        for products in budy.Product.find_chunks(size=self.records, **kwargs):
+            for product in products:
+                if not product.update_aggregates_s():
+                    continue
+                count += 1
+
+        # the products that reference groups or images modified since the
+        # previous fix are completely fixed (saved) so that their derived
+        # fields (names, labels and image URLs) reflect the changes
+        references = self._get_references_modified(watermark)
+        for product in self._iter_referencing(references):
             product.fix_s()
+            count += 1
+
+        budy.Product._ensure_min("omni_fix", start)
+
+        self.logger.info("Fixed %d products in database" % count)
 
     def fix_measurements_db(self):
-        measurements = budy.Measurement.find()
+        watermark = budy.Measurement._get_counter("omni_fix", 0)
+        start = int(time.time())
+        count = 0
+
+        self.logger.info("Fixing measurements modified since %d ..." % watermark)
+
+        # checks the measurements modified since the previous fix and the
+        # ones flagged as inconsistent by the (indexed) value type, notice
+        # that the fix only saves the measurements that are inconsistent
+        kwargs = (
+            {
+                "$or": [
+                    {"modified": {"$gte": watermark}},
+                    {"value": {"$type": "string"}},
+                ]
+            }
+            if budy.Measurement._is_mongo()
+            else dict()
+        )
+        for measurements in budy.Measurement.find_chunks(size=self.records, **kwargs):
+            for measurement in measurements:
+                if not measurement.fix_s():
+                    continue
+                count += 1
 
-        self.logger.info("Fixing %d measurements in database ..." % len(measurements))
+        budy.Measurement._ensure_min("omni_fix", start)
 
-        for measurement in measurements:
-            measurement.fix_s()
+        self.logger.info("Fixed %d measurements in database" % count)
 
     def gc_measurements_db(self):
-        measurements = budy.Measurement.find()
+        self.logger.info("Running GC for measurements in database ...")
+
+        report = budy.Measurement.dedupe_s()
 
         self.logger.info(
-            "Running GC for %d measurements in database ..." % len(measurements)
+            "Removed %d duplicated measurement(s) of %d object(s) from %d product(s) ..."
+            % (report["removed"], report["groups"], report["products"])
         )
 
-        # sorts the measurements (product dimensions) according to the
-        # modified data, from latest to oldest to be able to iterate
-        # over them to remove possible duplication from the database
-        measurements.sort(key=lambda v: v.meta.get("modify_date", 0), reverse=True)
-
-        # creates the list that is going to be used to detect possible
-        # duplicated sub product object ids
-        object_ids = []
-
-        # iterates over the complete set of measurements, trying to
-        # discover any possible duplicated measurement in case it exists
-        # removes it immediately from the data source, to avoid any
-        # possible duplicated value (would create issue in product)
-        for measurement in list(measurements):
-            object_id = measurement.meta.get("object_id", 0)
-            if object_id in object_ids:
-                measurements.remove(measurement)
-                measurement.delete()
-            else:
-                object_ids.append(object_id)
-
     def sync_product_safe(self, merchandise, *args, **kwargs):
         try:
             self.sync_product(merchandise, *args, **kwargs)
@@ -245,6 +410,8 @@ class OmniBot(base.Bot):
             lines = traceback.format_exc().splitlines()
             for line in lines:
                 self.logger.info(line)
+            return False
+        return True
 
     def sync_product(
         self, merchandise, inventory_line=None, inventory_lines=None, force=False
@@ -299,21 +466,26 @@ class OmniBot(base.Bot):
                 )
                 _media.save()
 
-            # iterates over the complete set of resized images to
-            # be created and for each of them verifies it has to
-            # be generated or if one already exists
-            for suffix, size in (
-                ("thumbnail", 260),
-                ("thumbnail_2x", 540),
-                ("large", 540),
-                ("large_2x", 1080),
-            ):
+            # retrieves the resized images that already exist for the
+            # media and creates the missing ones in a single pass (one
+            # decode of the original) running on the process pool
+            resized = dict()
+            for suffix, _size in budy.models.media.THUMBNAILS:
                 resized_unique = "%s-%s" % (unique, suffix)
-                resized = budy.Media.get(unique=resized_unique, raise_e=False)
-                if not resized:
-                    resized = _media.thumbnail_s(width=size, suffix=suffix)
-                    resized.save()
-                product.images.append(resized)
+                resized[suffix] = budy.Media.get(unique=resized_unique, raise_e=False)
+            missing = [
+                (suffix, size)
+                for suffix, size in budy.models.media.THUMBNAILS
+                if not resized[suffix]
+            ]
+            if missing:
+                thumbnails = _media.thumbnails_s(
+                    sizes=missing, pool=self.get_process_pool()
+                )
+                for thumbnail in thumbnails:
+                    resized[thumbnail.label] = thumbnail
+            for suffix, _size in budy.models.media.THUMBNAILS:
+                product.images.append(resized[suffix])
 
             product.images.append(_media)
             product.save()
@@ -329,16 +501,20 @@ class OmniBot(base.Bot):
             lines = traceback.format_exc().splitlines()
             for line in lines:
                 self.logger.info(line)
+            return False
+        return True
 
     def sync_sub_product(
         self, merchandise, inventory_line=None, inventory_lines=None, force=False
     ):
         api = self.get_api()
 
+        # uses the merchandise as the sub product in case it already contains
+        # the complete set of sub product attributes, avoiding an extra remote
+        # call, otherwise retrieves the complete sub product from remote
         object_id = merchandise["object_id"]
-        sub_product = api.get_sub_product(object_id)
-
-        product = sub_product["product"]
+        is_complete = "product" in merchandise and "weight" in merchandise
+        sub_product = merchandise if is_complete else api.get_sub_product(object_id)
 
         # tries to run the conversion process from the sub product and
         # associated merchandise value to the measurement in case it fails
@@ -352,26 +528,106 @@ class OmniBot(base.Bot):
             force=force,
         )
         if not measurement:
-            product = api.get_product(product["object_id"])
-            self.sync_product(product, force=True)
-            measurement = budy.Measurement.from_omni(
-                merchandise,
-                sub_product=sub_product,
-                inventory_line=inventory_line,
-                inventory_lines=inventory_lines,
-                force=force,
-            )
+            with self.lock:
+                measurement = self._sync_parent(
+                    merchandise,
+                    sub_product=sub_product,
+                    inventory_line=inventory_line,
+                    inventory_lines=inventory_lines,
+                    force=force,
+                )
 
         if not measurement:
             return
 
         measurement.save()
 
-        parent = measurement.product
+        # adds the measurement to its parent product (if required), this
+        # operation is serialized and runs over the latest version of the
+        # parent so that concurrent sub product syncs do not lose updates
+        with self.lock:
+            parent = measurement.product.reload()
+            parent.add_measurement_s(measurement)
+
+    def get_inventory_page(self, merchandise):
+        """
+        Retrieves the inventory lines for the complete set of provided
+        merchandise using a single remote call and groups them locally
+        by merchandise, separating the inventory line of the current
+        store from the ones of the other stock points.
+
+        :type merchandise: List
+        :param merchandise: The list of merchandise (page) for which
+        the inventory lines are going to be retrieved.
+        :rtype: Dictionary
+        :return: The map associating the object ID of each merchandise
+        with the keyword arguments (inventory line and lines) to be
+        used in the sync of it.
+        """
+
+        api = self.get_api()
+
+        object_ids = [item["object_id"] for item in merchandise]
+        inventory = dict(
+            (object_id, dict(inventory_line=None, inventory_lines=[]))
+            for object_id in object_ids
+        )
 
-        if not measurement in parent.measurements:
-            parent.measurements.append(measurement)
-            parent.save()
+        inventory_lines = api.list_inventory_lines(
+            store_id=self.store,
+            number_records=-1,
+            **{
+                "filter_string": "",
+                "filters[]": [
+                    "merchandise:in:%s"
+                    % ";".join(str(object_id) for object_id in object_ids)
+                ],
+            }
+        )
+
+        for inventory_line in inventory_lines:
+            merchandise_id = self._get_object_id(inventory_line.get("merchandise"))
+            functional_unit_id = self._get_object_id(
+                inventory_line.get("functional_unit")
+            )
+            item = inventory.get(merchandise_id, None)
+            if not item:
+                continue
+            if not functional_unit_id == self.store:
+                item["inventory_lines"].append(inventory_line)
+            elif not item["inventory_line"]:
+                item["inventory_line"] = inventory_line
+
+        return inventory
+
+    def is_full(self):
+        """
+        Determines if the next sync of the products in database should be
+        a full one (reconciliation) or a delta one, a full sync is required
+        if no full sync has ever been run or if the full sync interval has
+        elapsed since the last one.
+
+        :rtype: bool
+        :return: If the next sync should be a full sync.
+        """
+
+        last = budy.Product._get_counter("omni_full", None)
+        if last == None:
+            return True
+        return time.time() - last >= self.full_interval
+
+    def destroy(self):
+        with self.lock:
+            process_pool = self.process_pool
+            self.process_pool = None
+        self.destroy_pool(process_pool)
+
+    def get_process_pool(self):
+        with self.lock:
+            if self.process_pool:
+                return self.process_pool
+            self.process_pool = self.build_process_pool(self.processes)
+            return self.process_pool
 
     def get_api(self):
         import omni
@@ -385,3 +641,113 @@ class OmniBot(base.Bot):
         import omni
 
         return omni.OmniError
+
+    def _sync_parent(self, merchandise, sub_product=None, *args, **kwargs):
+        # tries to run the conversion once again as the parent product may
+        # have been created by a concurrent sync (while waiting for the lock)
+        measurement = budy.Measurement.from_omni(
+            merchandise, sub_product=sub_product, *args, **kwargs
+        )
+        if measurement:
+            return measurement
+
+        # retrieves the parent product from remote and syncs it, retrying
+        # then the conversion of the sub product into a measurement
+        api = self.get_api()
+        product = api.get_product(sub_product["product"]["object_id"])
+        self.sync_product(product, force=True)
+        return budy.Measurement.from_omni(
+            merchandise, sub_product=sub_product, *args, **kwargs
+        )
+
+    def _get_watermark(self, watermark, failed):
+        # the watermark never goes beyond the earliest failed entity (it's
+        # kept just below it) so that the entity is retried by the next
+        # delta sync instead of being skipped until the next full sync
+        if failed == None:
+            return watermark
+        return min(watermark, failed - 1)
+
+    def _iter_modified(self, method, watermark):
+        # iterates over the pages of remote entities modified after the
+        # watermark, notice that a one second overlap is used so that the
+        # entities modified on the watermark second are not lost and that
+        # the entities are sorted by modify date so that the (offset based)
+        # pages are stable and no entity is skipped or repeated
+        offset = 0
+        while True:
+            kwargs = {
+                "filter_string": "",
+                "start_record": offset,
+                "number_records": self.records,
+                "sort": "modify_date:ascending",
+                "filters[]": ["modify_date:greater:%d" % (watermark - 1)],
+            }
+            items = method(**kwargs)
+            if not items:
+                break
+            offset += len(items)
+            for item in items:
+                yield item
+
+    def _get_references_modified(self, watermark):
+        # retrieves the identifiers of the entities referenced by the products
+        # (groups and images) modified since the watermark, indexed by the
+        # name of the product field that references them
+        references = dict()
+        for name, model in (
+            ("brand", budy.Brand),
+            ("season", budy.Season),
+            ("colors", budy.Color),
+            ("categories", budy.Category),
+            ("collections", budy.Collection),
+            ("images", budy.Media),
+        ):
+            kwargs = dict(modified={"$gte": watermark}) if model._is_mongo() else dict()
+            entities = model.find(map=True, fields=("id", "modified"), **kwargs)
+            ids = [
+                entity["id"]
+                for entity in entities
+                if (entity.get("modified", None) or 0) >= watermark
+            ]
+            if not ids:
+                continue
+            references[name] = set(ids)
+        return references
+
+    def _iter_referencing(self, references):
+        # iterates over the products that reference any of the provided
+        # entities, for Mongo the products are selected by the query and
+        # for the other adapters (eg: tiny) they are filtered locally
+        if not references:
+            return
+        if budy.Product._is_mongo():
+            kwargs = {
+                "$or": [{name: {"$in": list(ids)}} for name, ids in references.items()]
+            }
+        else:
+            kwargs = dict()
+        for products in budy.Product.find_chunks(size=self.records, **kwargs):
+            for product in products:
+                for name, ids in references.items():
+                    value = getattr(product, name, None)
+                    if not value:
+                        continue
+                    values = value.ids if hasattr(value, "ids") else [value.id]
+                    if not ids.intersection(values):
+                        continue
+                    yield product
+                    break
+
+    def _get_object_ids(self, model):
+        entities = model.find(map=True, fields=("meta",))
+        object_ids = [
+            (entity.get("meta", None) or dict()).get("object_id", None)
+            for entity in entities
+        ]
+        return set(object_id for object_id in object_ids if object_id)
+
+    def _get_object_id(self, value):
+        if isinstance(value, dict):
+            return value.get("object_id", None)
+        return value
@@ -28,8 +28,16 @@ __copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
 __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
+import os
+import time
+import socket
+import threading
+import traceback
+
 import appier
 
+import budy
+
 from . import omni_bot
 from . import tracking_bot
 
@@ -39,14 +47,165 @@ loop between ticks, this value should not be too small
 to spend many resources or to high to create a long set
 of time between external interactions """
 
+JOBS = (
+    ("reservations", 30.0, 300.0, 1),
+    ("omni", 30.0, 3600.0, 1),
+    ("tracking", 300.0, 3600.0, 1),
+)
+""" The default definition of the jobs run by the scheduler as
+tuples of name, interval (between runs in the cluster), timeout
+(maximum duration of the lease) and concurrency (maximum number
+of concurrent runs in the cluster), each value may be changed using
+the `JOB_<NAME>_<VALUE>` configuration values """
+
+OMNI_PHASES = (
+    ("omni_sync", 30.0),
+    ("omni_fix", 300.0),
+    ("omni_gc", 3600.0),
+)
+""" The phases of the Omni job as tuples of name and interval
+(between runs in the cluster), run in sequence by the same job so
+that they never overlap, the interval may be changed using the
+`JOB_<NAME>_INTERVAL` configuration values """
+
 
 class Scheduler(appier.Scheduler):
     def __init__(self, owner, *args, **kwargs):
         appier.Scheduler.__init__(self, owner, timeout=LOOP_TIMEOUT, *args, **kwargs)
         self.omni_bot = omni_bot.OmniBot(owner=owner, **kwargs)
         self.tracking_bot = tracking_bot.TrackingBot(owner=owner, **kwargs)
+        self.node = "%s:%d" % (socket.gethostname(), os.getpid())
+        self.lock = threading.RLock()
+        self.active = dict()
+        self.jobs = self.build_jobs()
 
     def tick(self):
         appier.Scheduler.tick(self)
-        self.omni_bot.tick()
-        self.tracking_bot.tick()
+        for job in self.jobs:
+            self.run_job(job)
+
+    def stop(self, awake=True):
+        appier.Scheduler.stop(self, awake=awake)
+        self.destroy()
+
+    def destroy(self):
+        self.omni_bot.destroy()
+        self.tracking_bot.destroy()
+
+    def build_jobs(self):
+        methods = dict(
+            reservations=(self.collect_reservations, True),
+            omni=(self.run_omni, self.omni_bot.enabled),
+            tracking=(self.tracking_bot.sync_sent, self.tracking_bot.enabled),
+        )
+        jobs = []
+        for name, interval, timeout, concurrency in JOBS:
+            method, enabled = methods[name]
+            prefix = "JOB_%s_" % name.upper()
+            jobs.append(
+                dict(
+                    name=name,
+                    method=method,
+                    enabled=appier.conf(prefix + "ENABLED", enabled, cast=bool),
+                    interval=appier.conf(prefix + "INTERVAL", interval, cast=float),
+                    timeout=appier.conf(prefix + "TIMEOUT", timeout, cast=float),
+                    concurrency=appier.conf(
+                        prefix + "CONCURRENCY", concurrency, cast=int
+                    ),
+                )
+            )
+        return jobs
+
+    def run_job(self, job):
+        """
+        Runs the provided job in its own thread in case it's due and
+        the lease for it is acquired by this process, so that no other
+        process in the cluster runs it at the same time.
+
+        :type job: Dictionary
+        :param job: The job definition with its name, method, interval,
+        timeout and concurrency.
+        :rtype: bool
+        :return: If the job has been started by this process.
+        """
+
+        if not job["enabled"]:
+            return False
+
+        # tries to acquire one of the (free) lease slots for the job, this
+        # process never runs more than the allowed concurrency of the job
+        name = job["name"]
+        with self.lock:
+            active = self.active.setdefault(name, set())
+            slots = [slot for slot in range(job["concurrency"]) if not slot in active]
+            for slot in slots:
+                if budy.JobRun.acquire_lease(
+                    name, self.node, job["timeout"], slot=slot
+                ):
+                    active.add(slot)
+                    break
+            else:
+                return False
+
+        thread = threading.Thread(
+            target=self._run_job, args=(job, slot), name="Job-%s" % name
+        )
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def run_omni(self):
+        """
+        Runs the phases of the Omni bot (sync, fix and garbage collection)
+        in sequence, as the previous bot tick did, so that a phase never
+        overlaps another (eg: fix rewriting products being synced).
+
+        Each phase is only run in case it's due, using a lease per phase
+        to keep its own interval across the processes of the cluster.
+        """
+
+        methods = dict(
+            omni_sync=self.omni_bot.sync_products,
+            omni_fix=self.omni_bot.fix_products,
+            omni_gc=self.omni_bot.gc_products,
+        )
+        timeout = appier.conf("JOB_OMNI_TIMEOUT", 3600.0, cast=float)
+        for name, interval in OMNI_PHASES:
+            prefix = "JOB_%s_" % name.upper()
+            interval = appier.conf(prefix + "INTERVAL", interval, cast=float)
+            if not budy.JobRun.acquire_lease(name, self.node, timeout):
+                continue
+            budy.BudyBase.begin_batch()
+            try:
+                methods[name]()
+            finally:
+                budy.BudyBase.end_batch()
+                budy.JobRun.release_lease(name, self.node, interval)
+
+    def collect_reservations(self):
+        count = budy.Reservation.collect_expired_s()
+        if not count:
+            return
+        self.logger.info("Released %d expired reservation(s) ..." % count)
+
+    def _run_job(self, job, slot):
+        name = job["name"]
+        run = budy.JobRun(name=name, node=self.node, start=time.time())
+        status, message = "success", None
+        try:
+            run.save()
+            job["method"]()
+        except Exception as exception:
+            status, message = "failed", str(exception)
+            self.logger.error("Problem running job %s - %s ..." % (name, exception))
+            lines = traceback.format_exc().splitlines()
+            for line in lines:
+                self.logger.warning(line)
+        finally:
+            budy.JobRun.release_lease(name, self.node, job["interval"], slot=slot)
+            with self.lock:
+                self.active[name].discard(slot)
+        if run.is_new():
+            return
+        run.finish_s(status=status, message=message, timeout=job["timeout"])
+        budy.JobRun.prune_s(name)
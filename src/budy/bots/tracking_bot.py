@@ -36,14 +36,48 @@ import budy
 
 from . import base
 
+BATCH = 100
+""" The number of (due) orders that are loaded and checked
+per each batch, the schedule of each order is persisted as
+soon as it's checked so that the sync may be resumed """
+
+WORKERS = 8
+""" The maximum number of tracking requests that are going
+to be run concurrently, a value of one runs them sequentially """
+
+INTERVAL = 3600
+""" The interval (in seconds) between the checks of an order
+that is still not delivered, also the base value for the
+exponential backoff applied on failures """
+
+MAX_INTERVAL = 86400
+""" The maximum interval (in seconds) between two consecutive
+checks of an order, limiting the exponential backoff """
+
+DURATION = 300
+""" The maximum amount of time (in seconds) a tick may spend
+checking orders, the remaining ones are resumed in the next tick """
+
 
 class TrackingBot(base.Bot):
     def __init__(self, *args, **kwargs):
         base.Bot.__init__(self, *args, **kwargs)
         self.enabled = appier.conf("TRACKING_BOT_ENABLED", False, cast=bool)
         self.window = appier.conf("TRACKING_BOT_WINDOW", 14 * 86400, cast=int)
+        self.batch = appier.conf("TRACKING_BOT_BATCH", BATCH, cast=int)
+        self.workers = appier.conf("TRACKING_BOT_WORKERS", WORKERS, cast=int)
+        self.interval = appier.conf("TRACKING_BOT_INTERVAL", INTERVAL, cast=int)
+        self.max_interval = appier.conf(
+            "TRACKING_BOT_MAX_INTERVAL", MAX_INTERVAL, cast=int
+        )
+        self.duration = appier.conf("TRACKING_BOT_DURATION", DURATION, cast=int)
         self.enabled = kwargs.get("enabled", self.enabled)
         self.window = kwargs.get("window", self.window)
+        self.batch = kwargs.get("batch", self.batch)
+        self.workers = kwargs.get("workers", self.workers)
+        self.interval = kwargs.get("interval", self.interval)
+        self.max_interval = kwargs.get("max_interval", self.max_interval)
+        self.duration = kwargs.get("duration", self.duration)
         self.api = None
 
     def tick(self):
@@ -52,23 +86,83 @@ class TrackingBot(base.Bot):
         self.sync_sent()
 
     def sync_sent(self):
+        pool = self.build_pool(self.workers)
+        counters = dict(received=0, pending=0, errors=0)
+        start = time.time()
+
+        # processes the due orders in batches until either there are no
+        # more due orders or the time budget of the tick is exhausted, as
+        # the schedule of each order is persisted upon check the remaining
+        # orders are resumed in the next tick
+        try:
+            while time.time() - start < self.duration:
+                orders = self.get_due()
+                if not orders:
+                    break
+                results = self.map(self.sync_order, orders, pool=pool)
+                for result in results:
+                    counters[result] += 1
+        finally:
+            self.destroy_pool(pool)
+
+        if not any(counters.values()):
+            return
+
+        self.logger.info(
+            "Checked tracking of %d received, %d pending (%d errors) order(s) ..."
+            % (counters["received"], counters["pending"], counters["errors"])
+        )
+
+    def sync_order(self, order):
+        now = time.time()
+
+        # in case there's no tracking number there's nothing to be checked
+        # and the order is only going to be checked again latter (it may
+        # have its tracking number defined in the meantime)
+        if not order.tracking_number:
+            order.schedule_tracking_s(now + self.max_interval)
+            return "pending"
+
+        try:
+            result = appier.get(
+                "https://cttpie.stage.hive.pt",
+                params=dict(tracking=order.tracking_number),
+            )
+            if not result["status"] == "Entregue":
+                order.schedule_tracking_s(now + self.interval)
+                return "pending"
+            order.mark_received_s()
+        except Exception as exception:
+            failures = (order.tracking_failures or 0) + 1
+            order.schedule_tracking_s(
+                now + self.get_backoff(failures), failures=failures
+            )
+            self.logger.warn(
+                "Problem syncing order %s - %s ..." % (order.reference, exception)
+            )
+            return "errors"
+
+        self.logger.info("Marked order %s as received ..." % order.reference)
+        return "received"
+
+    def get_due(self):
+        """
+        Retrieves the next batch of sent orders (within the window) that
+        are due for a tracking check, the orders that were never checked
+        come first followed by the ones with the oldest schedule.
+
+        :rtype: List
+        :return: The batch of orders that should be checked now.
+        """
+
+        now = time.time()
         orders = budy.Order.find_e(
-            status="sent", created={"$gt": time.time() - self.window}
+            status="sent",
+            created={"$gt": now - self.window},
+            sort=[("tracking_next", 1), ("id", 1)],
+            limit=self.batch,
         )
-        for order in orders:
-            if not order.tracking_number:
-                continue
-            try:
-                result = appier.get(
-                    "https://cttpie.stage.hive.pt",
-                    params=dict(tracking=order.tracking_number),
-                )
-                if not result["status"] == "Entregue":
-                    continue
-                order.mark_received_s()
-            except Exception as exception:
-                self.logger.warn(
-                    "Problem syncing order %s - %s ..." % (order.reference, exception)
-                )
-                continue
-            self.logger.info("Marked order %s as received ..." % order.reference)
+        return [order for order in orders if (order.tracking_next or 0) <= now]
+
+    def get_backoff(self, failures):
+        return min(self.interval * 2 ** (failures - 1), self.max_interval)
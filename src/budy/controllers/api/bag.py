@@ -59,16 +59,14 @@ class BagAPIController(root.RootAPIController):
     def show(self, key):
         ensure = self.field("ensure", True, cast=bool)
         try_valid = self.field("try_valid", True, cast=bool)
-        bag = budy.Bag.get(key=key, raise_e=not ensure)
+        eager = ("lines.product.images", "lines.product.brand")
+        bag = budy.Bag.get(key=key, eager=eager, raise_e=not ensure)
         if not bag:
             bag = budy.Bag.ensure_s(key=key)
-        bag.refresh_s(currency=self.currency, country=self.country)
-        if try_valid:
-            bag.try_valid_s()
-        bag = bag.reload(
-            eager=("lines.product.images", "lines.product.brand"), map=True
+        bag.refresh_valid_s(
+            currency=self.currency, country=self.country, try_valid=try_valid
         )
-        return bag
+        return bag.map_eager(eager)
 
     @appier.route("/api/bags/<str:key>/merge/<str:target>", "PUT", json=True)
     def merge(self, key, target):
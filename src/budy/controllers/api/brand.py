@@ -39,15 +39,14 @@ class BrandAPIController(root.RootAPIController):
     @appier.route("/api/brands", "GET", json=True)
     def list(self):
         object = appier.get_object(alias=True, find=True)
-        brands = budy.Brand.find_e(eager=("images",), map=True, **object)
-        return brands
+        return self.catalog_cached(
+            lambda: budy.Brand.find_e(eager=("images",), map=True, **object)
+        )
 
     @appier.route("/api/brands/<int:id>", "GET", json=True)
     def show(self, id):
-        brand = budy.Brand.get_e(id=id, map=True)
-        return brand
+        return self.catalog_cached(lambda: budy.Brand.get_e(id=id, map=True))
 
     @appier.route("/api/brands/slug/<str:slug>", "GET", json=True)
     def slug(self, slug):
-        brand = budy.Brand.get_e(slug=slug, map=True)
-        return brand
+        return self.catalog_cached(lambda: budy.Brand.get_e(slug=slug, map=True))
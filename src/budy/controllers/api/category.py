@@ -39,15 +39,14 @@ class CategoryAPIController(root.RootAPIController):
     @appier.route("/api/categories", "GET", json=True)
     def list(self):
         object = appier.get_object(alias=True, find=True)
-        categories = budy.Category.find_e(eager=("images",), map=True, **object)
-        return categories
+        return self.catalog_cached(
+            lambda: budy.Category.find_e(eager=("images",), map=True, **object)
+        )
 
     @appier.route("/api/categories/<int:id>", "GET", json=True)
     def show(self, id):
-        category = budy.Category.get_e(id=id, map=True)
-        return category
+        return self.catalog_cached(lambda: budy.Category.get_e(id=id, map=True))
 
     @appier.route("/api/categories/slug/<str:slug>", "GET", json=True)
     def slug(self, slug):
-        category = budy.Category.get_e(slug=slug, map=True)
-        return category
+        return self.catalog_cached(lambda: budy.Category.get_e(slug=slug, map=True))
@@ -39,15 +39,14 @@ class CollectionAPIController(root.RootAPIController):
     @appier.route("/api/collections", "GET", json=True)
     def list(self):
         object = appier.get_object(alias=True, find=True)
-        collections = budy.Collection.find_e(eager=("images",), map=True, **object)
-        return collections
+        return self.catalog_cached(
+            lambda: budy.Collection.find_e(eager=("images",), map=True, **object)
+        )
 
     @appier.route("/api/collections/<int:id>", "GET", json=True)
     def show(self, id):
-        collection = budy.Collection.get_e(id=id, map=True)
-        return collection
+        return self.catalog_cached(lambda: budy.Collection.get_e(id=id, map=True))
 
     @appier.route("/api/collections/slug/<str:slug>", "GET", json=True)
     def slug(self, slug):
-        collection = budy.Collection.get_e(slug=slug, map=True)
-        return collection
+        return self.catalog_cached(lambda: budy.Collection.get_e(slug=slug, map=True))
@@ -39,15 +39,14 @@ class ColorAPIController(root.RootAPIController):
     @appier.route("/api/colors", "GET", json=True)
     def list(self):
         object = appier.get_object(alias=True, find=True)
-        colors = budy.Color.find_e(eager=("images",), map=True, **object)
-        return colors
+        return self.catalog_cached(
+            lambda: budy.Color.find_e(eager=("images",), map=True, **object)
+        )
 
     @appier.route("/api/colors/<int:id>", "GET", json=True)
     def show(self, id):
-        color = budy.Color.get_e(id=id, map=True)
-        return color
+        return self.catalog_cached(lambda: budy.Color.get_e(id=id, map=True))
 
     @appier.route("/api/colors/slug/<str:slug>", "GET", json=True)
     def slug(self, slug):
-        color = budy.Color.get_e(slug=slug, map=True)
-        return color
+        return self.catalog_cached(lambda: budy.Color.get_e(slug=slug, map=True))
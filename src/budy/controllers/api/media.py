@@ -62,7 +62,7 @@ class MediaAPIController(root.RootAPIController):
     def data_format(self, id, format):
         background = self.field("background", None)
         quality = self.field("quality", 90, cast=int)
-        media = budy.Media.get(id=id, fields=("file",), rules=False)
+        media = budy.Media.get(id=id, fields=("id", "file"), rules=False)
         file = media.file
         if not file:
             raise appier.NotFoundError(message="File not found for media '%d'" % id)
@@ -76,11 +76,9 @@ class MediaAPIController(root.RootAPIController):
                 etag=file.etag,
                 cache=True,
             )
-        buffer = media.convert_image(
-            format, background=background, **dict(quality=quality)
-        )
+        data = media.get_rendition(format, quality=quality, background=background)
         return self.send_file(
-            buffer.getvalue(),
+            data,
             name="%d.%s" % (id, format),
             content_type=mime,
             etag=file.etag,
@@ -49,6 +49,7 @@ class OrderAPIController(root.RootAPIController):
     @appier.ensure(token="admin")
     def report(self, id):
         order = budy.Order.get(id=id)
+        budy.Order.prefetch([order], ("lines", "lines.product"))
         lines = sorted(order.lines, key=lambda line: line.product.sku or "")
         rows = []
         for line in lines:
@@ -93,83 +94,7 @@ class OrderAPIController(root.RootAPIController):
             object["id"] = id
         if paid:
             object["paid"] = True
-        orders = budy.Order.find(**object)
-        orders_s = [
-            (
-                "id",
-                "reference",
-                "date",
-                "status",
-                "email",
-                "account",
-                "store",
-                "product",
-                "gender",
-                "size",
-                "quantity",
-                "total",
-                "taxes",
-                "currency",
-                "first_name",
-                "last_name",
-                "billing_address",
-                "billing_city",
-                "billing_state",
-                "billing_postal_code",
-                "billing_country",
-                "billing_phone",
-                "shipping_address",
-                "shipping_city",
-                "shipping_state",
-                "shipping_postal_code",
-                "shipping_country",
-                "shipping_phone",
-                "shipping_cost",
-            )
-        ]
-        for order in orders:
-            for line in order.lines:
-                if not line.product:
-                    continue
-                account = order.account
-                shipping_address = order.shipping_address
-                billing_address = order.billing_address
-                shipping_cost = order.shipping_cost
-                order_s = (
-                    order.id,
-                    order.reference,
-                    order.created_d.strftime("%d/%m/%Y"),
-                    order.status,
-                    order.email,
-                    account.username,
-                    order.store and order.store.name,
-                    line.product.short_description,
-                    line.product.gender,
-                    line.size,
-                    line.quantity,
-                    line.total,
-                    line.taxes,
-                    line.currency,
-                    billing_address.first_name,
-                    billing_address.last_name,
-                    billing_address.address,
-                    billing_address.city,
-                    billing_address.state,
-                    billing_address.postal_code,
-                    billing_address.country,
-                    billing_address.phone_number,
-                    shipping_address and shipping_address.address,
-                    shipping_address and shipping_address.city,
-                    shipping_address and shipping_address.state,
-                    shipping_address and shipping_address.postal_code,
-                    shipping_address and shipping_address.country,
-                    shipping_address and shipping_address.phone_number,
-                    shipping_cost,
-                )
-                orders_s.append(order_s)
-        result = appier.serialize_csv(orders_s, delimiter=",")
-        self.content_type("text/csv")
-        return result
+        return self.stream_csv(self._complex_rows(object), delimiter=",")
 
     @appier.route("/api/orders/ctt.csv", "GET")
     @appier.ensure(token="admin")
@@ -190,96 +115,15 @@ class OrderAPIController(root.RootAPIController):
             object["id"] = id
         if paid:
             object["paid"] = True
-        orders = self.admin_part._find_view(budy.Order, **object)
-        orders_s = []
-        for order in orders:
-            shipping_address = order.shipping_address
-            postal_code = shipping_address.postal_code or ""
-            if not "-" in postal_code:
-                postal_code += "-"
-            weight_s = "%.2f" % (order.quantity * weight)
-            weight_s = weight_s.replace(".", ",")
-            line = dict(
-                reference=order.reference,
-                quantity=int(order.quantity) if quantity == None else quantity,
-                weight=weight_s,
-                price="0ue",
-                destiny=shipping_address.full_name[:60],
-                title=order.account.title[:20],
-                name=shipping_address.full_name[:60],
-                address=shipping_address.address[:60],
-                town=shipping_address.city[:50],
-                zip_code_4=postal_code.split("-", 1)[0][:4],
-                zip_code_3=postal_code.split("-", 1)[1][:3],
-                not_applicable_1="",
-                observations="",
-                back=0,
-                document_code="",
-                phone_number=(shipping_address.phone_number or "").replace("+", "00")[
-                    :15
-                ],
-                saturday=0,
-                email=(order.email or "")[:200],
-                country=order.country,
-                fragile=0,
-                not_applicable_2="",
-                document_collection="",
-                code_email="",
-                mobile_phone=(shipping_address.phone_number or "").replace("+", "00")[
-                    :15
-                ],
-                second_delivery=0,
-                delivery_date="",
-                return_signed_document=0,
-                expeditor_instructions=0,
-                sms=1 if sms else 0,
-                not_applicable_3="",
-                printer="",
-                ticket_machine="",
-                at_code="",
-            )
-            order_s = (
-                line["reference"],
-                str(line["quantity"]),
-                line["weight"],
-                line["price"],
-                line["destiny"],
-                line["title"],
-                line["name"],
-                line["address"],
-                line["town"],
-                line["zip_code_4"],
-                line["zip_code_3"],
-                line["not_applicable_1"],
-                line["observations"],
-                str(line["back"]),
-                line["document_code"],
-                line["phone_number"],
-                str(line["saturday"]),
-                line["email"],
-                line["country"],
-                str(line["fragile"]),
-                line["not_applicable_2"],
-                line["document_collection"],
-                line["code_email"],
-                line["mobile_phone"],
-                str(line["second_delivery"]),
-                line["delivery_date"],
-                str(line["return_signed_document"]),
-                str(line["expeditor_instructions"]),
-                str(line["sms"]),
-                line["not_applicable_3"],
-                line["printer"],
-                line["ticket_machine"],
-                line["at_code"],
-            )
-            orders_s.append(order_s)
-        result = appier.serialize_csv(
-            orders_s, encoding="Cp1252", errors="ignore", delimiter="+"
+        object = self.admin_part._apply_view(
+            self.field("view", None), kwargs=object, cls=budy.Order
+        )
+        return self.stream_csv(
+            self._ctt_rows(object, sms=sms, quantity=quantity, weight=weight),
+            encoding="Cp1252",
+            errors="ignore",
+            delimiter="+",
         )
-        result = appier.legacy.bytes(result, encoding="Cp1252", errors="ignore")
-        self.content_type("text/csv")
-        return result
 
     @appier.route("/api/orders/inventory", "GET")
     @appier.ensure(token="admin")
@@ -301,6 +145,7 @@ class OrderAPIController(root.RootAPIController):
             object["paid"] = True
         orders = self.admin_part._find_view(budy.Order, **object)
         orders = sorted(orders, key=lambda order: order.id)
+        budy.Order.prefetch(orders, ("lines", "lines.product"))
         rows = []
         for order in orders:
             lines = sorted(order.lines, key=lambda line: line.product.sku or "")
@@ -383,6 +228,167 @@ class OrderAPIController(root.RootAPIController):
             ),
         )
 
+    def _complex_rows(self, object):
+        yield (
+            "id",
+            "reference",
+            "date",
+            "status",
+            "email",
+            "account",
+            "store",
+            "product",
+            "gender",
+            "size",
+            "quantity",
+            "total",
+            "taxes",
+            "currency",
+            "first_name",
+            "last_name",
+            "billing_address",
+            "billing_city",
+            "billing_state",
+            "billing_postal_code",
+            "billing_country",
+            "billing_phone",
+            "shipping_address",
+            "shipping_city",
+            "shipping_state",
+            "shipping_postal_code",
+            "shipping_country",
+            "shipping_phone",
+            "shipping_cost",
+        )
+        for orders in budy.Order.find_chunks(**object):
+            budy.Order.prefetch(orders)
+            for order in orders:
+                for line in order.lines:
+                    if not line.product:
+                        continue
+                    account = order.account
+                    shipping_address = order.shipping_address
+                    billing_address = order.billing_address
+                    shipping_cost = order.shipping_cost
+                    order_s = (
+                        order.id,
+                        order.reference,
+                        order.created_d.strftime("%d/%m/%Y"),
+                        order.status,
+                        order.email,
+                        account.username,
+                        order.store and order.store.name,
+                        line.product.short_description,
+                        line.product.gender,
+                        line.size,
+                        line.quantity,
+                        line.total,
+                        line.taxes,
+                        line.currency,
+                        billing_address.first_name,
+                        billing_address.last_name,
+                        billing_address.address,
+                        billing_address.city,
+                        billing_address.state,
+                        billing_address.postal_code,
+                        billing_address.country,
+                        billing_address.phone_number,
+                        shipping_address and shipping_address.address,
+                        shipping_address and shipping_address.city,
+                        shipping_address and shipping_address.state,
+                        shipping_address and shipping_address.postal_code,
+                        shipping_address and shipping_address.country,
+                        shipping_address and shipping_address.phone_number,
+                        shipping_cost,
+                    )
+                    yield order_s
+
+    def _ctt_rows(self, object, sms=False, quantity=1, weight=100):
+        for orders in budy.Order.find_chunks(**object):
+            budy.Order.prefetch(orders, ("account", "shipping_address"))
+            for order in orders:
+                shipping_address = order.shipping_address
+                postal_code = shipping_address.postal_code or ""
+                if not "-" in postal_code:
+                    postal_code += "-"
+                weight_s = "%.2f" % (order.quantity * weight)
+                weight_s = weight_s.replace(".", ",")
+                line = dict(
+                    reference=order.reference,
+                    quantity=int(order.quantity) if quantity == None else quantity,
+                    weight=weight_s,
+                    price="0ue",
+                    destiny=shipping_address.full_name[:60],
+                    title=order.account.title[:20],
+                    name=shipping_address.full_name[:60],
+                    address=shipping_address.address[:60],
+                    town=shipping_address.city[:50],
+                    zip_code_4=postal_code.split("-", 1)[0][:4],
+                    zip_code_3=postal_code.split("-", 1)[1][:3],
+                    not_applicable_1="",
+                    observations="",
+                    back=0,
+                    document_code="",
+                    phone_number=(shipping_address.phone_number or "").replace(
+                        "+", "00"
+                    )[:15],
+                    saturday=0,
+                    email=(order.email or "")[:200],
+                    country=order.country,
+                    fragile=0,
+                    not_applicable_2="",
+                    document_collection="",
+                    code_email="",
+                    mobile_phone=(shipping_address.phone_number or "").replace(
+                        "+", "00"
+                    )[:15],
+                    second_delivery=0,
+                    delivery_date="",
+                    return_signed_document=0,
+                    expeditor_instructions=0,
+                    sms=1 if sms else 0,
+                    not_applicable_3="",
+                    printer="",
+                    ticket_machine="",
+                    at_code="",
+                )
+                order_s = (
+                    line["reference"],
+                    str(line["quantity"]),
+                    line["weight"],
+                    line["price"],
+                    line["destiny"],
+                    line["title"],
+                    line["name"],
+                    line["address"],
+                    line["town"],
+                    line["zip_code_4"],
+                    line["zip_code_3"],
+                    line["not_applicable_1"],
+                    line["observations"],
+                    str(line["back"]),
+                    line["document_code"],
+                    line["phone_number"],
+                    str(line["saturday"]),
+                    line["email"],
+                    line["country"],
+                    str(line["fragile"]),
+                    line["not_applicable_2"],
+                    line["document_collection"],
+                    line["code_email"],
+                    line["mobile_phone"],
+                    str(line["second_delivery"]),
+                    line["delivery_date"],
+                    str(line["return_signed_document"]),
+                    str(line["expeditor_instructions"]),
+                    str(line["sms"]),
+                    line["not_applicable_3"],
+                    line["printer"],
+                    line["ticket_machine"],
+                    line["at_code"],
+                )
+                yield order_s
+
     def _format_quantity(self, quantity):
         quantity_int = int(quantity)
         if quantity_int == quantity:
@@ -603,25 +609,27 @@ class OrderAPIController(root.RootAPIController):
     @appier.ensure(token="admin")
     def lines_csv(self, key):
         order = budy.Order.get(key=key)
-        lines_s = [
-            (
-                "id",
-                "product",
-                "product_id",
-                "quantity",
-                "size",
-                "scale",
-                "gender",
-                "line_total",
-                "currency",
-                "order_id",
-                "order_reference",
-                "order_total",
-                "order_status",
-                "account",
-                "date",
-            )
-        ]
+        budy.Order.prefetch([order], ("lines", "lines.product", "account"))
+        return self.stream_csv(self._lines_rows(order), delimiter=",")
+
+    def _lines_rows(self, order):
+        yield (
+            "id",
+            "product",
+            "product_id",
+            "quantity",
+            "size",
+            "scale",
+            "gender",
+            "line_total",
+            "currency",
+            "order_id",
+            "order_reference",
+            "order_total",
+            "order_status",
+            "account",
+            "date",
+        )
         for line in order.lines:
             if not line.product:
                 continue
@@ -642,8 +650,4 @@ class OrderAPIController(root.RootAPIController):
                 order.account.username,
                 order.created_d.strftime("%d/%m/%Y"),
             )
-            lines_s.append(line_s)
-
-        result = appier.serialize_csv(lines_s, delimiter=",")
-        self.content_type("text/csv")
-        return result
+            yield line_s
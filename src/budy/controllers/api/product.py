@@ -39,27 +39,57 @@ class ProductAPIController(root.RootAPIController):
     @appier.route("/api/products", "GET", json=True)
     def list(self):
         object = appier.get_object(alias=True, find=True)
-        products = budy.Product.find_e(
-            find_t="right", eager=("images", "brand"), map=True, **object
+        return self.catalog_cached(
+            lambda: budy.Product.find_e(
+                find_t="right", eager=("images", "brand"), map=True, **object
+            )
+        )
+
+    @appier.route("/api/products/facets", "GET", json=True)
+    def facets(self):
+        object = appier.get_object(alias=True, find=True)
+        return self.catalog_cached(
+            lambda: budy.Product.facets(find_t="right", **object)
         )
-        return products
 
     @appier.route("/api/products/<int:id>", "GET", json=True)
     def show(self, id):
-        product = budy.Product.get_e(
-            id=id, eager=("images", "brand", "measurements"), map=True
+        return self.catalog_cached(
+            lambda: budy.Product.get_e(
+                id=id, eager=("images", "brand", "measurements"), map=True
+            )
         )
-        return product
 
     @appier.route("/api/products/search", "GET", json=True)
     def search(self):
         object = appier.get_object(alias=True, find=True)
-        products = budy.Product.find_se(
-            find_t="both",
-            find_n="tokens",
-            eager=("images", "brand"),
-            map=True,
-            **object
+        find_s = object.get("find_s", None)
+        if not find_s or not budy.Product.is_search_indexed():
+            products = budy.Product.find_se(
+                find_t="both",
+                find_n="tokens",
+                eager=("images", "brand"),
+                map=True,
+                **object
+            )
+            return products
+
+        # runs the search using the inverted index, obtaining the ids of
+        # the matching products sorted by relevance
+        operator = self.field("operator", "and")
+        ids = budy.Product.search_ids(find_s, operator=operator)
+
+        # retrieves the requested page of the enabled matching products that
+        # match the remaining filters of the request (as the non indexed
+        # search does), in the requested sort order or by relevance
+        kwargs = dict(
+            (name, value)
+            for name, value in object.items()
+            if not name in ("find_s", "find_t", "find_n", "find_i")
+        )
+        kwargs["enabled"] = True
+        products = budy.Product.find_ranked(
+            ids, eager=("images", "brand"), map=True, **kwargs
         )
         return products
 
@@ -67,9 +97,11 @@ class ProductAPIController(root.RootAPIController):
     def related(self, id):
         limit = self.field("limit", 10, cast=int)
         available = self.field("available", True, cast=bool)
-        product = budy.Product.get_e(id=id)
-        products = product.related(limit=limit, available=available, enabled=True)
-        return products
+        return self.catalog_cached(
+            lambda: budy.Product.get_e(id=id).related(
+                limit=limit, available=available, enabled=True
+            )
+        )
 
     @appier.route("/api/products/<int:id>/share", "GET", json=True)
     def share(self, id):
@@ -95,71 +127,72 @@ class ProductAPIController(root.RootAPIController):
     @appier.ensure(token="admin")
     def simple_csv(self):
         object = appier.get_object(alias=True, find=True, limit=0)
-        products = budy.Product.find_e(
-            eager=(
-                "colors",
-                "categories",
-                "collections",
-                "variants",
-                "brand",
-                "season",
-                "measurements",
-                "compositions",
-            ),
-            **object
+        return self.stream_csv(self._simple_rows(object), delimiter=",")
+
+    def _simple_rows(self, object):
+        yield (
+            "description",
+            "short_description",
+            "product_id",
+            "gender",
+            "price",
+            "order",
+            "tag",
+            "tag_description",
+            "farfetch_url",
+            "farfetch_male_url",
+            "farfetch_female_url",
+            "colors",
+            "categories",
+            "collections",
+            "variants",
+            "brand",
+            "season",
+            "measurements",
+            "compositions",
+            "price_provider",
+            "price_url",
         )
-
-        products_s = [
-            (
-                "description",
-                "short_description",
-                "product_id",
-                "gender",
-                "price",
-                "order",
-                "tag",
-                "tag_description",
-                "farfetch_url",
-                "farfetch_male_url",
-                "farfetch_female_url",
-                "colors",
-                "categories",
-                "collections",
-                "variants",
-                "brand",
-                "season",
-                "measurements",
-                "compositions",
-                "price_provider",
-                "price_url",
-            )
-        ]
-        for product in products:
-            product_s = (
-                product.description,
-                product.short_description,
-                product.product_id,
-                product.gender,
-                product.price,
-                product.order,
-                product.tag,
-                product.tag_description,
-                product.farfetch_url,
-                product.farfetch_male_url,
-                product.farfetch_female_url,
-                ";".join([color.name for color in product.colors]),
-                ";".join([category.name for category in product.categories]),
-                ";".join([collection.name for collection in product.collections]),
-                ";".join([variant.product_id for variant in product.variants]),
-                product.brand.name if product.brand else None,
-                product.season.name if product.season else None,
-                ";".join([measurement.name for measurement in product.measurements]),
-                ";".join([composition.name for composition in product.compositions]),
-                product.price_provider,
-                product.price_url,
+        for products in budy.Product.find_chunks(enabled=True, **object):
+            budy.Product.prefetch(
+                products,
+                (
+                    "colors",
+                    "categories",
+                    "collections",
+                    "variants",
+                    "brand",
+                    "season",
+                    "measurements",
+                    "compositions",
+                ),
             )
-            products_s.append(product_s)
-
-        result = appier.serialize_csv(products_s, delimiter=",")
-        self.content_type("text/csv")
-        return result
+            for product in products:
+                product_s = (
+                    product.description,
+                    product.short_description,
+                    product.product_id,
+                    product.gender,
+                    product.price,
+                    product.order,
+                    product.tag,
+                    product.tag_description,
+                    product.farfetch_url,
+                    product.farfetch_male_url,
+                    product.farfetch_female_url,
+                    ";".join([color.name for color in product.colors]),
+                    ";".join([category.name for category in product.categories]),
+                    ";".join([collection.name for collection in product.collections]),
+                    ";".join([variant.product_id for variant in product.variants]),
+                    product.brand.name if product.brand else None,
+                    product.season.name if product.season else None,
+                    ";".join(
+                        [measurement.name for measurement in product.measurements]
+                    ),
+                    ";".join(
+                        [composition.name for composition in product.compositions]
+                    ),
+                    product.price_provider,
+                    product.price_url,
+                )
+                yield product_s
@@ -28,10 +28,33 @@ __copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
 __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
+import csv
+import json
+import hashlib
+import threading
+
 import appier
 
+import budy
+
+CSV_BUFFER = 65536
+""" The size (in bytes) of the buffer that is going to be
+used when streaming CSV contents, each flushed buffer is
+sent as a chunk of the response """
+
+RESPONSES_SIZE = 1024
+""" The maximum number of catalog responses kept in the process
+local cache, once reached the cache is cleared and rebuilt """
+
 
 class RootAPIController(appier.Controller):
+    _responses = dict()
+    """ The process local cache of the serialized catalog responses
+    indexed by their (strong) ETag value """
+
+    _responses_lock = threading.RLock()
+    """ The lock that controls the access to the responses cache """
+
     @property
     def country(self):
         return self.request.get_header("X-Budy-Country", None)
@@ -39,3 +62,115 @@ class RootAPIController(appier.Controller):
     @property
     def currency(self):
         return self.request.get_header("X-Budy-Currency", None)
+
+    def catalog_cached(self, builder):
+        """
+        Runs a (read only) catalog request through the response cache,
+        keyed by the route, the query, the country and currency headers
+        and the generation of the catalog (changed by catalog saves).
+
+        The key is used to build a strong ETag so that a request with a
+        matching `If-None-Match` header is answered with a 304 without
+        any data source access (except for the catalog generation).
+
+        :type builder: Function
+        :param builder: The function to be called (without arguments)
+        to build the JSON serializable response in case it's not cached.
+        :rtype: String
+        :return: The serialized JSON response or an empty string in case
+        the client's version is still valid (not modified).
+        """
+
+        cls = self.__class__
+        params = sorted(
+            (name, sorted(value) if isinstance(value, list) else value)
+            for name, value in self.request.params.items()
+        )
+        key = json.dumps(
+            [
+                self.request.path,
+                params,
+                self.country,
+                self.currency,
+                budy.BudyBase.get_catalog(),
+            ]
+        )
+        etag = '"%s"' % hashlib.sha1(appier.legacy.bytes(key)).hexdigest()
+
+        self.request.set_header("Cache-Control", "no-cache, must-revalidate")
+        etags = self.request.get_header("If-None-Match", None) or ""
+        if etag in [value.strip() for value in etags.split(",")]:
+            self.request.set_header("Etag", etag)
+            self.request.set_code(304)
+            return ""
+
+        with cls._responses_lock:
+            data = cls._responses.get(etag, None)
+        if data == None:
+            data = json.dumps(builder())
+            with cls._responses_lock:
+                if len(cls._responses) >= RESPONSES_SIZE:
+                    cls._responses.clear()
+                cls._responses[etag] = data
+
+        self.request.set_header("Etag", etag)
+        self.content_type("application/json")
+        return data
+
+    def stream_csv(
+        self, rows, encoding="utf-8", errors="strict", delimiter=",", size=CSV_BUFFER
+    ):
+        """
+        Builds a generator that streams the provided rows (sequences)
+        as CSV contents, sending a chunk of the response each time the
+        underlying buffer reaches the provided size.
+
+        The rows should be provided as an iterable (eg: generator) so
+        that the complete set of rows is never held in memory.
+
+        :type rows: Iterable
+        :param rows: The iterable of rows (sequences of values) that are
+        going to be serialized, the first one should be the header.
+        :type encoding: String
+        :param encoding: The encoding to be used in the contents.
+        :type errors: String
+        :param errors: The strategy for encoding errors.
+        :type delimiter: String
+        :param delimiter: The delimiter of the CSV values.
+        :type size: int
+        :param size: The size (in bytes) of the buffer to be used.
+        :rtype: Generator
+        :return: The generator of the chunks of the response, compatible
+        with the appier generator protocol (unknown size first).
+        """
+
+        encoder = appier.build_encoder(encoding, errors=errors)
+
+        def generator():
+            yield -1
+            buffer = appier.legacy.StringIO()
+            writer = csv.writer(buffer, delimiter=delimiter)
+            for row in rows:
+                writer.writerow(
+                    [
+                        (
+                            encoder(value)
+                            if type(value) == appier.legacy.UNICODE
+                            else value
+                        )
+                        for value in row
+                    ]
+                )
+                if buffer.tell() < size:
+                    continue
+                yield appier.legacy.bytes(
+                    buffer.getvalue(), encoding=encoding, errors=errors
+                )
+                buffer.seek(0)
+                buffer.truncate()
+            data = buffer.getvalue()
+            if data:
+                yield appier.legacy.bytes(data, encoding=encoding, errors=errors)
+
+        self.content_type("text/csv")
+        return generator()
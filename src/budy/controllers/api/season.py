@@ -39,15 +39,14 @@ class SeasonAPIController(root.RootAPIController):
     @appier.route("/api/seasons", "GET", json=True)
     def list(self):
         object = appier.get_object(alias=True, find=True)
-        seasons = budy.Season.find_e(eager=("images",), map=True, **object)
-        return seasons
+        return self.catalog_cached(
+            lambda: budy.Season.find_e(eager=("images",), map=True, **object)
+        )
 
     @appier.route("/api/seasons/<int:id>", "GET", json=True)
     def show(self, id):
-        season = budy.Season.get_e(id=id, map=True)
-        return season
+        return self.catalog_cached(lambda: budy.Season.get_e(id=id, map=True))
 
     @appier.route("/api/seasons/slug/<str:slug>", "GET", json=True)
     def slug(self, slug):
-        season = budy.Season.get_e(slug=slug, map=True)
-        return season
+        return self.catalog_cached(lambda: budy.Season.get_e(slug=slug, map=True))
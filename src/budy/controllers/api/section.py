@@ -39,15 +39,14 @@ class SectionAPIController(root.RootAPIController):
     @appier.route("/api/sections", "GET", json=True)
     def list(self):
         object = appier.get_object(alias=True, find=True)
-        sections = budy.Section.find_e(eager=("images",), map=True, **object)
-        return sections
+        return self.catalog_cached(
+            lambda: budy.Section.find_e(eager=("images",), map=True, **object)
+        )
 
     @appier.route("/api/sections/<int:id>", "GET", json=True)
     def show(self, id):
-        section = budy.Section.get_e(id=id, map=True)
-        return section
+        return self.catalog_cached(lambda: budy.Section.get_e(id=id, map=True))
 
     @appier.route("/api/sections/slug/<str:slug>", "GET", json=True)
     def slug(self, slug):
-        section = budy.Section.get_e(slug=slug, map=True)
-        return section
+        return self.catalog_cached(lambda: budy.Section.get_e(slug=slug, map=True))
@@ -72,8 +72,13 @@ class BudyApp(appier.WebApp):
         if easypay:
             easypay.ShelveAPI.cleanup()
             easypay.ShelveAPIv2.cleanup()
+        self.scheduler.stop()
         appier.WebApp.stop(self)
 
+    def unload(self, *args, **kwargs):
+        self.scheduler.destroy()
+        appier.WebApp.unload(self, *args, **kwargs)
+
     def get_omni_api(self):
         import omni
 
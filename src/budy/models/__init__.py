@@ -41,6 +41,7 @@ from . import country
 from . import currency
 from . import exchange_rate
 from . import group
+from . import job_run
 from . import live_model
 from . import measurement
 from . import media
@@ -48,6 +49,7 @@ from . import order_line
 from . import order
 from . import product
 from . import referral
+from . import reservation
 from . import season
 from . import section
 from . import store
@@ -72,6 +74,7 @@ from .country import Country
 from .currency import Currency
 from .exchange_rate import ExchangeRate
 from .group import Group
+from .job_run import JobRun
 from .live_model import LiveModel
 from .measurement import Measurement
 from .media import Media
@@ -79,6 +82,7 @@ from .order_line import OrderLine
 from .order import Order
 from .product import Product
 from .referral import Referral
+from .reservation import Reservation
 from .season import Season
 from .section import Section
 from .store import Store
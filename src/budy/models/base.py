@@ -28,9 +28,31 @@ __copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
 __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
+import re
+import time
+import threading
+
 import appier
 import appier_extras
 
+CACHE_INTERVAL = 1.0
+""" The default minimum amount of time (in seconds) between checks
+of the (shared) cache generation of a model in the data source, this
+is the maximum staleness of the cache for the other processes """
+
+BATCH_INTERVAL = 60.0
+""" The default maximum amount of time (in seconds) the invalidations
+of the caches (and of the catalog) are deferred while running a batch
+of changes (eg: an Omni sync), after which the pending ones are run """
+
+CACHE_SIZE = 4096
+""" The maximum number of values kept in the (process local) cache,
+once this value is reached the stale values are removed from it """
+
+RANKED_CHUNK = 256
+""" The minimum number of ranked ids (eg: search results) that are
+filtered per query while filling a page of ranked entities """
+
 
 class BudyBase(appier_extras.admin.Base):
     slug = appier.field(index="hashed", safe=True)
@@ -39,6 +61,19 @@ class BudyBase(appier_extras.admin.Base):
 
     tokens = appier.field(index="hashed", safe=True)
 
+    _batch = threading.local()
+    """ The (thread local) state of the batches of changes running in
+    the current thread, with the number of nested batches, the pending
+    invalidations and the time of the last run of the pending ones """
+
+    @classmethod
+    def setup(cls):
+        super(BudyBase, cls).setup()
+        if not cls.is_searchable():
+            return
+        store = cls._collection(name="postings")
+        store.ensure_index("ids", direction=1)
+
     @classmethod
     def is_abstract(cls):
         return True
@@ -47,6 +82,22 @@ class BudyBase(appier_extras.admin.Base):
     def token_names(cls):
         return []
 
+    @classmethod
+    def prefetch_names(cls):
+        return []
+
+    @classmethod
+    def is_cached(cls):
+        return False
+
+    @classmethod
+    def is_catalog(cls):
+        return False
+
+    @classmethod
+    def is_searchable(cls):
+        return False
+
     @classmethod
     def find_s(cls, *args, **kwargs):
         find_s = kwargs.get("find_s", None)
@@ -61,6 +112,635 @@ class BudyBase(appier_extras.admin.Base):
             kwargs["find_s"] = cls._simplify(find_s)
         return cls.find_e(*args, **kwargs)
 
+    @classmethod
+    def find_chunks(cls, *args, **kwargs):
+        """
+        Iterates over the results of a find operation in chunks (lists)
+        of the provided size, so that the complete set of results never
+        has to be loaded in memory at the same time.
+
+        For Mongo and when sorting only by the id, the pagination is
+        made using the last id of the previous chunk (no skip penalty)
+        otherwise the typical skip and limit pagination is used.
+
+        The skip and limit values of the find operation are honoured,
+        skipping the first results and limiting the total number of
+        results (zero meaning no limit), the size must be provided as
+        a keyword argument.
+
+        :type size: int
+        :param size: The maximum number of models per chunk.
+        :rtype: Generator
+        :return: The generator that yields the lists of models.
+        """
+
+        size = kwargs.pop("size", 100)
+        skip = kwargs.pop("skip", None) or 0
+        limit = kwargs.pop("limit", None) or 0
+        sort = list(kwargs.pop("sort", None) or [("id", 1)])
+        name, direction = sort[0]
+        id = kwargs.get("id", None)
+        keyset = cls._is_mongo() and len(sort) == 1 and name == "id"
+        keyset = keyset and (id == None or isinstance(id, dict))
+
+        offset = skip
+        count = 0
+        last = None
+
+        while True:
+            _size = min(size, limit - count) if limit else size
+            if _size <= 0:
+                break
+            _kwargs = dict(kwargs)
+            if keyset and not last == None:
+                _id = dict(id or dict())
+                _id["$lt" if direction == -1 else "$gt"] = last
+                _kwargs["id"] = _id
+            models = cls.find(
+                skip=0 if keyset and not last == None else offset,
+                limit=_size,
+                sort=list(sort),
+                *args,
+                **_kwargs
+            )
+            if not models:
+                break
+            yield models
+            count += len(models)
+            if len(models) < _size:
+                break
+            offset += len(models)
+            last = models[-1]["id"] if isinstance(models[-1], dict) else models[-1].id
+
+    @classmethod
+    def prefetch(cls, models, names=None):
+        """
+        Resolves the references with the provided (dot separated) names
+        for the complete set of models, using a single query per name
+        and target model instead of one query per reference.
+
+        The references that are not resolved by the batch query (eg: the
+        adapter does not support the operator) are resolved normally.
+
+        :type models: List
+        :param models: The list of models for which the references are
+        going to be resolved.
+        :type names: List
+        :param names: The dot separated paths of the references to be
+        resolved (eg: lines.product), if not provided the default ones
+        for the model (prefetch names) are used.
+        :rtype: List
+        :return: The same list of models with references resolved.
+        """
+
+        names = cls.prefetch_names() if names == None else names
+        for name in names:
+            values = models
+            for part in name.split("."):
+                values = cls._prefetch(values, part)
+                if not values:
+                    break
+        return models
+
+    @classmethod
+    def search_ids(cls, query, operator="and", prefix=True):
+        """
+        Runs a search for the provided query using the inverted index
+        of tokens (postings collection), each term of the query matches
+        the indexed terms that start with it (in case prefix is set).
+
+        The resulting ids are ordered by relevance, meaning the number
+        of query terms matched, then the number of exact matches and
+        finally the order value of the entity (if defined).
+
+        :type query: String
+        :param query: The free text query to be searched.
+        :type operator: String
+        :param operator: The logical operator to be applied among the
+        query terms, either "and" (all terms) or "or" (any term).
+        :type prefix: bool
+        :param prefix: If the query terms should be matched as prefixes
+        of the indexed terms (autocomplete) instead of exact matches.
+        :rtype: List
+        :return: The ordered list of the ids of the matching entities.
+        """
+
+        terms = cls._get_terms(query)
+        if not terms:
+            return []
+
+        # iterates over the complete set of query terms gathering the
+        # posting lists of the matching indexed terms, counting for each
+        # entity the query terms and the exact terms matched
+        matches = dict()
+        exacts = dict()
+        for index, term in enumerate(terms):
+            for posting in cls._find_postings(term, prefix=prefix):
+                exact = posting["_id"] == cls._name() + ":" + term
+                for _id in posting.get("ids", []):
+                    matches.setdefault(_id, set()).add(index)
+                    if not exact:
+                        continue
+                    exacts[_id] = exacts.get(_id, 0) + 1
+
+        # filters the matched entities according to the operator and then
+        # sorts them by relevance (using the order field as tie breaker)
+        ids = [
+            _id
+            for _id, _matches in matches.items()
+            if operator == "or" or len(_matches) == len(terms)
+        ]
+        orders = cls._get_orders(ids)
+        ids.sort(
+            key=lambda _id: (
+                -len(matches[_id]),
+                -exacts.get(_id, 0),
+                orders.get(_id, None) == None,
+                orders.get(_id, None) or 0,
+                _id,
+            )
+        )
+        return ids
+
+    @classmethod
+    def find_ids(cls, ids, *args, **kwargs):
+        """
+        Retrieves the entities with the provided ids, keeping the order
+        of the ids in the result, using a single query for any adapter
+        (see `_find_in()`).
+
+        :type ids: List
+        :param ids: The ordered list of ids of the entities to retrieve.
+        :rtype: List
+        :return: The entities with the provided ids (and matching the
+        remaining filters) in the same order as the ids.
+        """
+
+        if not ids:
+            return []
+        entities = cls._find_in(cls, "id", ids, *args, **kwargs)
+        positions = dict((_id, index) for index, _id in enumerate(ids))
+        entities.sort(
+            key=lambda entity: positions.get(
+                entity["id"] if isinstance(entity, dict) else entity.id, 0
+            )
+        )
+        return entities
+
+    @classmethod
+    def find_ranked(cls, ids, sort=None, skip=0, limit=0, *args, **kwargs):
+        """
+        Retrieves a page of the entities with the provided (ranked) ids
+        that match the remaining filters, in the order of the ids or in
+        the provided sort order (if any).
+
+        With a sort the database sorts and paginates the entities with
+        the ids in a single query. Otherwise the ids are filtered in
+        chunks (ids only queries) until the page is filled, so that only
+        the ids up to the requested page are queried.
+
+        :type ids: List
+        :param ids: The ranked list of ids of the entities.
+        :type sort: List
+        :param sort: The sort to be used instead of the rank order.
+        :type skip: int
+        :param skip: The number of (matching) entities to be skipped.
+        :type limit: int
+        :param limit: The maximum number of entities to be retrieved.
+        :rtype: List
+        :return: The page of matching entities in the rank order or in
+        the sort order (if provided).
+        """
+
+        if not ids:
+            return []
+        if sort:
+            return cls._find_in(
+                cls, "id", ids, sort=sort, skip=skip, limit=limit, *args, **kwargs
+            )
+
+        # filters the ranked ids in chunks, retrieving only the ids of the
+        # matching entities, until enough of them are found for the page
+        count = skip + limit if limit else None
+        size = max(count or 0, RANKED_CHUNK)
+        _kwargs = dict(kwargs, fields=("id",), eager=None, map=True, build=False)
+        matched = []
+        for index in range(0, len(ids), size):
+            entities = cls.find_ids(ids[index : index + size], *args, **_kwargs)
+            matched.extend(entity["id"] for entity in entities)
+            if count and len(matched) >= count:
+                break
+
+        # retrieves the entities of the page, keeping the rank order
+        matched = matched[skip:count]
+        return cls.find_ids(matched, *args, **kwargs)
+
+    @classmethod
+    def index_search(cls):
+        """
+        Rebuilds the complete inverted index of tokens for the model,
+        marking the index as complete so that it starts being used for
+        search operations (see `is_search_indexed()`).
+        """
+
+        # iterates over the complete set of entities in chunks and builds
+        # the posting lists (term to ids) in memory
+        postings = dict()
+        for entities in cls.find_chunks():
+            for entity in entities:
+                tokens = entity.tokens if hasattr(entity, "tokens") else None
+                for term in cls._get_terms(tokens):
+                    postings.setdefault(term, []).append(entity.id)
+
+        # removes the previous posting lists of the model and inserts the
+        # new ones, marking the index as complete at the end
+        store = cls._collection(name="postings")
+        prefix = cls._name() + ":"
+        for posting in cls._find_postings(""):
+            store.remove({"_id": posting["_id"]})
+        for term, ids in postings.items():
+            store.insert(dict(_id=prefix + term, ids=ids))
+        cls._ensure_min("search", 1)
+
+    @classmethod
+    def is_search_indexed(cls):
+        return True if cls._get_counter("search", 0) else False
+
+    @classmethod
+    def get_cached(cls, name, builder, ttl=None, app=None):
+        """
+        Retrieves the value with the provided name from the process
+        local cache of the model, building it (using the builder) in
+        case it does not exist, it has expired or the generation of the
+        model has changed meanwhile.
+
+        The generation is a counter shared by all the processes (stored
+        in the data source) that is incremented whenever an entity of a
+        cached model is saved or deleted, ensuring coherence among them.
+
+        :type name: String
+        :param name: The name of the value to be retrieved from cache.
+        :type builder: Function
+        :param builder: The function to be called (without arguments)
+        to build the value in case it's not cached or it's stale.
+        :type ttl: float
+        :param ttl: The maximum amount of time (in seconds) the value
+        is kept in cache, regardless of the generation.
+        :type app: App
+        :param app: The app instance that holds the cache, if not
+        provided the current global app is used.
+        :rtype: Object
+        :return: The cached (or freshly built) value.
+        """
+
+        app = app or appier.get_app()
+        caches = cls._get_caches(app)
+        key = cls._name() + ":" + name
+        generation = cls.get_generation(app=app)
+        cache = caches.get(key, None)
+        if (
+            cache
+            and cache["generation"] == generation
+            and (not cache["expiration"] or cache["expiration"] > time.time())
+        ):
+            return cache["value"]
+        value = builder()
+        if len(caches) >= CACHE_SIZE:
+            cls._prune_cached(caches, generation)
+        caches[key] = dict(
+            value=value,
+            generation=generation,
+            expiration=time.time() + ttl if ttl else None,
+        )
+        return value
+
+    @classmethod
+    def get_generation(cls, app=None):
+        app = app or appier.get_app()
+        generations = cls._get_generations(app)
+        generation = generations.get(cls._name(), None)
+        if generation and generation[1] > time.time():
+            return generation[0]
+        value = cls._get_counter("generation", 0)
+        generations[cls._name()] = (value, time.time() + cls._cache_interval())
+        return value
+
+    @classmethod
+    def get_catalog(cls, app=None):
+        """
+        Retrieves the generation of the catalog, a counter shared by
+        all the processes (stored in the data source) that is incremented
+        whenever an entity of a catalog model (eg: product, group) changes.
+
+        The value is only read from the data source once per cache interval,
+        so it may be used to validate cached catalog responses cheaply.
+
+        :type app: App
+        :param app: The app instance that holds the local copy of the
+        generation, if not provided the current global app is used.
+        :rtype: int
+        :return: The current generation of the catalog.
+        """
+
+        app = app or appier.get_app()
+        generations = cls._get_generations(app)
+        generation = generations.get("catalog", None)
+        if generation and generation[1] > time.time():
+            return generation[0]
+        value = BudyBase._get_counter("catalog", 0)
+        generations["catalog"] = (value, time.time() + cls._cache_interval())
+        return value
+
+    @classmethod
+    def begin_batch(cls):
+        """
+        Starts a batch of changes (eg: a phase of the Omni sync) in the
+        process, during which the invalidations of the caches and of the
+        catalog are deferred, running once at the end of the batch (or
+        periodically for long batches) instead of once per saved entity.
+
+        Only the invalidations triggered by the current thread are
+        deferred, the other threads (eg: request handlers) are not
+        affected by the batch.
+
+        Every call must be paired with a call to `end_batch()`.
+        """
+
+        batch = BudyBase._get_batch()
+        if not batch["depth"]:
+            batch["flushed"] = time.time()
+        batch["depth"] += 1
+
+    @classmethod
+    def end_batch(cls):
+        batch = BudyBase._get_batch()
+        batch["depth"] -= 1
+        if batch["depth"]:
+            return
+        BudyBase._flush_batch()
+
+    @classmethod
+    def invalidate_catalog(cls, app=None, force=False):
+        if not force and cls._defer("catalog", BudyBase):
+            return
+        app = app or appier.get_app()
+        value = BudyBase._increment("catalog")
+        generations = cls._get_generations(app)
+        generations["catalog"] = (value, time.time() + cls._cache_interval())
+
+    @classmethod
+    def clear_cached(cls, app=None):
+        app = app or appier.get_app()
+        caches = cls._get_caches(app)
+        generations = cls._get_generations(app)
+        prefix = cls._name() + ":"
+        for key in list(caches.keys()):
+            if not key.startswith(prefix):
+                continue
+            del caches[key]
+        generations.pop(cls._name(), None)
+
+    @classmethod
+    def invalidate_cached(cls, app=None, force=False):
+        if not force and cls._defer("cached:" + cls._name(), cls):
+            return
+        app = app or appier.get_app()
+        cls.clear_cached(app=app)
+        value = cls._increment("generation")
+        generations = cls._get_generations(app)
+        generations[cls._name()] = (value, time.time() + cls._cache_interval())
+
+    @classmethod
+    def _defer(cls, name, target):
+        # registers the invalidation as pending in case there's a batch of
+        # changes running, running the pending ones in case they have been
+        # deferred for too long, returns if the invalidation was deferred
+        interval = appier.conf("BUDY_BATCH_INTERVAL", BATCH_INTERVAL, cast=float)
+        batch = BudyBase._get_batch()
+        if not batch["depth"]:
+            return False
+        batch["pending"][name] = target
+        if time.time() - batch["flushed"] >= interval:
+            BudyBase._flush_batch()
+        return True
+
+    @classmethod
+    def _flush_batch(cls):
+        batch = BudyBase._get_batch()
+        pending = batch["pending"]
+        batch["pending"] = dict()
+        batch["flushed"] = time.time()
+        for name, target in pending.items():
+            if name == "catalog":
+                target.invalidate_catalog(force=True)
+            else:
+                target.invalidate_cached(force=True)
+
+    @classmethod
+    def _get_batch(cls):
+        # retrieves the state of the batches of the current thread, creating
+        # it in case this is the first access to it from the thread
+        state = getattr(BudyBase._batch, "state", None)
+        if state == None:
+            state = dict(depth=0, pending=dict(), flushed=0.0)
+            BudyBase._batch.state = state
+        return state
+
+    @classmethod
+    def _prune_cached(cls, caches, generation):
+        # removes the expired values and the ones of the model that are
+        # from a previous generation, in case that's not enough the values
+        # of the model are all removed (keeps the cache bounded)
+        prefix = cls._name() + ":"
+        now = time.time()
+        for key, cache in list(caches.items()):
+            is_expired = cache["expiration"] and cache["expiration"] <= now
+            is_stale = key.startswith(prefix) and not cache["generation"] == generation
+            if not is_expired and not is_stale:
+                continue
+            del caches[key]
+        if len(caches) < CACHE_SIZE:
+            return
+        for key in list(caches.keys()):
+            if not key.startswith(prefix):
+                continue
+            del caches[key]
+
+    @classmethod
+    def _get_caches(cls, app):
+        if not hasattr(app, "_caches"):
+            app._caches = dict()
+        return app._caches
+
+    @classmethod
+    def _get_generations(cls, app):
+        if not hasattr(app, "_generations"):
+            app._generations = dict()
+        return app._generations
+
+    @classmethod
+    def _cache_interval(cls):
+        return appier.conf("BUDY_CACHE_INTERVAL", CACHE_INTERVAL, cast=float)
+
+    @classmethod
+    def _invalidate(cls):
+        if cls.is_cached():
+            cls.invalidate_cached()
+        if cls.is_catalog():
+            cls.invalidate_catalog()
+
+    @classmethod
+    def _removed(cls, ids):
+        # runs the equivalent of the delete hooks for the entities with the
+        # provided ids that have been removed in bulk (directly in the data
+        # source), removing them from the posting lists and invalidating
+        if not ids:
+            return
+        cls._unindex_ids(ids)
+        cls._invalidate()
+
+    @classmethod
+    def _unindex_ids(cls, ids):
+        if not cls.is_searchable():
+            return
+        store = cls._collection(name="postings")
+        prefix = cls._name() + ":"
+        if cls._is_mongo():
+            postings = list(
+                store.find(
+                    {"_id": {"$regex": "^" + re.escape(prefix)}, "ids": {"$in": ids}}
+                )
+            )
+        else:
+            postings = [
+                posting
+                for posting in store.find({})
+                if posting["_id"].startswith(prefix)
+                and any(_id in ids for _id in posting.get("ids", []))
+            ]
+        for posting in postings:
+            _ids = [_id for _id in posting.get("ids", []) if not _id in ids]
+            store.update({"_id": posting["_id"]}, {"$set": {"ids": _ids}})
+
+    @classmethod
+    def _aggregate(cls, pipeline, **kwargs):
+        # runs the aggregation pipeline over the underlying (Mongo) collection
+        # of the model, the only place where the private adapter is accessed
+        store = cls._collection()
+        return list(store._base.aggregate(pipeline, **kwargs))
+
+    @classmethod
+    def _get_counter(cls, name, default=None):
+        _name = cls._name() + ":" + name
+        store = cls._collection(name="counters")
+        value = store.find_one({"_id": _name})
+        return value["seq"] if value else default
+
+    @classmethod
+    def _prefetch(cls, models, name):
+        # gathers the complete set of reference objects for the name in
+        # the provided models, flattening the multiple references
+        references = []
+        for model in models:
+            value = model.model.get(name, None)
+            if isinstance(value, appier.References):
+                references.extend(value.objects)
+            elif isinstance(value, appier.Reference):
+                references.append(value)
+
+        # groups the still unresolved references by their target model
+        # and runs a single query per target to retrieve the objects
+        pending = dict()
+        for reference in references:
+            if not reference or reference.is_resolved():
+                continue
+            target = reference._target
+            key = (target, reference._name)
+            pending.setdefault(key, set()).add(reference.id)
+        resolved = dict()
+        for (target, key), ids in pending.items():
+            objects = cls._find_in(target, key, ids)
+            for _object in objects:
+                resolved[(target, getattr(_object, key))] = _object
+
+        # attaches the retrieved objects to the references, resolving the
+        # references not covered by the batch query one by one, returning
+        # the list of the resolved objects for (possible) nested prefetch
+        objects = []
+        for reference in references:
+            if not reference:
+                continue
+            _object = resolved.get((reference._target, reference.id), None)
+            if _object:
+                reference.__dict__["_object"] = _object
+            _object = reference.resolve()
+            if not _object:
+                continue
+            objects.append(_object)
+        return objects
+
+    @classmethod
+    def _find_in(cls, target, name, values, *args, **kwargs):
+        # retrieves the entities of the target model whose field with the
+        # provided name has one of the values in a single query, for Mongo
+        # this is an $in query and for the other adapters (eg: tiny) that
+        # don't support the operator the (scanned) entities are filtered
+        # locally, which is the same scan that a per value query would run,
+        # with the pagination (if any) applied after the filtering
+        values = list(values)
+        if cls._is_mongo():
+            kwargs[name] = {"$in": values}
+            return target.find(*args, **kwargs)
+        values = set(values)
+        skip = kwargs.pop("skip", 0)
+        limit = kwargs.pop("limit", 0)
+        entities = target.find(*args, **kwargs)
+        entities = [
+            entity
+            for entity in entities
+            if (
+                entity.get(name, None)
+                if isinstance(entity, dict)
+                else getattr(entity, name, None)
+            )
+            in values
+        ]
+        return entities[skip : skip + limit] if limit else entities[skip:]
+
+    @classmethod
+    def _get_terms(cls, value):
+        if not value:
+            return []
+        terms = []
+        for term in re.findall("[a-z0-9]+", cls._simplify(value)):
+            if term in terms:
+                continue
+            terms.append(term)
+        return terms
+
+    @classmethod
+    def _find_postings(cls, term, prefix=True):
+        store = cls._collection(name="postings")
+        key = cls._name() + ":" + term
+        if not prefix:
+            posting = store.find_one({"_id": key})
+            return [posting] if posting else []
+        if cls._is_mongo():
+            return list(store.find({"_id": {"$regex": "^" + re.escape(key)}}))
+        postings = store.find({})
+        return [posting for posting in postings if posting["_id"].startswith(key)]
+
+    @classmethod
+    def _get_orders(cls, ids):
+        if not ids or not "order" in cls.fields():
+            return dict()
+        entities = cls.find_ids(ids, fields=("id", "order"), map=True)
+        return dict((entity["id"], entity.get("order", None)) for entity in entities)
+
+    @classmethod
+    def _is_mongo(cls):
+        return cls._adapter().name == "mongo"
+
     @classmethod
     def _simplify(cls, value):
         return appier.App._simplify(value)
@@ -73,10 +753,93 @@ class BudyBase(appier_extras.admin.Base):
         appier_extras.admin.Base.pre_save(self)
         self._update_slug()
         self._update_tokens()
+        self._index_tokens()
+
+    def post_create(self):
+        appier_extras.admin.Base.post_create(self)
+        self._index_tokens()
 
     def post_save(self):
         appier_extras.admin.Base.post_save(self)
         self._update_slug_s()
+        self._invalidate_cached()
+        self._invalidate_catalog()
+
+    def post_delete(self):
+        appier_extras.admin.Base.post_delete(self)
+        self._invalidate_cached()
+        self._invalidate_catalog()
+        self._unindex_tokens()
+
+    def advance_s(self, name, delta, floor=None, clamp=False):
+        """
+        Atomically increments (or decrements) the field with the
+        provided name by the given delta, writing only that field
+        in the data source (no whole document rewrite).
+
+        In case a floor value is provided the update is conditional
+        and only takes place if the resulting value is not lower than
+        such floor, for Mongo this is a single conditional update and
+        for other adapters (eg: tiny) a local verification is used.
+
+        :type name: String
+        :param name: The name of the numeric field to be updated.
+        :type delta: float
+        :param delta: The value to be added to the field, a negative
+        value decrements the field.
+        :type floor: float
+        :param floor: The minimum value allowed for the field after the
+        update, if not respected the update is not performed.
+        :type clamp: bool
+        :param clamp: If the field should be clamped to the floor value
+        instead of failing in case the floor is not respected.
+        :rtype: float
+        :return: The resulting value of the field after the update or
+        an invalid value in case the (conditional) update failed.
+        """
+
+        cls = self.__class__
+        store = self._get_store()
+        delta = float(delta)
+
+        # builds the base filter for the update and in case there's a floor
+        # defined adds the condition on the current value, notice that for
+        # non Mongo adapters this is only an approximation (no atomicity)
+        filter = dict(_id=self._id)
+        if not floor == None:
+            if cls._is_mongo():
+                filter[name] = {"$gte": floor - delta}
+            else:
+                current = store.find_one(dict(_id=self._id)) or dict()
+                current_v = current.get(name, None) or 0.0
+                if current_v + delta < floor:
+                    filter = None
+
+        # runs the single field increment operation and in case the condition
+        # has failed and clamping was requested runs a single clamped update
+        # (oversold scenario), for Mongo this is a pipeline update that sets
+        # the field to the largest of the floor and the incremented value so
+        # that no concurrent update is lost and no value below floor is seen
+        value = (
+            store.find_and_modify(filter, {"$inc": {name: delta}}, new=True)
+            if filter
+            else None
+        )
+        if not value and not floor == None and clamp:
+            if cls._is_mongo():
+                incremented = {"$add": [{"$ifNull": ["$" + name, 0.0]}, delta]}
+                modification = [{"$set": {name: {"$max": [float(floor), incremented]}}}]
+            else:
+                modification = {"$inc": {name: max(delta, floor - current_v)}}
+            value = store.find_and_modify(dict(_id=self._id), modification, new=True)
+        if not value:
+            return None
+
+        # updates the local instance with the new value of the field
+        # so that it remains coherent with the data source
+        setattr(self, name, value[name])
+        self._invalidate_catalog()
+        return value[name]
 
     @appier.operation(name="Update Slug")
     def update_slug_s(self):
@@ -88,6 +851,70 @@ class BudyBase(appier_extras.admin.Base):
         self._update_tokens()
         self.save()
 
+    def map_eager(self, names):
+        """
+        Maps the model resolving its (already loaded) references and
+        running the build operation (calculated attributes) for the
+        referenced models under the provided (dot separated) names.
+
+        The result is the same as the one of an eager reload with map
+        but without the extra queries of such reload.
+
+        :type names: List
+        :param names: The dot separated paths of the references whose
+        models are going to be built (eg: lines.product).
+        :rtype: Dictionary
+        :return: The map representation of the model.
+        """
+
+        # expands the names into the complete set of (unique) paths, so
+        # that the intermediate references are built only once
+        paths = []
+        for name in names:
+            parts = name.split(".")
+            for index in range(1, len(parts) + 1):
+                path = tuple(parts[:index])
+                if path in paths:
+                    continue
+                paths.append(path)
+
+        # maps the model and then walks each of the paths in the mapped
+        # structure building the nested models found at its end
+        cls = self.__class__
+        model = self.map(resolve=True)
+        for path in paths:
+            target = cls
+            values = [model]
+            for part in path:
+                target = getattr(target, part)["type"]._target()
+                values = [value.get(part, None) for value in values]
+                values = [
+                    value for value in self._flatten(values) if isinstance(value, dict)
+                ]
+            for value in values:
+                target.build(value, map=True)
+        return model
+
+    def _flatten(self, values):
+        for value in values:
+            if isinstance(value, list):
+                for _value in value:
+                    yield _value
+            else:
+                yield value
+
+    def _invalidate_cached(self):
+        cls = self.__class__
+        if not cls.is_cached():
+            return
+        cls.invalidate_cached()
+
+    def _invalidate_catalog(self):
+        cls = self.__class__
+        if not cls.is_catalog():
+            return
+        cls.invalidate_catalog()
+
     def _update_slug_s(self):
         slug = self.slug if hasattr(self, "slug") else None
         slug_id = self.slug_id if hasattr(self, "slug_id") else None
@@ -117,6 +944,75 @@ class BudyBase(appier_extras.admin.Base):
         tokens.sort()
         self.tokens = "|".join(tokens)
 
+    def _index_tokens(self):
+        cls = self.__class__
+        if not cls.is_searchable():
+            return
+        if not hasattr(self, "id") or self.id == None:
+            return
+        terms = cls._get_terms(self.tokens)
+        previous = self._get_indexed_terms()
+        for term in terms:
+            if term in previous:
+                continue
+            self._update_posting(term)
+        for term in previous:
+            if term in terms:
+                continue
+            self._update_posting(term, member=False)
+
+    def _unindex_tokens(self):
+        cls = self.__class__
+        if not cls.is_searchable():
+            return
+        for term in self._get_indexed_terms():
+            self._update_posting(term, member=False)
+
+    def _get_indexed_terms(self):
+        # retrieves the terms under which the entity is currently indexed
+        # from the persisted posting lists, instead of the tokens of the
+        # instance, that may be partially loaded (eg: find with fields)
+        cls = self.__class__
+        store = cls._collection(name="postings")
+        prefix = cls._name() + ":"
+        if cls._is_mongo():
+            postings = store.find(
+                {"_id": {"$regex": "^" + re.escape(prefix)}, "ids": self.id}
+            )
+        else:
+            postings = [
+                posting
+                for posting in store.find({})
+                if posting["_id"].startswith(prefix)
+                and self.id in posting.get("ids", [])
+            ]
+        return [posting["_id"][len(prefix) :] for posting in postings]
+
+    def _update_posting(self, term, member=True):
+        cls = self.__class__
+        store = cls._collection(name="postings")
+        key = cls._name() + ":" + term
+
+        # for Mongo the id is added to (or removed from) the posting list
+        # using a single atomic operation (upserting the posting list)
+        if cls._is_mongo():
+            operation = "$addToSet" if member else "$pull"
+            store.update({"_id": key}, {operation: {"ids": self.id}}, upsert=member)
+            return
+
+        # for the other adapters (eg: tiny) the posting list is read, updated
+        # locally and then written back to the data source
+        posting = store.find_one({"_id": key})
+        if not posting and not member:
+            return
+        ids = [_id for _id in (posting["ids"] if posting else []) if not _id == self.id]
+        if member:
+            ids.append(self.id)
+        if posting:
+            store.update({"_id": key}, {"$set": {"ids": ids}})
+        else:
+            store.insert(dict(_id=key, ids=ids))
+
     def _get_tokens(self, name, pluralize=False):
         cls = self.__class__
 
@@ -28,6 +28,7 @@ __copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
 __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
+import json
 import commons
 
 import appier
@@ -35,6 +36,11 @@ import appier
 from . import base
 from . import bundle_line
 
+RULES = dict()
+""" The map that associates the name of a pricing rule (its
+configuration name) with a tuple containing the source of the
+rule and its compiled callable, avoiding re-compilation """
+
 
 class Bundle(base.BudyBase):
     key = appier.field(index="hashed", safe=True, immutable=True)
@@ -202,29 +208,116 @@ class Bundle(base.BudyBase):
     def line_cls(cls):
         return bundle_line.BundleLine
 
+    @classmethod
+    def prefetch_names(cls):
+        return ["lines", "lines.product"]
+
     @classmethod
     def eval_discount(cls, *args, **kwargs):
-        discount = appier.conf("BUDY_DISCOUNT", None)
-        if not discount:
-            return 0.0
-        discount = eval(discount)
-        return discount(*args, **kwargs)
+        return cls.eval_rule("BUDY_DISCOUNT", *args, **kwargs)
 
     @classmethod
     def eval_shipping(cls, *args, **kwargs):
-        shipping = appier.conf("BUDY_SHIPPING", None)
-        if not shipping:
-            return 0.0
-        shipping = eval(shipping)
-        return shipping(*args, **kwargs)
+        return cls.eval_rule("BUDY_SHIPPING", *args, **kwargs)
 
     @classmethod
     def eval_taxes(cls, *args, **kwargs):
-        taxes = appier.conf("BUDY_TAXES", None)
-        if not taxes:
+        return cls.eval_rule("BUDY_TAXES", *args, **kwargs)
+
+    @classmethod
+    def eval_rule(cls, name, *args, **kwargs):
+        rule = cls.compile_rule(name)
+        if not rule:
             return 0.0
-        taxes = eval(taxes)
-        return taxes(*args, **kwargs)
+        return rule(*args, **kwargs)
+
+    @classmethod
+    def compile_rule(cls, name):
+        """
+        Retrieves the callable for the pricing rule defined under the
+        provided configuration name, compiling it only in case the
+        configuration value has changed since the last compilation.
+
+        The rule may be either the source of a lambda function or a
+        declarative (JSON) table, as described in `_eval_table()`.
+
+        :type name: String
+        :param name: The name of the configuration value that contains
+        the definition of the pricing rule (eg: `BUDY_SHIPPING`).
+        :rtype: Function
+        :return: The compiled callable for the rule or an invalid value
+        in case no rule is defined for the provided name.
+        """
+
+        source = appier.conf(name, None)
+        if not source:
+            return None
+        cached = RULES.get(name, None)
+        if cached and cached[0] == source:
+            return cached[1]
+        rule = cls._compile_rule(source)
+        RULES[name] = (source, rule)
+        return rule
+
+    @classmethod
+    def invalidate_rules(cls, name=None):
+        if name:
+            RULES.pop(name, None)
+        else:
+            RULES.clear()
+
+    @classmethod
+    def _compile_rule(cls, source):
+        if isinstance(source, dict):
+            table = source
+        elif source.strip().startswith("{"):
+            table = json.loads(source)
+        else:
+            return eval(source)
+        return lambda *args, **kwargs: cls._eval_table(table, *args, **kwargs)
+
+    @classmethod
+    def _eval_table(cls, table, value, taxes, quantity, bundle):
+        """
+        Evaluates a declarative pricing table against the provided
+        bundle values, the table selects the field to be used with
+        the `by` key (`sub_total`, `taxes`, `quantity`, `weight` or
+        `country`) and then resolves the result using either the
+        `values` map (exact match) or the `tiers` sequence of ascending
+        `[threshold, result]` pairs, falling back to `default`.
+
+        Results may be nested tables and if the `percent` flag is set
+        the final result is considered a percentage of the value.
+
+        :type table: Dictionary
+        :param table: The declarative table that is going to be used
+        in the evaluation of the rule.
+        :rtype: float
+        :return: The final value resolved from the table.
+        """
+
+        if not isinstance(table, dict):
+            return table
+        by = table.get("by", "sub_total")
+        if by == "sub_total":
+            key = value
+        elif by == "taxes":
+            key = taxes
+        elif by == "quantity":
+            key = quantity
+        else:
+            key = getattr(bundle, by, None) if bundle else None
+        result = table.get("default", 0.0)
+        if "values" in table and not key == None:
+            result = table["values"].get(key, result)
+        for threshold, _result in table.get("tiers", []):
+            if key == None or key < threshold:
+                break
+            result = _result
+        result = cls._eval_table(result, value, taxes, quantity, bundle)
+        if table.get("percent", False):
+            result = value * result / 100.0
+        return result
 
     def pre_validate(self):
         base.BudyBase.pre_validate(self)
@@ -286,21 +379,16 @@ class Bundle(base.BudyBase):
         if not product:
             raise appier.OperationalError(message="No product defined")
 
-        for line in self.lines:
-            is_same = line.product.id == product.id
-            is_same &= line.size == size
-            is_same &= line.size_s == size_s
-            is_same &= line.scale == scale
-            is_same &= line.attributes == attributes
-            if not is_same:
-                continue
-            _line = line
+        view = self.lines_view()
+        key = self._line_key(product, size, size_s, scale, attributes)
+        _line = view["lines"].get(key, None)
 
         if _line:
             if not increment:
                 return _line
             _line.quantity += quantity
-            _line.try_valid(bundle=self)
+            self.view_quantity(view, _line.merchandise, quantity)
+            _line.try_valid(bundle=self, view=view)
             _line.save()
             self.save()
             return _line
@@ -357,6 +445,74 @@ class Bundle(base.BudyBase):
         self.save()
         return True
 
+    def refresh_valid_s(self, currency=None, country=None, try_valid=True, force=False):
+        """
+        Refreshes (for the currency and country) and tries to validate
+        the bundle, running the complete set of calculations in memory
+        and persisting the changes only in case something has actually
+        changed, through a single save of the bundle at the end (and of
+        the lines that have changed).
+
+        This is the equivalent of calling `refresh_s()` followed by
+        `try_valid_s()` without the associated intermediate writes.
+
+        :type currency: String
+        :param currency: The ISO code of the currency for the refresh.
+        :type country: String
+        :param country: The ISO code of the country for the refresh.
+        :type try_valid: bool
+        :param try_valid: If the lines of the bundle should be fixed so
+        that they become valid (eg: quantity above stock).
+        :type force: bool
+        :param force: If the lines should be refreshed even if the bundle
+        is not considered to be dirty.
+        :rtype: bool
+        :return: If the bundle has changed and has been persisted.
+        """
+
+        currency = currency or self.currency
+        country = country or self.country
+        lines = self.lines if hasattr(self, "lines") else []
+
+        # runs the refresh operation in memory for the dirty lines of the
+        # bundle, keeping track of the lines that have been changed
+        changed = dict()
+        view = self.lines_view()
+        refreshed = self.is_dirty(currency=currency, country=country) or force
+        if refreshed:
+            for line in lines:
+                is_dirty = line.is_dirty(currency=currency, country=country)
+                if not is_dirty:
+                    continue
+                line.calculate(currency=currency, country=country)
+                line.try_valid(bundle=self, view=view)
+                changed[line.id] = line
+            self.currency = currency
+            self.country = country
+
+        # tries to fix the lines of the bundle (in memory) and in case any
+        # of them has been fixed collects the empty ones and re-calculates
+        # the bundle values as some of the line financials may have changed
+        fixed = False
+        if try_valid:
+            for line in lines:
+                if not line.try_valid(bundle=self, view=view):
+                    continue
+                changed[line.id] = line
+                fixed = True
+            if fixed:
+                self.collect_empty()
+                self.calculate()
+
+        # in case nothing has changed returns immediately (no writes) otherwise
+        # persists the changed lines and then the bundle itself (single write)
+        if not refreshed and not fixed:
+            return False
+        for line in changed.values():
+            line.save()
+        self.save()
+        return True
+
     def add_referral_s(self, referral):
         self.referrals.append(referral)
         self.save()
@@ -447,13 +603,51 @@ class Bundle(base.BudyBase):
         for line in empty:
             self.lines.remove(line)
 
-    def merchandise_quantity(self, merchandise):
+    def merchandise_quantity(self, merchandise, view=None):
+        if view:
+            key = self._merchandise_key(merchandise)
+            return view["quantities"].get(key, 0.0)
         quantity = 0.0
         for line in self.lines:
             if line.merchandise.id == merchandise.id:
                 quantity += line.quantity
         return quantity
 
+    def lines_view(self):
+        """
+        Builds an indexed (in memory) view of the lines of the bundle,
+        so that the multiple consistency checks of an operation run in
+        constant time per line instead of scanning all the lines.
+
+        The view contains the total quantity per merchandise and the
+        line per identity (product, size, size_s, scale and attributes),
+        it should be built once per operation and kept up-to-date with
+        `view_quantity()` as the quantity of the lines changes.
+
+        :rtype: Dictionary
+        :return: The map with the quantities (per merchandise key) and
+        the lines (per line identity key) of the bundle.
+        """
+
+        quantities = dict()
+        lines = dict()
+        for line in self.lines:
+            merchandise = line.merchandise
+            if merchandise:
+                key = self._merchandise_key(merchandise)
+                quantities[key] = quantities.get(key, 0.0) + line.quantity
+            key = self._line_key(
+                line.product, line.size, line.size_s, line.scale, line.attributes
+            )
+            lines[key] = line
+        return dict(quantities=quantities, lines=lines)
+
+    def view_quantity(self, view, merchandise, delta):
+        if not view or not merchandise:
+            return
+        key = self._merchandise_key(merchandise)
+        view["quantities"][key] = view["quantities"].get(key, 0.0) + delta
+
     def try_valid(self):
         # unsets the fixed flag meaning that by default no
         # fixing operation has occurred
@@ -462,8 +656,9 @@ class Bundle(base.BudyBase):
         # iterates over the complete set of bundle lines
         # to try to fix them and make them valid in case
         # none of them has to be fixed returns immediately
+        view = self.lines_view()
         for line in self.lines:
-            fixed |= line.try_valid_s(bundle=self)
+            fixed |= line.try_valid_s(bundle=self, view=view)
         if not fixed:
             return fixed
 
@@ -496,10 +691,45 @@ class Bundle(base.BudyBase):
 
     def is_valid(self):
         is_valid = True
+        snapshot = self.merchandise_snapshot()
         for line in self.lines:
-            is_valid &= line.is_valid()
+            merchandise = line.merchandise
+            merchandise = (
+                snapshot.get(self._merchandise_key(merchandise), None)
+                if merchandise
+                else None
+            )
+            is_valid &= line.is_valid(merchandise=merchandise, bundle=self)
         return is_valid
 
+    def merchandise_snapshot(self):
+        """
+        Retrieves a fresh (from the data source) snapshot of the complete
+        set of merchandise (products and measurements) referenced by the
+        lines of the bundle, using a single query per merchandise model.
+
+        :rtype: Dictionary
+        :return: The map that associates the tuple containing the name
+        of the model and the id of the merchandise with its fresh instance.
+        """
+
+        # prefetches the lines and their products in batch so that the
+        # merchandise of each line is not lazily loaded one by one
+        self.prefetch([self], ("lines", "lines.product"))
+
+        ids = dict()
+        for line in self.lines:
+            merchandise = line.merchandise
+            if not merchandise:
+                continue
+            merchandise_cls = self._merchandise_cls(merchandise)
+            ids.setdefault(merchandise_cls, set()).add(merchandise.id)
+        snapshot = dict()
+        for merchandise_cls, _ids in ids.items():
+            for merchandise in merchandise_cls.find_ids(sorted(_ids)):
+                snapshot[(merchandise_cls._name(), merchandise.id)] = merchandise
+        return snapshot
+
     @appier.operation(name="Empty")
     def empty_s(self):
         for line in self.lines:
@@ -544,3 +774,25 @@ class Bundle(base.BudyBase):
     @property
     def discount_base(self):
         return self.discount_fixed + self.discount_dynamic
+
+    @property
+    def weight(self):
+        lines = self.lines if hasattr(self, "lines") else []
+        return sum(
+            line.quantity * (line.merchandise.weight or 0.0)
+            for line in lines
+            if line.merchandise and hasattr(line.merchandise, "weight")
+        )
+
+    def _merchandise_key(self, merchandise):
+        merchandise_cls = self._merchandise_cls(merchandise)
+        return (merchandise_cls._name(), merchandise.id)
+
+    def _line_key(self, product, size, size_s, scale, attributes):
+        product_id = product.id if product else None
+        return (product_id, size, size_s, scale, attributes)
+
+    def _merchandise_cls(self, merchandise):
+        if isinstance(merchandise, appier.Reference):
+            return merchandise._target
+        return merchandise.__class__
@@ -179,23 +179,25 @@ class BundleLine(base.BudyBase):
     def ensure_valid(self):
         appier.verify(self.is_valid())
 
-    def try_valid(self, bundle=None):
+    def try_valid(self, bundle=None, view=None):
         fixed = False
-        fixed |= self.try_valid_quantity(bundle=bundle)
+        fixed |= self.try_valid_quantity(bundle=bundle, view=view)
         fixed |= self.try_valid_price(bundle=bundle)
         return fixed
 
-    def try_valid_s(self, bundle=None):
-        fixed = self.try_valid(bundle=bundle)
+    def try_valid_s(self, bundle=None, view=None):
+        fixed = self.try_valid(bundle=bundle, view=view)
         if not fixed:
             return fixed
         self.save()
         return fixed
 
-    def try_valid_quantity(self, bundle=None):
+    def try_valid_quantity(self, bundle=None, view=None):
         fixed = False
         quantity = (
-            bundle.merchandise_quantity(self.merchandise) if bundle else self.quantity
+            bundle.merchandise_quantity(self.merchandise, view=view)
+            if bundle
+            else self.quantity
         )
         if quantity <= 0.0:
             quantity = 0.0
@@ -204,9 +206,12 @@ class BundleLine(base.BudyBase):
         if quantity <= self.merchandise.quantity_hand:
             return fixed
         other_quantity = quantity - self.quantity
+        previous = self.quantity
         self.quantity = max(
             min(self.quantity, self.merchandise.quantity_hand - other_quantity), 0
         )
+        if bundle:
+            bundle.view_quantity(view, self.merchandise, self.quantity - previous)
         self.calculate(force=True)
         fixed |= True
         return fixed
@@ -234,9 +239,9 @@ class BundleLine(base.BudyBase):
         is_dirty |= not hasattr(self, "taxes") or self.taxes == None
         return is_dirty
 
-    def is_valid(self):
-        is_valid = self.is_valid_quantity()
-        is_valid &= self.is_valid_price()
+    def is_valid(self, merchandise=None, bundle=None):
+        is_valid = self.is_valid_quantity(merchandise=merchandise, bundle=bundle)
+        is_valid &= self.is_valid_price(merchandise=merchandise, bundle=bundle)
         is_valid &= self.is_valid_size()
         return is_valid
 
@@ -247,14 +252,15 @@ class BundleLine(base.BudyBase):
             return False
         return True
 
-    def is_valid_quantity(self, reload=True):
+    def is_valid_quantity(self, reload=True, merchandise=None, bundle=None):
         if self.quantity < 0:
             return False
-        merchandise = (
-            self.merchandise and self.merchandise.reload()
-            if reload
-            else self.merchandise
-        )
+        if merchandise == None:
+            merchandise = (
+                self.merchandise and self.merchandise.reload()
+                if reload
+                else self.merchandise
+            )
         if (
             not merchandise.quantity_hand == None
             and self.quantity > merchandise.quantity_hand
@@ -262,12 +268,13 @@ class BundleLine(base.BudyBase):
             return False
         return True
 
-    def is_valid_price(self, reload=True):
-        merchandise = (
-            self.merchandise and self.merchandise.reload()
-            if reload
-            else self.merchandise
-        )
+    def is_valid_price(self, reload=True, merchandise=None, bundle=None):
+        if merchandise == None:
+            merchandise = (
+                self.merchandise and self.merchandise.reload()
+                if reload
+                else self.merchandise
+            )
         if (
             not merchandise.is_price_provided
             and not merchandise.price == None
@@ -42,6 +42,15 @@ class Country(base.BudyBase):
 
     locale = appier.field(index=True)
 
+    @classmethod
+    def teardown(cls):
+        super(Country, cls).teardown()
+        cls.clear_cached()
+
+    @classmethod
+    def is_cached(cls):
+        return True
+
     @classmethod
     def validate(cls):
         return super(Country, cls).validate() + [
@@ -66,6 +75,14 @@ class Country(base.BudyBase):
     def get_by_code(cls, country_code, *args, **kwargs):
         return cls.get(country_code=country_code, *args, **kwargs)
 
+    @classmethod
+    def get_countries(cls, app=None):
+        def builder():
+            countries = cls.find(map=True)
+            return dict([(value["country_code"], value) for value in countries])
+
+        return cls.get_cached("countries", builder, app=app)
+
     @classmethod
     @appier.operation(
         name="Import CSV",
@@ -92,6 +109,7 @@ class Country(base.BudyBase):
         if empty:
             cls.delete_c()
         cls._csv_import(file, callback)
+        cls.invalidate_cached()
 
     @classmethod
     @appier.link(name="Export Simple")
@@ -41,7 +41,11 @@ class Currency(base.BudyBase):
     @classmethod
     def teardown(cls):
         super(Currency, cls).teardown()
-        cls.invalidate()
+        cls.clear_cached()
+
+    @classmethod
+    def is_cached(cls):
+        return True
 
     @classmethod
     def validate(cls):
@@ -81,19 +85,15 @@ class Currency(base.BudyBase):
 
     @classmethod
     def get_currencies(cls, app=None):
-        app = app or appier.get_app()
-        if hasattr(app, "_currencies"):
-            return app._currencies
-        currencies = cls.find(map=True)
-        app._currencies = dict([(value["iso"], value) for value in currencies])
-        return app._currencies
+        def builder():
+            currencies = cls.find(map=True)
+            return dict([(value["iso"], value) for value in currencies])
+
+        return cls.get_cached("currencies", builder, app=app)
 
     @classmethod
     def invalidate(cls, app=None):
-        app = app or appier.get_app()
-        if not hasattr(app, "_currencies"):
-            return
-        delattr(app, "_currencies")
+        cls.invalidate_cached(app=app)
 
     @classmethod
     @appier.operation(
@@ -113,6 +113,7 @@ class Currency(base.BudyBase):
         if empty:
             cls.delete_c()
         cls._csv_import(file, callback)
+        cls.invalidate()
 
     @classmethod
     @appier.link(name="Export Simple")
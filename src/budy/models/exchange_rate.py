@@ -34,6 +34,15 @@ import appier
 
 from . import base
 
+RATES_TTL = 300.0
+""" The default amount of time (in seconds) the in memory matrix
+of exchange rates is considered valid before being reloaded from
+the data source, regardless of the cache generation """
+
+RATES_PIVOT = "EUR"
+""" The default currency to be used as the pivot (intermediate)
+currency for triangulation whenever a direct rate is missing """
+
 
 class ExchangeRate(base.BudyBase):
     name = appier.field(default=True)
@@ -44,6 +53,15 @@ class ExchangeRate(base.BudyBase):
 
     rate = appier.field(type=commons.Decimal, index=True)
 
+    @classmethod
+    def teardown(cls):
+        super(ExchangeRate, cls).teardown()
+        cls.clear_cached()
+
+    @classmethod
+    def is_cached(cls):
+        return True
+
     @classmethod
     def validate(cls):
         return super(ExchangeRate, cls).validate() + [
@@ -76,27 +94,87 @@ class ExchangeRate(base.BudyBase):
 
         if reversed:
             return cls.reverse(value, base, target, rounder=rounder)
-        exchange_rate = cls.get(base=base, target=target)
-        result = commons.Decimal(value) * exchange_rate.rate
+        rate = cls.get_rate(base, target)
+        result = commons.Decimal(value) * rate
         return currency.Currency.round(result, target, rounder=rounder)
 
     @classmethod
     def reverse(cls, value, base, target, rounder=round):
         from . import currency
 
-        exchange_rate = cls.get(base=target, target=base)
-        result = commons.Decimal(value) * (commons.Decimal(1.0) / exchange_rate.rate)
+        rate = cls.get_rate(target, base)
+        result = commons.Decimal(value) * (commons.Decimal(1.0) / rate)
         return currency.Currency.round(result, target, rounder=rounder)
 
     @classmethod
     def has_rate(cls, base, target):
-        exchange_rate = cls.get(base=base, target=target, raise_e=False)
-        if not exchange_rate:
-            return False
-        if not exchange_rate.rate:
+        rate = cls.get_rate(base, target, raise_e=False)
+        if not rate:
             return False
         return True
 
+    @classmethod
+    def get_rate(cls, base, target, pivot=None, raise_e=True):
+        """
+        Retrieves the rate to be used in the conversion of values from
+        the base currency to the target one, using the in memory matrix
+        of rates (no data source access while the matrix is valid).
+
+        In case there's no direct rate for the pair the rate is obtained
+        by triangulation through the pivot currency (base to pivot and
+        then pivot to target).
+
+        :type base: String
+        :param base: The ISO code of the currency to convert from.
+        :type target: String
+        :param target: The ISO code of the currency to convert to.
+        :type pivot: String
+        :param pivot: The ISO code of the currency to be used in the
+        triangulation, if not provided the configured one is used.
+        :type raise_e: bool
+        :param raise_e: If an exception should be raised in case no
+        rate (direct or triangulated) exists for the pair.
+        :rtype: Decimal
+        :return: The rate for the conversion from base to target.
+        """
+
+        rates = cls.get_rates()
+        rate = rates.get((base, target), None)
+        if not rate == None:
+            return rate
+
+        pivot = pivot or cls._pivot()
+        if pivot and not pivot in (base, target):
+            rate_b = rates.get((base, pivot), None)
+            rate_t = rates.get((pivot, target), None)
+            if not rate_b == None and not rate_t == None:
+                return rate_b * rate_t
+
+        if not raise_e:
+            return None
+        raise appier.NotFoundError(
+            message="No exchange rate found for %s to %s" % (base, target)
+        )
+
+    @classmethod
+    def get_rates(cls, app=None):
+        def builder():
+            matrix = dict()
+            exchange_rates = cls.find(map=True)
+            for exchange_rate in exchange_rates:
+                rate = exchange_rate.get("rate", None)
+                if rate == None:
+                    continue
+                key = (exchange_rate["base"], exchange_rate["target"])
+                matrix.setdefault(key, commons.Decimal(rate))
+            return matrix
+
+        return cls.get_cached("rates", builder, ttl=cls._ttl(), app=app)
+
+    @classmethod
+    def invalidate(cls, app=None):
+        cls.invalidate_cached(app=app)
+
     @classmethod
     @appier.operation(
         name="Import CSV",
@@ -115,3 +193,12 @@ class ExchangeRate(base.BudyBase):
         if empty:
             cls.delete_c()
         cls._csv_import(file, callback)
+        cls.invalidate()
+
+    @classmethod
+    def _ttl(cls):
+        return appier.conf("BUDY_RATES_TTL", RATES_TTL, cast=float)
+
+    @classmethod
+    def _pivot(cls):
+        return appier.conf("BUDY_RATES_PIVOT", RATES_PIVOT)
@@ -59,6 +59,10 @@ class Group(base.BudyBase):
 
     images = appier.field(type=appier.references("Media", name="id"))
 
+    @classmethod
+    def is_catalog(cls):
+        return True
+
     @classmethod
     def validate(cls):
         return super(Group, cls).validate() + [
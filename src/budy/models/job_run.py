@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Hive Budy
+# Copyright (c) 2008-2024 Hive Solutions Lda.
+#
+# This file is part of Hive Budy.
+#
+# Hive Budy is free software: you can redistribute it and/or modify
+# it under the terms of the Apache License as published by the Apache
+# Foundation, either version 2.0 of the License, or (at your option) any
+# later version.
+#
+# Hive Budy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# Apache License for more details.
+#
+# You should have received a copy of the Apache License along with
+# Hive Budy. If not, see <http://www.apache.org/licenses/>.
+
+__author__ = "João Magalhães <joamag@hive.pt>"
+""" The author(s) of the module """
+
+__copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
+""" The copyright for the module """
+
+__license__ = "Apache License, Version 2.0"
+""" The license for the module """
+
+import time
+
+import appier
+
+from . import base
+
+RUNS = 100
+""" The default number of (most recent) runs kept per job, the
+older ones are removed after each run of the job """
+
+
+class JobRun(base.BudyBase):
+    """
+    Represents a run of a scheduled job (eg: a bot phase) in one
+    of the processes of the cluster, keeping the history of the
+    runs visible in the admin.
+
+    The class also controls the leases (stored in their own
+    collection) that ensure that only one process of the cluster
+    runs each job at a certain time.
+    """
+
+    STATUS_S = dict(
+        running="running",
+        success="success",
+        failed="failed",
+        timeout="timeout",
+    )
+
+    STATUS_C = dict(
+        running="blue",
+        success="green",
+        failed="red",
+        timeout="orange",
+    )
+
+    name = appier.field(
+        index=True,
+        default=True,
+        safe=True,
+        observations="""The name of the job that was run""",
+    )
+
+    status = appier.field(
+        initial="running",
+        index=True,
+        safe=True,
+        meta="enum",
+        enum=STATUS_S,
+        colors=STATUS_C,
+    )
+
+    node = appier.field(
+        index=True,
+        safe=True,
+        observations="""The identifier of the process (host and
+        PID) that has run the job""",
+    )
+
+    start = appier.field(type=float, index=True, safe=True, meta="datetime")
+
+    end = appier.field(type=float, index=True, safe=True, meta="datetime")
+
+    duration = appier.field(
+        type=float,
+        safe=True,
+        observations="""The time (in seconds) the run took""",
+    )
+
+    message = appier.field(
+        safe=True,
+        observations="""The error message in case the run has
+        failed, empty otherwise""",
+    )
+
+    @classmethod
+    def validate(cls):
+        return super(JobRun, cls).validate() + [
+            appier.not_null("name"),
+            appier.not_empty("name"),
+        ]
+
+    @classmethod
+    def list_names(cls):
+        return ["id", "name", "status", "node", "start", "duration"]
+
+    @classmethod
+    def order_name(cls):
+        return ["id", -1]
+
+    @classmethod
+    def acquire_lease(cls, name, node, timeout, slot=0):
+        """
+        Tries to acquire the lease for the job with the provided name,
+        succeeding only in case the job is due (its interval has elapsed)
+        and there's no other process holding a (non expired) lease.
+
+        For Mongo the acquire is a single atomic conditional update, for
+        the other adapters (eg: tiny) a local verification is used.
+
+        :type name: String
+        :param name: The name of the job to acquire the lease for.
+        :type node: String
+        :param node: The identifier of the process acquiring the lease.
+        :type timeout: float
+        :param timeout: The maximum time (in seconds) the lease is held,
+        after which it's considered expired (the job has timed out).
+        :type slot: int
+        :param slot: The slot of the lease to acquire, jobs that allow
+        multiple concurrent runs have one lease per slot.
+        :rtype: bool
+        :return: If the lease has been acquired by the process.
+        """
+
+        store = cls._collection(name="leases")
+        key = "%s:%d" % (name, slot)
+        now = time.time()
+
+        # makes sure that the lease document exists so that the acquire
+        # operation is always a conditional update (concurrent inserts
+        # of the same document fail and are ignored)
+        if not store.find_one({"_id": key}):
+            try:
+                store.insert(dict(_id=key, node=None, expires=0.0, next=0.0))
+            except Exception:
+                pass
+
+        update = {"$set": {"node": node, "expires": now + timeout}}
+        if cls._is_mongo():
+            lease = store.find_and_modify(
+                {"_id": key, "expires": {"$lte": now}, "next": {"$lte": now}},
+                update,
+                new=True,
+            )
+            return True if lease else False
+
+        lease = store.find_one({"_id": key}) or dict()
+        if lease.get("expires", 0.0) > now or lease.get("next", 0.0) > now:
+            return False
+        store.update({"_id": key}, update)
+        return True
+
+    @classmethod
+    def release_lease(cls, name, node, interval, slot=0):
+        """
+        Releases the lease for the job with the provided name, held by
+        the provided process, scheduling the next run of the job for
+        after the provided interval.
+
+        :type name: String
+        :param name: The name of the job to release the lease for.
+        :type node: String
+        :param node: The identifier of the process holding the lease.
+        :type interval: float
+        :param interval: The interval (in seconds) until the next run
+        of the job (in any of the processes).
+        :type slot: int
+        :param slot: The slot of the lease that is going to be released.
+        """
+
+        store = cls._collection(name="leases")
+        key = "%s:%d" % (name, slot)
+        now = time.time()
+        store.update(
+            {"_id": key, "node": node},
+            {"$set": {"node": None, "expires": 0.0, "next": now + interval}},
+        )
+
+    @classmethod
+    def prune_s(cls, name, keep=None):
+        """
+        Removes the older runs of the job with the provided name, keeping
+        only the most recent ones, so that the history of frequent jobs
+        (eg: reservations) does not grow without bounds.
+
+        :type name: String
+        :param name: The name of the job to prune the runs for.
+        :type keep: int
+        :param keep: The number of (most recent) runs to keep, if not
+        provided the `JOB_RUNS` configuration value is used.
+        :rtype: int
+        :return: The number of runs that have been removed.
+        """
+
+        keep = appier.conf("JOB_RUNS", RUNS, cast=int) if keep == None else keep
+        runs = cls.find(name=name, sort=[("id", -1)], fields=("id",), map=True)
+        ids = [run["id"] for run in runs[keep:]]
+        if not ids:
+            return 0
+        store = cls._collection()
+        if cls._is_mongo():
+            store.remove({"id": {"$in": ids}})
+        else:
+            for id in ids:
+                store.remove({"id": id})
+        cls._removed(ids)
+        return len(ids)
+
+    def finish_s(self, status="success", message=None, timeout=None):
+        self.end = time.time()
+        self.duration = self.end - self.start
+        if status == "success" and timeout and self.duration > timeout:
+            status = "timeout"
+        self.status = status
+        self.message = message
+        self.save()
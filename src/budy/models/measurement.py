@@ -35,6 +35,10 @@ import appier
 from . import base
 from . import currency as _currency
 
+CHUNK = 1000
+""" The maximum number of measurements removed per each bulk
+remove operation, keeping the size of each query bounded """
+
 
 class Measurement(base.BudyBase):
     name = appier.field(index=True, default=True)
@@ -76,6 +80,10 @@ class Measurement(base.BudyBase):
 
     product = appier.field(type=appier.reference("Product", name="id"))
 
+    @classmethod
+    def is_catalog(cls):
+        return True
+
     @classmethod
     def validate(cls):
         return super(Measurement, cls).validate() + [
@@ -267,6 +275,112 @@ class Measurement(base.BudyBase):
         # to properly save the newly generated measurement instance according to omni
         return measurement
 
+    @classmethod
+    @appier.operation(name="Dedupe")
+    def dedupe_s(cls):
+        """
+        Removes the duplicated measurements (same Omni object ID), keeping
+        only the most recently modified one of each object ID.
+
+        For Mongo the duplicates are discovered with a server side
+        aggregation and removed in bulk, with the parent products being
+        updated with a single pull operation each, for other adapters
+        (eg: tiny) the measurements are grouped in memory.
+
+        :rtype: Dictionary
+        :return: The report of the operation with the number of object
+        IDs that were duplicated, the number of removed measurements and
+        the number of products that have been updated.
+        """
+
+        from . import product
+
+        if not cls._is_mongo():
+            return cls._dedupe_local()
+
+        pipeline = [
+            {"$match": {"meta.object_id": {"$ne": None}}},
+            {"$sort": {"meta.modify_date": -1, "id": 1}},
+            {
+                "$group": {
+                    "_id": "$meta.object_id",
+                    "ids": {"$push": "$id"},
+                    "_ids": {"$push": "$_id"},
+                    "products": {"$push": "$product"},
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$match": {"count": {"$gt": 1}}},
+        ]
+        groups = cls._aggregate(pipeline, allowDiskUse=True)
+
+        # gathers the duplicates of each group (all but the newest) and
+        # the ids of the duplicates that are referenced by each product
+        removed = []
+        removed_ids = []
+        products = dict()
+        for group in groups:
+            duplicates = zip(group["_ids"][1:], group["ids"][1:], group["products"][1:])
+            for _id, id, product_id in duplicates:
+                removed.append(_id)
+                removed_ids.append(id)
+                if product_id == None:
+                    continue
+                products.setdefault(product_id, []).append(id)
+
+        # removes the duplicated measurements in bulk (chunked to keep the
+        # size of each query bounded), running the equivalent of the delete
+        # hooks (postings and caches) as the removal does not trigger them
+        store = cls._collection()
+        for index in range(0, len(removed), CHUNK):
+            store.remove({"_id": {"$in": removed[index : index + CHUNK]}})
+        cls._removed(removed_ids)
+
+        # removes the references to the duplicates from the parent products,
+        # updating their aggregates accordingly, and then invalidates the
+        # product caches as the products have been changed in the data source
+        product_store = product.Product._collection()
+        for product_id, ids in products.items():
+            product_store.update(
+                {"id": product_id}, {"$pullAll": {"measurements": ids}}
+            )
+            _product = product.Product.get(id=product_id, raise_e=False)
+            if not _product:
+                continue
+            _product.update_aggregates_s()
+        if products:
+            product.Product._invalidate()
+
+        return dict(groups=len(groups), removed=len(removed), products=len(products))
+
+    @classmethod
+    def _dedupe_local(cls):
+        # sorts the measurements from latest to oldest modification, so
+        # that the first measurement of each object ID is the one kept
+        measurements = cls.find(sort=[("id", 1)])
+        measurements.sort(
+            key=lambda v: (v.meta or dict()).get("modify_date", 0), reverse=True
+        )
+
+        kept = dict()
+        groups = set()
+        products = set()
+        removed = 0
+        for measurement in measurements:
+            object_id = (measurement.meta or dict()).get("object_id", None)
+            if object_id == None:
+                continue
+            if not object_id in kept:
+                kept[object_id] = measurement
+                continue
+            groups.add(object_id)
+            if measurement.product:
+                products.add(measurement.product.id)
+            measurement.delete()
+            removed += 1
+
+        return dict(groups=len(groups), removed=removed, products=len(products))
+
     @classmethod
     def _hash(cls, value, max_size=8):
         counter = 0
@@ -279,16 +393,35 @@ class Measurement(base.BudyBase):
         counter = counter % modulus
         return counter
 
+    def post_apply(self):
+        base.BudyBase.post_apply(self)
+        if self.is_new():
+            return
+        self.__dict__.setdefault("_aggregates", self._get_aggregates())
+
+    def post_save(self):
+        base.BudyBase.post_save(self)
+        self._update_aggregates()
+
+    def advance_s(self, name, delta, *args, **kwargs):
+        value = base.BudyBase.advance_s(self, name, delta, *args, **kwargs)
+        if name == "quantity_hand" and not value == None:
+            # the exact delta is known unless the value has been clamped
+            # (oversold), in which case the aggregates are re-computed
+            clamp = kwargs.get("clamp", False)
+            previous = None if clamp else dict(quantity_hand=value - float(delta))
+            self._update_aggregates(
+                previous=previous, current=dict(quantity_hand=value)
+            )
+        return value
+
     def pre_delete(self):
         base.BudyBase.pre_delete(self)
         if not self.product:
             return
         if not hasattr(self.product, "measurements"):
             return
-        if not self in self.product.measurements:
-            return
-        self.product.measurements.remove(self)
-        self.product.save()
+        self.product.remove_measurement_s(self)
 
     def get_price(self, currency=None, country=None, attributes=None):
         return self.price
@@ -345,8 +478,13 @@ class Measurement(base.BudyBase):
     @appier.operation(name="Fix")
     def fix_s(self):
         if not self.exists():
-            return
+            return False
+        if self.value == None:
+            return False
+        if isinstance(self.value, appier.legacy.INTEGERS):
+            return False
         self._fix_value_s()
+        return True
 
     @appier.operation(name="Duplicate", factory=True)
     def duplicate_s(self):
@@ -362,10 +500,41 @@ class Measurement(base.BudyBase):
             meta=self.meta,
         )
         measurement.save()
-        self.product.measurements.append(measurement)
-        self.product.save()
+        self.product.add_measurement_s(measurement)
         return measurement
 
+    def _update_aggregates(self, previous=None, current=None):
+        from . import product
+
+        # compares the values of the aggregate fields as known by this
+        # instance (loaded or last saved) with the current ones, returning
+        # immediately in case none of them has changed (no product access)
+        if current == None:
+            previous = self.__dict__.get("_aggregates", None)
+            current = self._get_aggregates()
+            self.__dict__["_aggregates"] = current
+        elif "_aggregates" in self.__dict__:
+            self.__dict__["_aggregates"].update(current)
+        if previous == current:
+            return
+
+        # retrieves the latest version of the parent product and in case
+        # this measurement is part of it runs the targeted update of the
+        # product aggregates (no complete product save is performed)
+        if not self.product:
+            return
+        _product = product.Product.get(id=self.product.id, raise_e=False)
+        if not _product:
+            return
+        if not self.id in _product.measurements.ids:
+            return
+        _product.update_aggregates_s(previous=previous, current=current)
+
+    def _get_aggregates(self):
+        from . import product
+
+        return dict((name, getattr(self, name, None)) for name in product.AGGREGATES)
+
     @property
     def _product_id_meta(self):
         if not self.meta:
@@ -29,8 +29,11 @@ __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
 import os
+import uuid
+import hashlib
 import zipfile
 import tempfile
+import threading
 import mimetypes
 
 import appier
@@ -40,6 +43,89 @@ from . import product
 
 BASE_URL = "http://localhost:8080/"
 
+RENDITIONS_SIZE = 268435456
+""" The default maximum size (in bytes) of the local disk
+cache of media renditions, once exceeded the least recently
+used renditions are evicted from the cache """
+
+RENDITIONS_FORMATS = ("webp", "jpeg")
+""" The formats for which the renditions are going to be
+generated when the renditions cache of a media is filled """
+
+THUMBNAILS = (
+    ("thumbnail", 260),
+    ("thumbnail_2x", 540),
+    ("large", 540),
+    ("large_2x", 1080),
+)
+""" The sequence of suffix and size tuples that define
+the (square) resized variants of an original media """
+
+
+def build_thumbnails(data, sizes, format="png", background="ffffff"):
+    """
+    Builds the (square) resized variants of the provided image
+    data decoding it only once, the variants are built from the
+    largest to the smallest re-using the previous (downsampled)
+    image as the source of the next one.
+
+    This is a module level function so that it may be run under
+    a process pool (required for pickling).
+
+    :type data: String
+    :param data: The binary data of the original image.
+    :type sizes: List
+    :param sizes: The sequence of suffix and size tuples of the
+    variants that are going to be built.
+    :type format: String
+    :param format: The image format of the variants.
+    :type background: String
+    :param background: The hexadecimal color of the background
+    to be used for RGB only formats (eg: jpeg).
+    :rtype: Dictionary
+    :return: The map associating the suffix of each variant with
+    its encoded binary data.
+    """
+
+    import PIL.Image
+
+    resample = getattr(PIL.Image, "LANCZOS", None) or getattr(
+        PIL.Image, "ANTIALIAS", None
+    )
+
+    # decodes the original image and crops it at the center into
+    # a square, matching the cropping of the appier image type
+    image = PIL.Image.open(appier.legacy.BytesIO(data))
+    image.load()
+    width, height = image.size
+    side = min(width, height)
+    x_offset = int((width - side) / 2.0)
+    y_offset = int((height - side) / 2.0)
+    image = image.crop((x_offset, y_offset, x_offset + side, y_offset + side))
+
+    # iterates over the sizes from the largest to the smallest one using
+    # the previous (smaller than original) result as source, notice that
+    # equal sizes are only encoded once
+    results = dict()
+    encoded = dict()
+    previous = None
+    for suffix, size in sorted(sizes, key=lambda value: value[1], reverse=True):
+        if not size in encoded:
+            source = previous if previous and previous.size[0] <= side else image
+            previous = source.resize((size, size), resample)
+            target = previous
+            if format in ("jpg", "jpeg") and not target.mode == "RGB":
+                target = PIL.Image.new("RGB", target.size, "#" + background)
+                target.paste(
+                    previous, mask=previous if previous.mode == "RGBA" else None
+                )
+            buffer = appier.legacy.BytesIO()
+            target.save(buffer, format)
+            encoded[size] = buffer.getvalue()
+        results[suffix] = encoded[size]
+
+    return results
+
 
 class Media(base.BudyBase):
     label = appier.field(index=True)
@@ -52,6 +138,19 @@ class Media(base.BudyBase):
 
     file = appier.field(type=appier.File, private=True)
 
+    _renditions_sizes = dict()
+    """ The map associating the path of each renditions cache with
+    its (estimated) size in bytes, so that the eviction is only run
+    when the size crosses the maximum one """
+
+    _renditions_lock = threading.RLock()
+    """ The lock that controls the access to the sizes of the
+    renditions caches and to their eviction """
+
+    @classmethod
+    def is_catalog(cls):
+        return True
+
     @classmethod
     def validate(cls):
         return super(Media, cls).validate() + [
@@ -153,8 +252,7 @@ class Media(base.BudyBase):
                 if not _product:
                     continue
 
-                _product.images.append(media)
-                _product.save()
+                _product.add_image_s(media)
 
     @classmethod
     def _build(cls, model, map):
@@ -169,6 +267,67 @@ class Media(base.BudyBase):
     def _plural(cls):
         return "Media"
 
+    @classmethod
+    def _renditions_path(cls):
+        path = appier.conf("BUDY_RENDITIONS_PATH", None)
+        path = path or os.path.join(tempfile.gettempdir(), "budy_renditions")
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                pass
+        return path
+
+    @classmethod
+    def _account_renditions(cls, size):
+        # updates the (estimated) size of the cache with the size of the new
+        # rendition and only runs the (expensive) eviction in case it crosses
+        # the maximum size, notice that the first use in the process always
+        # runs the eviction to obtain the real size of the cache (renditions
+        # created by other processes are only accounted on eviction)
+        max_size = appier.conf("BUDY_RENDITIONS_SIZE", RENDITIONS_SIZE, cast=int)
+        path = cls._renditions_path()
+        with cls._renditions_lock:
+            current = cls._renditions_sizes.get(path, None)
+            if not current == None:
+                current += size
+            if current == None or current > max_size:
+                current = cls._evict_renditions()
+            cls._renditions_sizes[path] = current
+
+    @classmethod
+    def _evict_renditions(cls):
+        # retrieves the complete set of renditions currently stored in the
+        # cache and in case the total size exceeds the maximum one removes the
+        # least recently used renditions (by modification time) until the
+        # size of the cache is under the maximum value, the temporary files
+        # (renditions being written) are never touched
+        max_size = appier.conf("BUDY_RENDITIONS_SIZE", RENDITIONS_SIZE, cast=int)
+        path = cls._renditions_path()
+        entries = []
+        for name in os.listdir(path):
+            if name.endswith(".tmp"):
+                continue
+            file_path = os.path.join(path, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+        size = sum(entry[1] for entry in entries)
+        if size <= max_size:
+            return size
+        entries.sort()
+        for _mtime, _size, file_path in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            size -= _size
+        return size
+
     @classmethod
     def _get_url(cls, id, format=None, absolute=True):
         app = appier.get_app()
@@ -186,6 +345,117 @@ class Media(base.BudyBase):
     def get_url(self, format=None):
         return self.__class__._get_url(self.id, format=format)
 
+    @appier.operation(name="Fill Renditions")
+    def fill_renditions(self, formats=RENDITIONS_FORMATS):
+        """
+        Fills the renditions cache for the provided formats using the
+        default quality and background, so that not even the first
+        request for them runs an image conversion.
+
+        The renditions are not generated when the media is saved, as
+        that would run the (expensive) encodings on the thread saving
+        it, they are generated on their first request and then served
+        from the cache, this operation allows warming up the cache.
+
+        Any problem in the conversion (eg: the file is not an image)
+        is logged and ignored, as the renditions are not critical.
+
+        :type formats: Tuple
+        :param formats: The sequence of formats for which the renditions
+        are going to be generated.
+        """
+
+        file = getattr(self, "file", None)
+        media = self if file and file.data else self.reload(rules=False)
+        if not media.file or not media.file.data:
+            return
+        mime = (media.file.mime or "").lower()
+        mime = "image/jpeg" if mime == "image/jpg" else mime
+        if not mime.startswith("image/"):
+            return
+        for format in formats:
+            if mime == "image/" + format:
+                continue
+            try:
+                media.get_rendition(format)
+            except Exception as exception:
+                self.logger.warning(
+                    "Problem generating %s rendition for media %d - %s ..."
+                    % (format, self.id, exception)
+                )
+
+    def get_rendition(self, format, quality=90, background=None):
+        """
+        Retrieves the binary data of the rendition of the media (image)
+        for the provided format, quality and background, using the local
+        disk cache and only converting the image on a cache miss.
+
+        The key of the rendition includes the etag of the file so that
+        any change in the file invalidates its previous renditions.
+
+        :type format: String
+        :param format: The image format of the rendition (eg: webp).
+        :type quality: int
+        :param quality: The quality to be used in the encoding.
+        :type background: String
+        :param background: The hexadecimal color of the background to be
+        used in the composition (for transparent images).
+        :rtype: String
+        :return: The binary data of the rendition.
+        """
+
+        cls = self.__class__
+
+        # builds the (hashed) key of the rendition and uses it to check if
+        # the rendition already exists in the cache, if that's the case
+        # touches it (LRU) and returns its contents immediately
+        key = "%d:%s:%s:%d:%s" % (
+            self.id,
+            self.file.etag,
+            format,
+            quality,
+            background or "",
+        )
+        key = hashlib.sha1(appier.legacy.bytes(key)).hexdigest()
+        path = os.path.join(cls._renditions_path(), key)
+        try:
+            file = open(path, "rb")
+        except (IOError, OSError):
+            file = None
+        if file:
+            try:
+                data = file.read()
+            finally:
+                file.close()
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return data
+
+        # converts the image into the requested format and stores it in the
+        # cache, using a temporary file and a rename operation so that other
+        # processes never read a partially written rendition
+        buffer = self.convert_image(
+            format, background=background, **dict(quality=quality)
+        )
+        data = buffer.getvalue()
+        path_t = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        file = open(path_t, "wb")
+        try:
+            file.write(data)
+        finally:
+            file.close()
+        try:
+            os.rename(path_t, path)
+        except OSError:
+            try:
+                os.remove(path_t)
+            except OSError:
+                pass
+        cls._account_renditions(len(data))
+        return data
+
     def convert_image(self, format, background=None, **kwargs):
         import PIL.Image
 
@@ -237,6 +507,59 @@ class Media(base.BudyBase):
         thumbnail.save()
         return thumbnail
 
+    def thumbnails_s(self, sizes=THUMBNAILS, format="png", pool=None):
+        """
+        Creates the resized variants (thumbnails) of the current media
+        for the provided sizes, decoding the original image only once.
+
+        In case a process pool is provided the decoding, resizing and
+        encoding of the image is run on one of its processes.
+
+        :type sizes: List
+        :param sizes: The sequence of suffix and size tuples of the
+        variants that are going to be created.
+        :type format: String
+        :param format: The image format of the variants.
+        :type pool: Pool
+        :param pool: The (optional) process pool to be used for the
+        heavy image processing operations.
+        :rtype: List
+        :return: The list of media created, in the same order as the
+        provided sizes.
+        """
+
+        cls = self.__class__
+
+        # retrieves the media with its file data loaded, in case the file
+        # is not available in the current instance (private field) then a
+        # reload operation is required to retrieve it
+        file = getattr(self, "file", None)
+        media = self if file and file.data else self.reload(rules=False)
+
+        # runs the building of the variants either on the process pool
+        # or locally, retrieving the encoded data for each of them
+        args = (media.file.data, list(sizes), format)
+        if pool:
+            results = pool.apply(build_thumbnails, args)
+        else:
+            results = build_thumbnails(*args)
+
+        thumbnails = []
+        for suffix, _size in sizes:
+            name = "%s.%s" % (suffix, format)
+            mime, _encoding = mimetypes.guess_type(name, strict=False)
+            thumbnail = cls(
+                description=media.description,
+                label=suffix,
+                order=media.order,
+                size=suffix,
+                unique="%s-%s" % (media.unique, suffix),
+                file=appier.File((name, mime, results[suffix])),
+            )
+            thumbnail.save()
+            thumbnails.append(thumbnail)
+        return thumbnails
+
     @appier.link(name="View")
     def view_url(self, absolute=False):
         return self.owner.url_for(
@@ -43,6 +43,7 @@ from . import product
 from . import country
 from . import voucher
 from . import currency
+from . import reservation
 from . import order_line
 
 COUNTRIES_MAP = dict(ES="Spain", PT="Portugal")
@@ -120,6 +121,32 @@ class Order(bundle.Bundle):
 
     tracking_url = appier.field(index="hashed", meta="url", description="Tracking URL")
 
+    tracking_checked = appier.field(
+        type=int,
+        index=True,
+        safe=True,
+        meta="datetime",
+        observations="""The last time the tracking status of the order
+        was checked against the remote tracking service""",
+    )
+
+    tracking_next = appier.field(
+        type=int,
+        index=True,
+        safe=True,
+        meta="datetime",
+        observations="""The time from which the tracking status of the
+        order should be checked again (backoff schedule)""",
+    )
+
+    tracking_failures = appier.field(
+        type=int,
+        initial=0,
+        safe=True,
+        observations="""The number of consecutive failures checking
+        the tracking status of the order, used for backoff""",
+    )
+
     payment_data = appier.field(type=dict)
 
     cancel_data = appier.field(type=dict)
@@ -198,6 +225,15 @@ class Order(bundle.Bundle):
     def line_cls(cls):
         return order_line.OrderLine
 
+    @classmethod
+    def prefetch_names(cls):
+        return bundle.Bundle.prefetch_names() + [
+            "account",
+            "store",
+            "shipping_address",
+            "billing_address",
+        ]
+
     @classmethod
     def is_snapshot(cls):
         return True
@@ -428,6 +464,10 @@ class Order(bundle.Bundle):
             ],
         )
 
+    @classmethod
+    def _reservations(cls):
+        return appier.conf("BUDY_RESERVATIONS", True, cast=bool)
+
     @classmethod
     def _pproviders(cls):
         return appier.conf(
@@ -542,6 +582,7 @@ class Order(bundle.Bundle):
 
     def pre_delete(self):
         bundle.Bundle.pre_delete(self)
+        self.release_inventory_s()
         for line in self.lines:
             line.delete()
 
@@ -556,8 +597,9 @@ class Order(bundle.Bundle):
     def is_valid(self):
         # in case the current status of the current order is the
         # first one (created) the order is considered to be open
-        # and so the validation process must occur
-        if self.is_open():
+        # and so the validation process must occur, unless the stored
+        # version of the order is already closed (as the lines check)
+        if self.is_open() and not self._is_closed_stored():
             return bundle.Bundle.is_valid(self)
 
         # returns the true value on all other cases as the order lines
@@ -999,6 +1041,7 @@ class Order(bundle.Bundle):
     @appier.operation(name="Mark Waiting Payment")
     def mark_waiting_payment_s(self):
         self.verify_waiting_payment()
+        self.reserve_inventory_s()
         self.status = "waiting_payment"
         self.set_reference_f_s()
         self.save()
@@ -1041,6 +1084,7 @@ class Order(bundle.Bundle):
     @appier.operation(name="Mark Canceled")
     def mark_canceled_s(self):
         self.verify_canceled()
+        self.release_inventory_s()
         self.status = "canceled"
         self.save()
 
@@ -1068,8 +1112,38 @@ class Order(bundle.Bundle):
             return
         self.tracking_number = tracking_number
         self.tracking_url = tracking_url
+        self.tracking_next = 0
+        self.tracking_failures = 0
         self.save()
 
+    def schedule_tracking_s(self, next_check, failures=0):
+        """
+        Stores the tracking check schedule of the order, writing only
+        the schedule fields in the data source (no complete save).
+
+        :type next_check: int
+        :param next_check: The timestamp from which the tracking status
+        of the order should be checked again.
+        :type failures: int
+        :param failures: The number of consecutive failures checking the
+        tracking status (zero in case the last check succeeded).
+        """
+
+        self.tracking_checked = int(time.time())
+        self.tracking_next = int(next_check)
+        self.tracking_failures = failures
+        collection = self._get_store()
+        collection.update(
+            {"_id": self._id},
+            {
+                "$set": {
+                    "tracking_checked": self.tracking_checked,
+                    "tracking_next": self.tracking_next,
+                    "tracking_failures": self.tracking_failures,
+                }
+            },
+        )
+
     @appier.operation(name="Set Reference")
     def set_reference_s(self, force=False):
         if self.reference and not force:
@@ -1131,13 +1205,28 @@ class Order(bundle.Bundle):
     def decrement_inventory_s(self, force=False):
         if self.inventory_decremented and not force:
             return
+
+        # confirms the currently held reservations of the order, the
+        # stock for these lines has already been removed so there's
+        # no need to decrement it once again
+        reserved = set()
+        for _reservation in self.reservations(status="held"):
+            if not _reservation.confirm_s():
+                continue
+            reserved.add(_reservation.line.id)
+
+        # decrements the stock of the lines that are not covered by a
+        # reservation (eg: expired hold) using an atomic single field
+        # update, clamping the stock to zero in case it's not enough
         for line in self.lines:
+            if line.id in reserved:
+                continue
             if line.merchandise.quantity_hand == None:
                 continue
-            line.merchandise.quantity_hand = max(
-                line.merchandise.quantity_hand - line.quantity, 0
+            line.merchandise.advance_s(
+                "quantity_hand", line.quantity * -1, floor=0.0, clamp=True
             )
-            line.merchandise.save()
+
         self.inventory_decremented = True
         self.save()
 
@@ -1155,11 +1244,73 @@ class Order(bundle.Bundle):
         for line in self.lines:
             if line.merchandise.quantity_hand == None:
                 continue
-            line.merchandise.quantity_hand += line.quantity
-            line.merchandise.save()
+            line.merchandise.advance_s("quantity_hand", line.quantity)
         self.inventory_decremented = False
         self.save()
 
+    @appier.operation(
+        name="Reserve Inventory",
+        description="""Holds the inventory stock levels
+        according to order lines, the holds expire after
+        a certain amount of time if not confirmed""",
+        level=2,
+    )
+    def reserve_inventory_s(self):
+        cls = self.__class__
+        if not cls._reservations():
+            return
+        if self.inventory_decremented:
+            return
+        if self.reservations(status="held"):
+            return
+
+        # creates a reservation for each of the lines of the order and
+        # in case any of them fails (not enough stock) the ones that
+        # were already created are released, restoring their stock
+        reservations = []
+        try:
+            for line in self.lines:
+                _reservation = reservation.Reservation.hold_s(self, line)
+                if not _reservation:
+                    continue
+                reservations.append(_reservation)
+        except Exception:
+            for _reservation in reservations:
+                _reservation.release_s()
+            raise
+
+    @appier.operation(
+        name="Release Inventory",
+        description="""Releases the inventory stock levels
+        currently held by the order (not yet confirmed)""",
+        level=2,
+    )
+    def release_inventory_s(self):
+        for _reservation in self.reservations(status="held"):
+            _reservation.release_s()
+
+    @appier.view(name="Reservations")
+    def reservations_v(self, *args, **kwargs):
+        kwargs["sort"] = kwargs.get("sort", [("id", -1)])
+        kwargs.update(order=self.id)
+        return appier.lazy_dict(
+            model=reservation.Reservation,
+            kwargs=kwargs,
+            entities=appier.lazy(lambda: reservation.Reservation.find(*args, **kwargs)),
+            page=appier.lazy(lambda: reservation.Reservation.paginate(*args, **kwargs)),
+        )
+
+    def reservations(self, *args, **kwargs):
+        if self.is_new():
+            return []
+        return reservation.Reservation.find(order=self.id, *args, **kwargs)
+
+    def _is_closed_stored(self):
+        if self.is_new():
+            return False
+        order = self.__class__.get(id=self.id, fields=("status", "paid"), raise_e=False)
+        return order.is_closed() if order else False
+
     @appier.operation(
         name="Import Omni",
         parameters=(
@@ -1648,17 +1799,23 @@ class Order(bundle.Bundle):
             return currency
         if not self.shipping_country:
             return None
-        shipping_country = country.Country.get_by_code(self.shipping_country)
-        return shipping_country.currency_code
+        countries = country.Country.get_countries()
+        shipping_country = countries.get(self.shipping_country, None)
+        if not shipping_country:
+            shipping_country = country.Country.get_by_code(self.shipping_country)
+            return shipping_country.currency_code
+        return shipping_country["currency_code"]
 
     @property
     def payment_currency(self):
         currency = appier.conf("BUDY_CURRENCY", None)
         if currency:
             return currency
-        has_store_currency = self.store and self.store.currency_code
+        stores = store.Store.get_stores()
+        _store = stores.get(self.store.id, None) if self.store else None
+        has_store_currency = _store and _store.get("currency_code", None)
         if has_store_currency:
-            return self.store.currency_code
+            return _store["currency_code"]
         return self.shipping_currency
 
     def _pay(self, payment_data, payment_function=None, strict=True):
@@ -44,17 +44,21 @@ class OrderLine(bundle_line.BundleLine):
     def is_visible(cls):
         return False
 
-    def is_valid_quantity(self, reload=True):
-        order = self.order and self.order.reload() if reload else self.order
+    def is_valid_quantity(self, reload=True, merchandise=None, bundle=None):
+        order = self._get_order(reload=reload, bundle=bundle)
         if order and order.is_closed():
             return True
-        return bundle_line.BundleLine.is_valid_quantity(self, reload=reload)
+        return bundle_line.BundleLine.is_valid_quantity(
+            self, reload=reload, merchandise=merchandise, bundle=bundle
+        )
 
-    def is_valid_price(self, reload=True):
-        order = self.order and self.order.reload() if reload else self.order
+    def is_valid_price(self, reload=True, merchandise=None, bundle=None):
+        order = self._get_order(reload=reload, bundle=bundle)
         if order and order.is_closed():
             return True
-        return bundle_line.BundleLine.is_valid_price(self, reload=reload)
+        return bundle_line.BundleLine.is_valid_price(
+            self, reload=reload, merchandise=merchandise, bundle=bundle
+        )
 
     @appier.operation(name="Garbage Collect")
     def collect_s(self):
@@ -65,3 +69,8 @@ class OrderLine(bundle_line.BundleLine):
     @property
     def bundle(self):
         return self.order
+
+    def _get_order(self, reload=True, bundle=None):
+        if bundle:
+            return bundle
+        return self.order and self.order.reload() if reload else self.order
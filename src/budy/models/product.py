@@ -29,7 +29,10 @@ __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
 import json
+import time
+import bisect
 import commons
+import threading
 
 import appier
 import appier_extras
@@ -38,12 +41,57 @@ from . import base
 from . import bundle
 from . import currency as _currency
 
+QUOTES_TTL = 60.0
+""" The default amount of time (in seconds) the price quotes
+obtained from external price providers (eg: ripe) are kept in
+cache, should be small as these quotes may change frequently """
+
+QUOTES_SIZE = 4096
+""" The maximum number of price quotes kept in cache, once this
+value is reached the expired quotes are removed from it """
+
+FACETS = ("brand_s", "season_s", "color_s", "category_s", "collection_s", "labels")
+""" The denormalized fields of the product for which the counts
+per value are computed in the faceted navigation """
+
+AGGREGATES = ("quantity_hand", "price", "taxes", "price_compare")
+""" The fields of the product that are aggregated from the
+values of the same fields in its measurements """
+
+FACETS_TTL = 300.0
+""" The default time (in seconds) the facet counts of a filter are
+kept in cache, the cache is also invalidated on product changes """
+
+RELATED_SIZE = 24
+""" The number of neighbours (following products of its group)
+kept for each product in the related index, this is also the
+largest limit of related products served from the index """
+
+RELATED_VARIANTS = ("all", "available")
+""" The variants of the neighbours kept for each product in the
+related index, either any of the (enabled) products of the group
+or only the ones that are available (with stock) """
+
 
 class Product(base.BudyBase):
     GENDER_S = {"Male": "Male", "Female": "Female", "Child": "Child", "Both": "Both"}
     """ The dictionary that maps the multiple gender
     enumeration values with their string representation """
 
+    _quotes = dict()
+    """ The cache of the price quotes obtained from external
+    price providers, mapping the quote key with a tuple that
+    contains the expiration timestamp and the quote """
+
+    _quotes_pending = dict()
+    """ The map of the price quotes that are currently being
+    retrieved (in flight), so that concurrent identical requests
+    wait for the same remote call """
+
+    _quotes_lock = threading.RLock()
+    """ The lock that controls the access to the quotes cache
+    and to the pending (in flight) quotes """
+
     short_description = appier.field(
         index="hashed",
         default=True,
@@ -236,6 +284,31 @@ class Product(base.BudyBase):
 
     live_model = appier.field(type=appier.references("LiveModel", name="id"))
 
+    @classmethod
+    def setup(cls):
+        super(Product, cls).setup()
+        store = cls._collection(name="related")
+        store.ensure_index("key", direction=1)
+
+    @classmethod
+    def teardown(cls):
+        super(Product, cls).teardown()
+        with cls._quotes_lock:
+            cls._quotes.clear()
+        cls.clear_cached()
+
+    @classmethod
+    def is_cached(cls):
+        return True
+
+    @classmethod
+    def is_catalog(cls):
+        return True
+
+    @classmethod
+    def is_searchable(cls):
+        return True
+
     @classmethod
     def validate(cls):
         return super(Product, cls).validate() + [
@@ -590,11 +663,380 @@ class Product(base.BudyBase):
             cls.delete_c()
         cls._csv_import(file, callback)
 
+    @classmethod
+    def facets(cls, *args, **kwargs):
+        """
+        Computes the counts per value of each of the facets (brand,
+        season, color, category, collection and labels) for the enabled
+        products matching the provided filter (find keyword arguments).
+
+        For Mongo the counts are computed with a single aggregation, for
+        other adapters (eg: tiny) the products are counted in memory, the
+        result is cached per normalized filter.
+
+        :rtype: Dictionary
+        :return: The map with the total number of matching products and
+        the list of value and count maps per facet (most common first).
+        """
+
+        # normalizes the filter, removing the pagination and converting
+        # the find values into the data source filter so that the same
+        # filter always results in the same cache key
+        for name in ("skip", "limit", "sort"):
+            kwargs.pop(name, None)
+        find_d = kwargs.get("find_d", None)
+        if isinstance(find_d, list):
+            kwargs["find_d"] = sorted(find_d)
+        kwargs["enabled"] = True
+        cls._find_s(kwargs)
+        cls._find_d(kwargs)
+
+        key = "facets:" + json.dumps(kwargs, sort_keys=True, default=str)
+        ttl = appier.conf("BUDY_FACETS_TTL", FACETS_TTL, cast=float)
+        return cls.get_cached(key, lambda: cls._build_facets(kwargs), ttl=ttl)
+
+    @classmethod
+    @appier.operation(name="Index Related")
+    def index_related_s(cls):
+        # gathers the ids of the enabled products of each related group (and
+        # of the available ones) in memory, iterating over the products in
+        # chunks, notice that a product belongs to every group of it but its
+        # neighbours are the ones of its first group
+        groups = dict()
+        keys = dict()
+        for products in cls.find_chunks():
+            for product in products:
+                _keys = product._get_related_keys()
+                if _keys:
+                    keys[product.id] = _keys[0]
+                if not product._is_related_enabled():
+                    continue
+                available = product._is_related_available()
+                for key in _keys:
+                    group = groups.setdefault(key, dict(all=[], available=[]))
+                    group["all"].append(product.id)
+                    if available:
+                        group["available"].append(product.id)
+
+        # replaces the previous contents of the related collection with the
+        # newly computed neighbours of each product (complete re-indexing)
+        store = cls._collection(name="related")
+        store.remove({})
+        for id, key in keys.items():
+            group = groups.get(key, dict(all=[], available=[]))
+            model = dict(_id=id, key=key)
+            for variant in RELATED_VARIANTS:
+                ids = sorted(group[variant])
+                index = bisect.bisect_right(ids, id)
+                after = ids[index : index + RELATED_SIZE]
+                head = ids[: RELATED_SIZE * 2 + 1]
+                model[variant] = cls._get_related_neighbours(id, after, head)
+            store.insert(model)
+
+    @classmethod
+    @appier.operation(name="Index Search")
+    def index_search_s(cls):
+        cls.index_search()
+
     @classmethod
     @appier.link(name="Export Simple")
     def simple_csv_url(cls, absolute=False):
         return appier.get_app().url_for("product_api.simple_csv", absolute=absolute)
 
+    @classmethod
+    def _build_facets(cls, filter):
+        if cls._is_mongo():
+            facets = dict(total=[{"$count": "count"}])
+            for name in FACETS:
+                pipeline = [{"$unwind": "$" + name}] if name == "labels" else []
+                pipeline.append({"$group": {"_id": "$" + name, "count": {"$sum": 1}}})
+                facets[name] = pipeline
+            result = cls._aggregate([{"$match": filter}, {"$facet": facets}])
+            result = result[0] if result else dict()
+            total = result.get("total", [])
+            counts = dict(
+                (
+                    name,
+                    dict((item["_id"], item["count"]) for item in result.get(name, [])),
+                )
+                for name in FACETS
+            )
+            total = total[0]["count"] if total else 0
+        else:
+            counts = dict((name, dict()) for name in FACETS)
+            products = cls.find(map=True, **filter)
+            for product in products:
+                for name in FACETS:
+                    values = product.get(name, None)
+                    values = values if isinstance(values, list) else [values]
+                    for value in values:
+                        counts[name][value] = counts[name].get(value, 0) + 1
+            total = len(products)
+
+        # converts the counts into the sorted (most common first) lists of
+        # values per facet, ignoring the products without value
+        result = dict(total=total)
+        for name in FACETS:
+            items = [
+                dict(value=value, count=count)
+                for value, count in counts[name].items()
+                if not value == None
+            ]
+            items.sort(key=lambda item: (-item["count"], item["value"]))
+            result[name[:-2] if name.endswith("_s") else name] = items
+        return result
+
+    @classmethod
+    def _get_quote(cls, key, builder):
+        """
+        Retrieves the price quote for the provided key, either from the
+        quotes cache or by calling the builder (remote call) in case the
+        quote is not cached or has expired.
+
+        Concurrent requests for the same key share a single call to
+        the builder, the ones that arrive while the call is in flight
+        wait for its result (or exception).
+
+        :type key: Tuple
+        :param key: The (hashable) key that identifies the quote.
+        :type builder: Function
+        :param builder: The function to be called (without arguments)
+        to retrieve the quote from the remote price provider.
+        :rtype: Object
+        :return: The price quote for the provided key.
+        """
+
+        # tries to retrieve the quote from cache and in case it does not
+        # exist checks if there's a pending (in flight) call for the key,
+        # registering a new one in case there's none
+        with cls._quotes_lock:
+            quote = cls._quotes.get(key, None)
+            if quote and quote[0] > time.time():
+                return quote[1]
+            pending = cls._quotes_pending.get(key, None)
+            is_owner = pending == None
+            if is_owner:
+                pending = dict(event=threading.Event(), result=None, exception=None)
+                cls._quotes_pending[key] = pending
+
+        # in case there's already a call in flight for the key waits for
+        # it to finish and re-uses its result (or exception)
+        if not is_owner:
+            pending["event"].wait()
+            if pending["exception"]:
+                raise pending["exception"]
+            return pending["result"]
+
+        # runs the remote call and stores its result in cache, unblocking
+        # the other requests waiting for the same quote at the end
+        try:
+            result = builder()
+            pending["result"] = result
+            cls._set_quote(key, result)
+            return result
+        except Exception as exception:
+            pending["exception"] = exception
+            raise
+        finally:
+            with cls._quotes_lock:
+                del cls._quotes_pending[key]
+            pending["event"].set()
+
+    @classmethod
+    def _set_quote(cls, key, quote):
+        current = time.time()
+        ttl = appier.conf("BUDY_QUOTES_TTL", QUOTES_TTL, cast=float)
+        with cls._quotes_lock:
+            if len(cls._quotes) >= QUOTES_SIZE:
+                for _key, _quote in list(cls._quotes.items()):
+                    if _quote[0] > current:
+                        continue
+                    del cls._quotes[_key]
+            if len(cls._quotes) >= QUOTES_SIZE:
+                cls._quotes.clear()
+            cls._quotes[key] = (current + ttl, quote)
+
+    @classmethod
+    def _get_related_keys_m(cls, model):
+        keys = []
+        for name in ("collections", "categories", "colors"):
+            values = model.get(name, None) or []
+            for value in values:
+                if value == None:
+                    continue
+                keys.append("%s:%s" % (name, value))
+        for name in ("brand", "season"):
+            value = model.get(name, None)
+            if value == None:
+                continue
+            keys.append("%s:%s" % (name, value))
+        return keys
+
+    @classmethod
+    def _get_related_ids(
+        cls, key, available=False, gt=None, lt=None, reverse=False, limit=0
+    ):
+        # retrieves the sorted ids of the enabled (and optionally available)
+        # products of the related group within the provided bounds, for Mongo
+        # this is a single (limited) query and for the other adapters (eg:
+        # tiny) the raw products are scanned and filtered locally
+        store = cls._collection()
+        if cls._is_mongo():
+            name, value = key.split(":", 1)
+            filter = {name: int(value), "enabled": {"$ne": False}}
+            if available:
+                filter["quantity_hand"] = {"$gt": 0}
+            bounds = dict()
+            if not gt == None:
+                bounds["$gt"] = gt
+            if not lt == None:
+                bounds["$lt"] = lt
+            if bounds:
+                filter["id"] = bounds
+            models = store.find(
+                filter,
+                {"id": 1},
+                sort=[("id", -1 if reverse else 1)],
+                limit=limit,
+            )
+            return [model["id"] for model in models]
+        ids = []
+        for model in store.find({}):
+            if model.get("enabled", True) == False:
+                continue
+            if available and not (model.get("quantity_hand", None) or 0) > 0:
+                continue
+            if not gt == None and not model["id"] > gt:
+                continue
+            if not lt == None and not model["id"] < lt:
+                continue
+            if not key in cls._get_related_keys_m(model):
+                continue
+            ids.append(model["id"])
+        ids.sort(reverse=reverse)
+        return ids[:limit] if limit else ids
+
+    @classmethod
+    def _get_related_neighbours(cls, id, after, head):
+        # the head of the group (first ids) is only required by the products
+        # with less than the maximum number of neighbours after them, as for
+        # these the related window is shifted back (see `related()`)
+        after = after[:RELATED_SIZE]
+        if len(after) == RELATED_SIZE:
+            return dict(after=after, head=[])
+        head = [_id for _id in head if not _id == id]
+        return dict(after=after, head=head[: RELATED_SIZE * 2])
+
+    @classmethod
+    def _find_related(cls, key, gt=None, lt=None):
+        store = cls._collection(name="related")
+        if cls._is_mongo():
+            filter = dict(key=key)
+            bounds = dict()
+            if not gt == None:
+                bounds["$gt"] = gt
+            if not lt == None:
+                bounds["$lt"] = lt
+            if bounds:
+                filter["_id"] = bounds
+            return list(store.find(filter))
+        return [
+            model
+            for model in store.find(dict(key=key))
+            if (gt == None or model["_id"] > gt) and (lt == None or model["_id"] < lt)
+        ]
+
+    @classmethod
+    def _set_related(cls, id, values):
+        store = cls._collection(name="related")
+        if cls._is_mongo():
+            store.update({"_id": id}, {"$set": values}, upsert=True)
+            return
+        if store.find_one({"_id": id}):
+            store.update({"_id": id}, {"$set": values})
+        else:
+            store.insert(dict(values, _id=id))
+
+    @classmethod
+    def _index_related_group(cls, key, id, variants):
+        """
+        Updates the neighbours of the products of the related group
+        (with the group as their first one) affected by the change in
+        the membership of the product with the provided id.
+
+        The affected products are the ones that have the product among
+        their neighbours (the ones before it in the group) and, if the
+        head of the group has changed, the ones at the tail of the group
+        (that hold its head), both ranges span at most the related size
+        of group members (the ids of these are read with limited queries).
+
+        :type key: String
+        :param key: The key of the related group (eg: collections:1).
+        :type id: int
+        :param id: The id of the product whose membership has changed.
+        :type variants: List
+        :param variants: The variants (all or available) for which the
+        membership of the product has changed.
+        """
+
+        size = RELATED_SIZE
+
+        for variant in variants:
+            available = variant == "available"
+
+            # retrieves the window of ids of the group that covers the
+            # products with the changed product as neighbour (after the id
+            # that has size ids between it and the product), the tail of the
+            # group (ids after the one with size ids after it) and its head
+            before = cls._get_related_ids(
+                key, available=available, lt=id, reverse=True, limit=size + 1
+            )
+            start = before[-1] if len(before) == size + 1 else None
+            window = cls._get_related_ids(
+                key, available=available, gt=start, limit=size * 2 + 1
+            )
+            tail = cls._get_related_ids(
+                key, available=available, reverse=True, limit=size + 1
+            )
+            end = tail[-1] if len(tail) == size + 1 else None
+            head = cls._get_related_ids(key, available=available, limit=size * 2 + 1)
+
+            # the products at the tail of the group only need to be updated
+            # in case the head of the group has changed (product is part of it)
+            models = cls._find_related(key, gt=start, lt=id)
+            if len(head) < size * 2 + 1 or id <= head[-1]:
+                models += cls._find_related(key, gt=end)
+
+            # re-computes the neighbours of each of the affected products
+            # from the retrieved ids, notice that the same product may be
+            # both before the changed product and at the tail of the group
+            updated = set()
+            for model in models:
+                _id = model["_id"]
+                if _id in updated or _id == id:
+                    continue
+                updated.add(_id)
+                source = tail if end == None or _id > end else window
+                after = sorted(value for value in source if value > _id)
+                neighbours = cls._get_related_neighbours(_id, after, head)
+                cls._set_related(_id, {variant: neighbours})
+
+    @classmethod
+    def _index_related_product(cls, id, key):
+        values = dict(key=key)
+        for variant in RELATED_VARIANTS:
+            available = variant == "available"
+            after = cls._get_related_ids(
+                key, available=available, gt=id, limit=RELATED_SIZE
+            )
+            head = []
+            if len(after) < RELATED_SIZE:
+                head = cls._get_related_ids(
+                    key, available=available, limit=RELATED_SIZE * 2 + 1
+                )
+            values[variant] = cls._get_related_neighbours(id, after, head)
+        cls._set_related(id, values)
+
     @classmethod
     def _build(cls, model, map):
         super(Product, cls)._build(model, map)
@@ -625,6 +1067,11 @@ class Product(base.BudyBase):
             model[label] = label
             model[label + "_s"] = "true"
 
+    def __setattr__(self, name, value):
+        base.BudyBase.__setattr__(self, name, value)
+        if name in ("measurements", "images"):
+            self._reset_lookups(name=name)
+
     def pre_validate(self):
         base.BudyBase.pre_validate(self)
         self.build_images()
@@ -635,32 +1082,13 @@ class Product(base.BudyBase):
         base.BudyBase.pre_save(self)
         if not self.measurements:
             return
-        quantities_hand = [
-            measurement.quantity_hand or 0.0
-            for measurement in self.measurements
-            if hasattr(measurement, "quantity_hand")
-            and not measurement.quantity_hand == None
-        ]
-        prices = [
-            measurement.price or 0.0
-            for measurement in self.measurements
-            if hasattr(measurement, "price") and not measurement.price == None
-        ]
-        taxes = [
-            measurement.taxes or 0.0
-            for measurement in self.measurements
-            if hasattr(measurement, "taxes") and not measurement.taxes == None
-        ]
-        prices_compare = [
-            measurement.price_compare or 0.0
-            for measurement in self.measurements
-            if hasattr(measurement, "price_compare")
-            and not measurement.price_compare == None
-        ]
-        self.quantity_hand = sum(quantities_hand) if quantities_hand else None
-        self.price = max(prices) if prices else 0.0
-        self.taxes = max(taxes) if taxes else 0.0
-        self.price_compare = max(prices_compare) if prices_compare else None
+
+        # the (complete) aggregates are only rebuilt in case the list of
+        # measurements has changed, changes in the measurements themselves
+        # are propagated incrementally (see `update_aggregates_s()`) and
+        # the loaded aggregates are otherwise not persisted (see `_filter()`)
+        if self._is_measurements_changed():
+            self._build_aggregates()
 
         # in case the product is orderable then the quantity on hand must
         # be forced to be greater than zero so that the product can be
@@ -668,8 +1096,34 @@ class Product(base.BudyBase):
         # considered to be a "hack"
         if self.orderable and self.quantity_hand <= 0:
             self.quantity_hand = 1
+            self.__dict__["_aggregates"] = True
+
+    def pre_create(self):
+        base.BudyBase.pre_create(self)
+
+        # marks the product as not yet indexed in the related index, so
+        # that the apply run after its insertion does not mark it with
+        # its new state (the complete related state is indexed)
+        self.__dict__["_related"] = None
+
+    def post_save(self):
+        base.BudyBase.post_save(self)
+        self.__dict__.pop("_aggregates", None)
+        self._index_related()
+        self._mark_measurements(force=True)
+
+    def post_delete(self):
+        base.BudyBase.post_delete(self)
+        self._unindex_related()
+
+    def post_apply(self):
+        base.BudyBase.post_apply(self)
+        self._reset_lookups()
+        self._mark_measurements()
+        self._mark_related()
 
     def build_images(self):
+        self._reset_lookups(name="images")
         thumbnail = self.get_image(size="thumbnail", order=1)
         thumbnail = thumbnail or self.get_image(size="thumbnail")
         image = self.get_image(size="large", order=1)
@@ -693,6 +1147,54 @@ class Product(base.BudyBase):
         self._build_labels(self.collections)
 
     def related(self, limit=6, available=True, enabled=True):
+        """
+        Retrieves the products related with the current one, that are
+        the ones that follow it (by id) in its related group (first
+        collection, category, color, brand or season), once the end of
+        the group is reached the window is shifted back (tail offset).
+
+        The neighbours of the product are obtained from the related
+        index (single lookup) falling back to the counting of the
+        products in the group in case the product is not grouped, not
+        yet indexed or the limit is larger than the indexed neighbours.
+
+        :type limit: int
+        :param limit: The maximum number of related products.
+        :type available: bool
+        :param available: If only products with stock should be returned.
+        :type enabled: bool
+        :param enabled: If only enabled products should be returned.
+        :rtype: List
+        :return: The list of maps representing the related products.
+        """
+
+        cls = self.__class__
+        key = self._get_related_key()
+        store = cls._collection(name="related")
+        indexed = key and enabled and limit <= RELATED_SIZE
+        model = store.find_one({"_id": self.id}) if indexed else None
+        if not model or not model.get("key", None) == key:
+            return self._related_scan(limit=limit, available=available, enabled=enabled)
+
+        # selects the window of ids from the neighbours of the product, in
+        # case there are enough products after it these are used, otherwise
+        # the window is shifted back (as the scan does) and taken from the
+        # head of the group, notice that the tail offset is the number of
+        # products after the current one minus the ones missing for limit
+        neighbours = model.get("available" if available else "all", dict())
+        after = neighbours.get("after", [])
+        if len(after) >= limit:
+            ids = after[:limit]
+        else:
+            skip = max(len(after) * 2 - limit, 0)
+            ids = neighbours.get("head", [])[skip : skip + limit]
+        if not ids:
+            return []
+
+        # runs a single query for the selected products (sorted by id)
+        return cls.find_ids(ids, eager=("images",), map=True, enabled=True)
+
+    def _related_scan(self, limit=6, available=True, enabled=True):
         cls = self.__class__
         kwargs = dict()
         if available:
@@ -720,20 +1222,77 @@ class Product(base.BudyBase):
         products = find(eager=("images",), skip=skip, limit=limit, map=True, **kwargs)
         return products
 
+    def advance_s(self, name, delta, *args, **kwargs):
+        value = base.BudyBase.advance_s(self, name, delta, *args, **kwargs)
+        if name == "quantity_hand" and not value == None:
+            self._index_related_available()
+        return value
+
+    def update_aggregates_s(self, previous=None, current=None):
+        """
+        Updates the aggregates of the product (quantity on hand, price,
+        taxes and price compare) after a change in one of its measurements,
+        writing only the aggregate fields in the data source (no whole
+        product rewrite).
+
+        In case the previous and current values of the aggregate fields
+        of the changed measurement are provided, the change is applied as
+        a single atomic delta (increment of the quantity and maximum of
+        the prices) without reading the other measurements. Otherwise (or
+        if the delta is not applicable, eg: price decrease) the aggregates
+        are re-computed from the persisted state of the measurements,
+        retrieved with a single query.
+
+        :type previous: Dictionary
+        :param previous: The previous values of the aggregate fields of
+        the changed measurement.
+        :type current: Dictionary
+        :param current: The current values of the aggregate fields of
+        the changed measurement.
+        :rtype: bool
+        :return: If any of the aggregates of the product has changed.
+        """
+
+        if not self.measurements:
+            return False
+
+        # tries to apply the change of the measurement as an atomic delta
+        # over the product, which avoids both the read of the complete set
+        # of measurements and the lost updates of concurrent changes
+        modification = self._get_aggregates_delta(previous, current)
+        if not modification == None:
+            return self._apply_aggregates_delta(modification)
+
+        names = AGGREGATES
+        previous = dict((name, getattr(self, name, None)) for name in names)
+
+        measurement_cls = self.measurements._target
+        measurements = measurement_cls.find_ids(self.measurements.ids)
+        self._build_aggregates(measurements=measurements)
+        if self.orderable and self.quantity_hand <= 0:
+            self.quantity_hand = 1
+
+        values = dict(
+            (name, None if getattr(self, name) == None else float(getattr(self, name)))
+            for name in names
+            if not getattr(self, name) == previous[name]
+        )
+        if not values:
+            return False
+
+        self.__dict__.pop("_aggregates", None)
+
+        store = self._get_store()
+        store.update({"_id": self._id}, {"$set": values})
+        if "quantity_hand" in values:
+            self._index_related_available()
+        self._invalidate_cached()
+        self._invalidate_catalog()
+        return True
+
     def get_measurement(self, value, name=None):
-        for measurement in self.measurements:
-            if not measurement:
-                continue
-            if not hasattr(measurement, "value"):
-                continue
-            if not hasattr(measurement, "name"):
-                continue
-            if not measurement.value == value:
-                continue
-            if not measurement.name == name:
-                continue
-            return measurement
-        return None
+        lookup = self._get_lookup("measurements", self._build_measurements)
+        return lookup.get((value, name), None)
 
     def get_price(self, currency=None, country=None, attributes=None):
         if not self.price_provider:
@@ -770,6 +1329,7 @@ class Product(base.BudyBase):
         return total["ddp"] + total["vat"]
 
     def get_availability_ripe(self, currency=None, country=None, attributes=None):
+        cls = self.__class__
         attributes_m = json.loads(attributes)
         p = []
         parts = attributes_m.get("parts", {})
@@ -792,7 +1352,19 @@ class Product(base.BudyBase):
         if letters:
             params["letters"] = letters
 
-        result = appier.get(self.price_url, params=params)
+        # builds the key that identifies the quote and uses it to obtain
+        # the quote from cache or from the remote price provider, notice
+        # that identical concurrent requests share the same remote call
+        key = (
+            self.price_url,
+            self.product_id,
+            tuple(sorted(p)),
+            embossing,
+            letters,
+            currency,
+            country,
+        )
+        result = cls._get_quote(key, lambda: appier.get(self.price_url, params=params))
         return result
 
     def get_currency(self, currency=None):
@@ -805,21 +1377,8 @@ class Product(base.BudyBase):
         return self.currency or currency
 
     def get_image(self, size=None, order=None):
-        for image in self.images:
-            if not image:
-                continue
-            if not hasattr(image, "size"):
-                continue
-            if not hasattr(image, "order"):
-                continue
-            is_size = size == None or image.size == size
-            if not is_size:
-                continue
-            is_order = order == None or image.order == order
-            if not is_order:
-                continue
-            return image
-        return None
+        lookup = self._get_lookup("images", self._build_images)
+        return lookup.get((size, order), None)
 
     def get_size(self, currency=None, country=None, attributes=None):
         if not self.price_provider:
@@ -878,6 +1437,7 @@ class Product(base.BudyBase):
         if image in self.images:
             return
         self.images.append(image)
+        self._reset_lookups(name="images")
         self.save()
 
     @appier.operation(
@@ -890,12 +1450,46 @@ class Product(base.BudyBase):
         if not image in self.images:
             return
         self.images.remove(image)
+        self._reset_lookups(name="images")
+        self.save()
+
+    def add_measurement_s(self, measurement):
+        if not measurement:
+            return
+        if measurement in self.measurements:
+            return
+        self.measurements.append(measurement)
+        self._reset_lookups(name="measurements")
+        self.save()
+
+    def remove_measurement_s(self, measurement):
+        if not measurement:
+            return
+        if not measurement in self.measurements:
+            return
+        self.measurements.remove(measurement)
+        self._reset_lookups(name="measurements")
         self.save()
 
     @appier.operation(name="Fix")
     def fix_s(self):
         if not self.exists():
             return
+        self._build_aggregates()
+        self.save()
+
+    @appier.operation(name="Aggregate Measurements")
+    def aggregate_s(self):
+        """
+        Runs the complete re-computation of the aggregates of the product
+        (quantity on hand, price, taxes and price compare) from the
+        current state of its measurements, persisting the product.
+
+        This is considered a repair operation as the aggregates are
+        kept up-to-date incrementally as the measurements change.
+        """
+
+        self._build_aggregates()
         self.save()
 
     @appier.operation(name="Ensure Quantity", level=2, devel=True)
@@ -1018,6 +1612,116 @@ class Product(base.BudyBase):
                     continue
                 self.labels.append(label)
 
+    def _get_related_keys(self):
+        cls = self.__class__
+        model = dict()
+        for name in ("collections", "categories", "colors"):
+            values = getattr(self, name, None) or []
+            model[name] = [value.id for value in values if value]
+        for name in ("brand", "season"):
+            value = getattr(self, name, None)
+            model[name] = value.id if value else None
+        return cls._get_related_keys_m(model)
+
+    def _get_related_key(self):
+        keys = self._get_related_keys()
+        return keys[0] if keys else None
+
+    def _get_related_state(self):
+        return (
+            tuple(self._get_related_keys()),
+            self._is_related_available(),
+            self._is_related_enabled(),
+        )
+
+    def _is_related_available(self):
+        quantity_hand = getattr(self, "quantity_hand", None)
+        return True if quantity_hand and quantity_hand > 0 else False
+
+    def _is_related_enabled(self):
+        return False if getattr(self, "enabled", True) == False else True
+
+    def _mark_related(self, force=False):
+        if not force and "_related" in self.__dict__:
+            return
+        if self.is_new():
+            return
+        for name in ("collections", "categories", "colors", "brand", "season"):
+            if not name in self.model:
+                return
+        self.__dict__["_related"] = self._get_related_state()
+
+    def _index_related(self):
+        previous = self.__dict__.get("_related", None)
+        current = self._get_related_state()
+        self._update_related(previous, current)
+        self.__dict__["_related"] = current
+
+    def _index_related_available(self):
+        # uses the last indexed groups of the product (not the possibly
+        # changed in memory ones) as only the availability has changed,
+        # in case there's no indexed state the availability is considered
+        # to have flipped (safe approach)
+        available = self._is_related_available()
+        previous = self.__dict__.get("_related", None)
+        if previous == None:
+            keys, _available, enabled = self._get_related_state()
+            previous = (keys, not available, enabled)
+        current = (previous[0], available, previous[2])
+        self._update_related(previous, current)
+        self.__dict__["_related"] = current
+
+    def _unindex_related(self):
+        cls = self.__class__
+        previous = self.__dict__.get("_related", None)
+        previous = previous or self._get_related_state()
+        self._update_related(previous, ((), False, False))
+        store = cls._collection(name="related")
+        store.remove({"_id": self.id})
+        self.__dict__.pop("_related", None)
+
+    def _update_related(self, previous, current):
+        cls = self.__class__
+
+        # in case there's no previous state the product is considered not
+        # to be a member of any group (eg: new product), forcing its own
+        # neighbours to be computed
+        own = previous == None
+        previous = previous or ((), False, False)
+        keys_p, available_p, enabled_p = previous
+        keys_c, available_c, enabled_c = current
+
+        # iterates over the groups of both states and for each of them
+        # determines the variants (all or available products) for which
+        # the membership of the product has flipped, only these are going
+        # to have the neighbours of the affected products updated
+        for key in sorted(set(keys_p) | set(keys_c)):
+            variants = []
+            for variant in RELATED_VARIANTS:
+                available = variant == "available"
+                member_p = key in keys_p and enabled_p
+                member_p = member_p and (available_p or not available)
+                member_c = key in keys_c and enabled_c
+                member_c = member_c and (available_c or not available)
+                if member_p == member_c:
+                    continue
+                variants.append(variant)
+            if not variants:
+                continue
+            cls._index_related_group(key, self.id, variants)
+
+        # in case the group of the product (first one) has changed then its
+        # own neighbours must be re-computed, as they belong to other group
+        key_p = keys_p[0] if keys_p else None
+        key_c = keys_c[0] if keys_c else None
+        if not own and key_p == key_c:
+            return
+        if key_c:
+            cls._index_related_product(self.id, key_c)
+        else:
+            store = cls._collection(name="related")
+            store.remove({"_id": self.id})
+
     def _get_offset(self, count, limit, kwargs):
         return self._get_offset_offset(count, limit, kwargs)
 
@@ -1030,3 +1734,198 @@ class Product(base.BudyBase):
         kwargs["id"] = {"$lt": self.id}
         offset = cls.count(**kwargs)
         return offset
+
+    def _build_aggregates(self, measurements=None):
+        measurements = self.measurements if measurements == None else measurements
+        if not measurements:
+            return
+        quantities_hand = [
+            measurement.quantity_hand or 0.0
+            for measurement in measurements
+            if hasattr(measurement, "quantity_hand")
+            and not measurement.quantity_hand == None
+        ]
+        prices = [
+            measurement.price or 0.0
+            for measurement in measurements
+            if hasattr(measurement, "price") and not measurement.price == None
+        ]
+        taxes = [
+            measurement.taxes or 0.0
+            for measurement in measurements
+            if hasattr(measurement, "taxes") and not measurement.taxes == None
+        ]
+        prices_compare = [
+            measurement.price_compare or 0.0
+            for measurement in measurements
+            if hasattr(measurement, "price_compare")
+            and not measurement.price_compare == None
+        ]
+        self.quantity_hand = sum(quantities_hand) if quantities_hand else None
+        self.price = max(prices) if prices else 0.0
+        self.taxes = max(taxes) if taxes else 0.0
+        self.price_compare = max(prices_compare) if prices_compare else None
+        self.__dict__["_aggregates"] = True
+
+    def _filter(self, *args, **kwargs):
+        model = base.BudyBase._filter(self, *args, **kwargs)
+
+        # in case this is an update of a product with measurements for which
+        # the aggregates have not been rebuilt removes them from the persisted
+        # model, as they may have been (incrementally) changed since the load
+        if not kwargs.get("immutables_a", False):
+            return model
+        if not self.measurements:
+            return model
+        if self.__dict__.get("_aggregates", False):
+            return model
+        for name in AGGREGATES:
+            model.pop(name, None)
+        return model
+
+    def _is_measurements_changed(self):
+        if self.is_new():
+            return True
+
+        # uses the ids of the measurements as loaded (or last saved) by
+        # this instance, falling back to the stored ones only in case the
+        # instance has not been loaded from the data source
+        previous = self.__dict__.get("_measurements", None)
+        if previous == None:
+            store = self._get_store()
+            stored = store.find_one({"_id": self._id}) or dict()
+            previous = stored.get("measurements", [])
+        return not previous == self.measurements.ids
+
+    def _mark_measurements(self, force=False):
+        if not force and "_measurements" in self.__dict__:
+            return
+        if self.is_new():
+            return
+        measurements = self.model.get("measurements", None)
+        if measurements == None:
+            return
+        self.__dict__["_measurements"] = list(self.measurements.ids)
+
+    def _get_aggregates_delta(self, previous, current):
+        # the delta can only be applied when both states of the measurement
+        # are known and the product is not orderable (forced quantity)
+        if previous == None or current == None:
+            return None
+        if self.orderable:
+            return None
+
+        # builds the atomic modification for the changed fields, the sum
+        # of the quantities is incremented while the prices (maximums) can
+        # only be raised, any other change requires a complete re-computation
+        increments = dict()
+        maximums = dict()
+        for name in AGGREGATES:
+            _previous = previous.get(name, None)
+            _current = current.get(name, _previous)
+            if _previous == _current:
+                continue
+            value = getattr(self, name, None)
+            if _previous == None or _current == None or value == None:
+                return None
+            if name == "quantity_hand":
+                increments[name] = float(_current) - float(_previous)
+            elif _current > _previous:
+                maximums[name] = float(_current)
+            else:
+                return None
+
+        modification = dict()
+        if increments:
+            modification["$inc"] = increments
+        if maximums:
+            modification["$max"] = maximums
+        return modification
+
+    def _apply_aggregates_delta(self, modification):
+        if not modification:
+            return False
+        store = self._get_store()
+        value = store.find_and_modify({"_id": self._id}, modification, new=True)
+        if not value:
+            return False
+        names = list(modification.get("$inc", {})) + list(modification.get("$max", {}))
+        for name in names:
+            setattr(self, name, value[name])
+        if "quantity_hand" in names:
+            self._index_related_available()
+        self._invalidate_cached()
+        self._invalidate_catalog()
+        return True
+
+    def _get_lookup(self, name, builder):
+        """
+        Retrieves the (in memory) lookup map for the list field with
+        the provided name, building it with the provided builder if
+        there's no valid lookup for the current list.
+
+        The lookups are stored in the instance (outside of the model)
+        and must be explicitly reset whenever the list changes (see
+        `_reset_lookups()`), which the setters and the add and remove
+        methods of the product already do.
+
+        :type name: String
+        :param name: The name of the list field to retrieve the lookup.
+        :type builder: Function
+        :param builder: The function that builds the lookup map from
+        the list of items.
+        :rtype: Dictionary
+        :return: The lookup map for the current list of items.
+        """
+
+        lookups = self.__dict__.setdefault("_lookups", dict())
+        lookup = lookups.get(name, None)
+        if not lookup == None:
+            return lookup
+        items = getattr(self, name, None) or []
+        lookup = builder(items)
+        lookups[name] = lookup
+        return lookup
+
+    def _reset_lookups(self, name=None):
+        lookups = self.__dict__.get("_lookups", None)
+        if not lookups:
+            return
+        if name:
+            lookups.pop(name, None)
+        else:
+            lookups.clear()
+
+    def _build_measurements(self, measurements):
+        lookup = dict()
+        for measurement in measurements:
+            if not measurement:
+                continue
+            if not hasattr(measurement, "value"):
+                continue
+            if not hasattr(measurement, "name"):
+                continue
+            key = (measurement.value, measurement.name)
+            lookup.setdefault(key, measurement)
+        return lookup
+
+    def _build_images(self, images):
+        # registers each image under its exact (size, order) pair and
+        # under the wildcard variants (where none means any value) so
+        # that the first image in the list wins, as in a linear scan
+        lookup = dict()
+        for image in images:
+            if not image:
+                continue
+            if not hasattr(image, "size"):
+                continue
+            if not hasattr(image, "order"):
+                continue
+            for key in (
+                (image.size, image.order),
+                (image.size, None),
+                (None, image.order),
+                (None, None),
+            ):
+                lookup.setdefault(key, image)
+        return lookup
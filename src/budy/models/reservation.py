@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Hive Budy
+# Copyright (c) 2008-2024 Hive Solutions Lda.
+#
+# This file is part of Hive Budy.
+#
+# Hive Budy is free software: you can redistribute it and/or modify
+# it under the terms of the Apache License as published by the Apache
+# Foundation, either version 2.0 of the License, or (at your option) any
+# later version.
+#
+# Hive Budy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# Apache License for more details.
+#
+# You should have received a copy of the Apache License along with
+# Hive Budy. If not, see <http://www.apache.org/licenses/>.
+
+__author__ = "João Magalhães <joamag@hive.pt>"
+""" The author(s) of the module """
+
+__copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
+""" The copyright for the module """
+
+__license__ = "Apache License, Version 2.0"
+""" The license for the module """
+
+import time
+import commons
+
+import appier
+
+from . import base
+
+
+class Reservation(base.BudyBase):
+    """
+    Represents a temporary hold of stock (inventory) for an
+    order line, created when the order starts waiting for
+    payment and either confirmed (on payment) or released
+    (on cancel or expiration) afterwards.
+
+    The stock is decremented atomically when the hold is
+    created so that concurrent checkouts of the same item
+    are not able to oversell it.
+    """
+
+    STATUS_S = dict(
+        held="held",
+        confirmed="confirmed",
+        released="released",
+        expired="expired",
+    )
+
+    status = appier.field(
+        initial="held",
+        index="hashed",
+        safe=True,
+        meta="enum",
+        enum=STATUS_S,
+        observations="""The current status of the reservation,
+        only held reservations are considered to be active""",
+    )
+
+    quantity = appier.field(
+        type=commons.Decimal,
+        initial=commons.Decimal(0.0),
+        safe=True,
+        observations="""The quantity of the merchandise that
+        has been removed from the stock by the reservation""",
+    )
+
+    expiration = appier.field(
+        type=int,
+        index=True,
+        safe=True,
+        meta="datetime",
+        observations="""The timestamp after which a held
+        reservation is considered expired and its stock
+        should be restored""",
+    )
+
+    order = appier.field(
+        type=appier.reference("Order", name="id"),
+        safe=True,
+        observations="""The order that "owns" the reservation""",
+    )
+
+    line = appier.field(
+        type=appier.reference("OrderLine", name="id"),
+        safe=True,
+        observations="""The order line for which the stock
+        has been reserved""",
+    )
+
+    product = appier.field(
+        type=appier.reference("Product", name="id"),
+        eager=True,
+        safe=True,
+    )
+
+    measurement = appier.field(
+        type=appier.reference("Measurement", name="id"),
+        eager=True,
+        safe=True,
+    )
+
+    @classmethod
+    def validate(cls):
+        return super(Reservation, cls).validate() + [
+            appier.not_null("quantity"),
+            appier.gte("quantity", 0.0),
+            appier.not_null("order"),
+            appier.not_null("product"),
+        ]
+
+    @classmethod
+    def list_names(cls):
+        return [
+            "id",
+            "order",
+            "product",
+            "quantity",
+            "status",
+            "expiration",
+        ]
+
+    @classmethod
+    def order_name(cls):
+        return ["id", -1]
+
+    @classmethod
+    def hold_s(cls, order, line, timeout=None):
+        """
+        Creates a new held reservation for the provided order line
+        atomically removing the line's quantity from the stock of
+        the associated merchandise (product or measurement).
+
+        In case the merchandise has no stock control (no quantity
+        in hand defined) no reservation is created.
+
+        :type order: Order
+        :param order: The order that is going to own the reservation.
+        :type line: OrderLine
+        :param line: The order line for which the stock should be
+        reserved (its quantity is used).
+        :type timeout: int
+        :param timeout: The number of seconds the reservation should
+        be held before being considered expired.
+        :rtype: Reservation
+        :return: The created reservation or an invalid value in case
+        no stock control exists for the merchandise.
+        """
+
+        timeout = timeout or appier.conf("BUDY_RESERVATION_TTL", 3600, cast=int)
+
+        merchandise = line.merchandise
+        if merchandise.quantity_hand == None:
+            return None
+
+        # runs the conditional and atomic decrement of the stock of the
+        # merchandise, making sure that no negative stock is reached
+        value = merchandise.advance_s("quantity_hand", line.quantity * -1, floor=0.0)
+        if value == None:
+            raise appier.OperationalError(
+                message="Not enough stock for '%s'" % merchandise.short_description
+            )
+
+        reservation = cls(
+            quantity=line.quantity,
+            expiration=int(time.time() + timeout),
+            order=order,
+            line=line,
+            product=line.product,
+            measurement=None if merchandise is line.product else merchandise,
+        )
+        reservation.save()
+        return reservation
+
+    @classmethod
+    @appier.operation(name="Collect Expired", level=2)
+    def collect_expired_s(cls):
+        # retrieves the complete set of held reservations whose expiration
+        # timestamp has already passed, notice that the filtering on the
+        # expiration is only delegated to the data source for Mongo
+        now = time.time()
+        kwargs = dict(expiration={"$lt": now}) if cls._is_mongo() else dict()
+        reservations = cls.find(status="held", **kwargs)
+        reservations = [
+            reservation
+            for reservation in reservations
+            if reservation.expiration and reservation.expiration < now
+        ]
+
+        # releases each of the expired reservations restoring the stock
+        # of the associated merchandise and marking them as expired
+        for reservation in reservations:
+            reservation.release_s(status="expired")
+        return len(reservations)
+
+    @appier.operation(name="Confirm")
+    def confirm_s(self):
+        return self._transition_s("confirmed")
+
+    @appier.operation(name="Release")
+    def release_s(self, status="released"):
+        # tries to change the status of the reservation and in case that
+        # fails (already not held) no stock is restored as the reservation
+        # has already been confirmed or released by a concurrent operation
+        changed = self._transition_s(status)
+        if not changed:
+            return False
+
+        # restores the stock of the merchandise with a single field atomic
+        # increment operation, this avoids any whole document rewrite
+        merchandise = self.merchandise
+        if merchandise and not merchandise.quantity_hand == None:
+            merchandise.advance_s("quantity_hand", self.quantity)
+        return True
+
+    def is_held(self):
+        return self.status == "held"
+
+    @property
+    def merchandise(self):
+        return self.measurement or self.product
+
+    def _transition_s(self, status):
+        cls = self.__class__
+        store = self._get_store()
+
+        # runs the held to target status transition as a single conditional
+        # update (for Mongo) so that only one of the concurrent operations is
+        # able to confirm or release the reservation, for other adapters a
+        # non atomic verification is used instead
+        if cls._is_mongo():
+            value = store.find_and_modify(
+                dict(_id=self._id, status="held"),
+                {"$set": dict(status=status)},
+                new=True,
+            )
+            changed = True if value else False
+        else:
+            current = store.find_one(dict(_id=self._id)) or dict()
+            changed = current.get("status", None) == "held"
+            if changed:
+                store.update(dict(_id=self._id), {"$set": dict(status=status)})
+
+        if changed:
+            self.status = status
+        return changed
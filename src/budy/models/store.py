@@ -50,6 +50,15 @@ class Store(base.BudyBase):
 
     restrict_mode = appier.field(type=bool, index=True, initial=True)
 
+    @classmethod
+    def teardown(cls):
+        super(Store, cls).teardown()
+        cls.clear_cached()
+
+    @classmethod
+    def is_cached(cls):
+        return True
+
     @classmethod
     def validate(cls):
         return super(Store, cls).validate() + [
@@ -62,6 +71,14 @@ class Store(base.BudyBase):
     def list_names(cls):
         return ["id", "name", "currency_code", "checkout_mode"]
 
+    @classmethod
+    def get_stores(cls, app=None):
+        def builder():
+            stores = cls.find(map=True)
+            return dict([(value["id"], value) for value in stores])
+
+        return cls.get_cached("stores", builder, app=app)
+
     @property
     def is_restricted(self):
         return self.restrict_mode
@@ -488,3 +488,200 @@ class BagTest(unittest.TestCase):
         self.assertEqual(bag.total, 20.0)
         self.assertEqual(bag.discountable, 0.0)
         self.assertEqual(len(bag.lines), 1)
+
+    def test_shipping_rules(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, weight=2.0
+        )
+        product.save()
+
+        appier.conf_s("BUDY_SHIPPING", "lambda v, t, q, b: 5.0 if v < 30.0 else 0.0")
+        try:
+            bag = budy.Bag()
+            bag.save()
+
+            bag.add_product_s(product, 2.0)
+
+            self.assertEqual(bag.sub_total, 20.0)
+            self.assertEqual(bag.shipping_cost, 5.0)
+            self.assertEqual(bag.total, 25.0)
+
+            bag.add_product_s(product, 1.0)
+
+            self.assertEqual(bag.sub_total, 30.0)
+            self.assertEqual(bag.shipping_cost, 0.0)
+            self.assertEqual(bag.total, 30.0)
+
+            rule = budy.Bundle.compile_rule("BUDY_SHIPPING")
+
+            self.assertEqual(rule, budy.Bundle.compile_rule("BUDY_SHIPPING"))
+
+            appier.conf_s(
+                "BUDY_SHIPPING",
+                '{"by": "weight", "tiers": [[0, 3.0], [5, 6.0]], "default": 1.0}',
+            )
+
+            self.assertNotEqual(rule, budy.Bundle.compile_rule("BUDY_SHIPPING"))
+            self.assertEqual(bag.weight, 6.0)
+
+            bag.calculate_s()
+
+            self.assertEqual(bag.shipping_cost, 6.0)
+            self.assertEqual(bag.total, 36.0)
+
+            appier.conf_s(
+                "BUDY_SHIPPING",
+                '{"by": "country", "values": {"PT": 2.0}, "default": {"percent": true, "default": 10.0}}',
+            )
+
+            bag.calculate_s()
+
+            self.assertEqual(bag.shipping_cost, 3.0)
+
+            bag.country = "PT"
+            bag.calculate_s()
+
+            self.assertEqual(bag.shipping_cost, 2.0)
+        finally:
+            appier.conf_r("BUDY_SHIPPING")
+            budy.Bundle.invalidate_rules()
+
+    def test_refresh_valid(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=2.0
+        )
+        product.save()
+
+        bag = budy.Bag()
+        bag.save()
+
+        bag_line = budy.BagLine(quantity=2.0)
+        bag_line.product = product
+        bag_line.save()
+        bag.add_line_s(bag_line)
+
+        bag = bag.reload()
+        result = bag.refresh_valid_s(currency="EUR", country="PT")
+
+        self.assertEqual(result, True)
+        self.assertEqual(bag.currency, "EUR")
+        self.assertEqual(bag.reload().currency, "EUR")
+        self.assertEqual(bag_line.reload().currency, "EUR")
+
+        bag = bag.reload()
+        modified = bag.modified
+        result = bag.refresh_valid_s(currency="EUR", country="PT")
+
+        self.assertEqual(result, False)
+        self.assertEqual(bag.reload().modified, modified)
+
+        budy.Product.get(id=product.id).advance_s("quantity_hand", -1.0)
+
+        bag = bag.reload()
+        result = bag.refresh_valid_s(currency="EUR", country="PT")
+
+        self.assertEqual(result, True)
+        self.assertEqual(bag.total, 10.0)
+        self.assertEqual(bag.reload().total, 10.0)
+        self.assertEqual(bag_line.reload().quantity, 1.0)
+
+        result = bag.refresh_valid_s(currency="EUR", country="PT")
+
+        self.assertEqual(result, False)
+
+    def test_merchandise_snapshot(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=3.0
+        )
+        product.save()
+
+        other = budy.Product(
+            short_description="other", gender="Male", price=5.0, quantity_hand=3.0
+        )
+        other.save()
+
+        bag = budy.Bag()
+        bag.save()
+        bag.add_product_s(product, 2.0)
+        bag.add_product_s(other, 1.0)
+
+        snapshot = bag.merchandise_snapshot()
+
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual(snapshot[("product", product.id)].quantity_hand, 3.0)
+        self.assertEqual(snapshot[("product", other.id)].quantity_hand, 3.0)
+        self.assertEqual(bag.is_valid(), True)
+
+        budy.Product.get(id=product.id).advance_s("quantity_hand", -2.0)
+
+        snapshot = bag.merchandise_snapshot()
+
+        self.assertEqual(snapshot[("product", product.id)].quantity_hand, 1.0)
+        self.assertEqual(bag.is_valid(), False)
+
+    def test_lines_view(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=4.0
+        )
+        product.save()
+
+        bag = budy.Bag()
+        bag.save()
+        line = bag.add_product_s(product, 1.0, attributes="a")
+        bag.add_product_s(
+            product, 2.0, size=line.size, scale=line.scale, attributes="b"
+        )
+        bag.add_product_s(
+            product, 1.0, size=line.size, scale=line.scale, attributes="a"
+        )
+
+        self.assertEqual(len(bag.lines), 2)
+
+        view = bag.lines_view()
+
+        self.assertEqual(len(view["lines"]), 2)
+        self.assertEqual(bag.merchandise_quantity(product, view=view), 4.0)
+        self.assertEqual(
+            bag.merchandise_quantity(product, view=view),
+            bag.merchandise_quantity(product),
+        )
+
+        budy.Product.get(id=product.id).advance_s("quantity_hand", -2.0)
+        bag = budy.Bag.get(id=bag.id)
+
+        self.assertEqual(bag.try_valid(), True)
+        self.assertEqual(sum(line.quantity for line in bag.lines), 2.0)
+
+    def test_map_eager(self):
+        file = appier.typesf.ImageFile(dict(name="name", data="data", mime="mime"))
+
+        media = budy.Media(description="description", label="label", order=1, file=file)
+        media.save()
+
+        brand = budy.Brand(name="brand")
+        brand.save()
+
+        product = budy.Product(
+            short_description="product",
+            gender="Male",
+            price=10.0,
+            price_compare=12.0,
+            quantity_hand=2.0,
+        )
+        product.brand = brand
+        product.save()
+        product.add_image_s(media)
+
+        bag = budy.Bag()
+        bag.save()
+        bag.add_product_s(product, 1.0)
+
+        eager = ("lines.product.images", "lines.product.brand")
+        bag = budy.Bag.get(id=bag.id, eager=eager)
+        result = bag.map_eager(eager)
+        product = result["lines"][0]["product"]
+
+        self.assertEqual(result, bag.reload(eager=eager, map=True))
+        self.assertEqual(product["is_discounted"], True)
+        self.assertEqual(product["brand"]["name"], "brand")
+        self.assertEqual(product["images"][0]["url"], budy.Media._get_url(media.id))
@@ -107,3 +107,31 @@ class CurrencyTest(unittest.TestCase):
 
         result = budy.Currency.format(1200.238, "JPY")
         self.assertEqual(result, "1200")
+
+    def test_cache(self):
+        budy.Currency.create_s("EUR", 2)
+
+        result = budy.Currency.format(1200.238, "EUR")
+        self.assertEqual(result, "1200.24")
+
+        currency = budy.Currency.get(iso="EUR")
+        currency.decimal_places = 3
+        currency.save()
+
+        result = budy.Currency.format(1200.238, "EUR")
+        self.assertEqual(result, "1200.238")
+
+        store = budy.Currency._collection()
+        store.update({"iso": "EUR"}, {"$set": {"decimal_places": 1}})
+
+        result = budy.Currency.format(1200.238, "EUR")
+        self.assertEqual(result, "1200.238")
+
+        generation = budy.Currency.get_generation()
+        budy.Currency._increment("generation")
+        self.app._generations.clear()
+
+        self.assertEqual(budy.Currency.get_generation(), generation + 1)
+
+        result = budy.Currency.format(1200.238, "EUR")
+        self.assertEqual(result, "1200.2")
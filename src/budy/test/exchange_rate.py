@@ -64,3 +64,42 @@ class ExchangeRateTest(unittest.TestCase):
         result = budy.ExchangeRate.convert(10.0, "USD", "EUR")
 
         self.assertEqual(result, commons.Decimal(8.78735))
+
+    def test_cache(self):
+        budy.ExchangeRate.create_s("EUR", "USD", 1.138)
+
+        rates = budy.ExchangeRate.get_rates()
+
+        self.assertEqual(rates[("EUR", "USD")], commons.Decimal(1.138))
+        self.assertEqual(budy.ExchangeRate.get_rates() is rates, True)
+
+        budy.ExchangeRate.create_s("EUR", "GBP", 0.85)
+
+        self.assertEqual(budy.ExchangeRate.get_rates() is rates, False)
+        self.assertEqual(budy.ExchangeRate.has_rate("EUR", "GBP"), True)
+        self.assertEqual(budy.ExchangeRate.has_rate("GBP", "EUR"), False)
+
+        exchange_rate = budy.ExchangeRate.get(base="EUR", target="GBP")
+        exchange_rate.delete()
+
+        self.assertEqual(budy.ExchangeRate.has_rate("EUR", "GBP"), False)
+
+    def test_triangulation(self):
+        budy.ExchangeRate.create_both_s("EUR", "USD", 1.138)
+        budy.ExchangeRate.create_s("EUR", "GBP", 0.85)
+
+        rate = budy.ExchangeRate.get_rate("USD", "GBP")
+
+        self.assertEqual(
+            rate, commons.Decimal(1.0) / commons.Decimal(1.138) * commons.Decimal(0.85)
+        )
+        self.assertEqual(budy.ExchangeRate.has_rate("USD", "GBP"), True)
+        self.assertEqual(budy.ExchangeRate.has_rate("GBP", "USD"), False)
+
+        result = budy.ExchangeRate.convert(10.0, "USD", "GBP")
+
+        self.assertEqual(result, commons.Decimal(7.46924))
+
+        self.assertRaises(
+            appier.NotFoundError, lambda: budy.ExchangeRate.convert(10.0, "GBP", "USD")
+        )
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Hive Budy
+# Copyright (c) 2008-2024 Hive Solutions Lda.
+#
+# This file is part of Hive Budy.
+#
+# Hive Budy is free software: you can redistribute it and/or modify
+# it under the terms of the Apache License as published by the Apache
+# Foundation, either version 2.0 of the License, or (at your option) any
+# later version.
+#
+# Hive Budy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# Apache License for more details.
+#
+# You should have received a copy of the Apache License along with
+# Hive Budy. If not, see <http://www.apache.org/licenses/>.
+
+__author__ = "João Magalhães <joamag@hive.pt>"
+""" The author(s) of the module """
+
+__copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
+""" The copyright for the module """
+
+__license__ = "Apache License, Version 2.0"
+""" The license for the module """
+
+import time
+import logging
+import unittest
+
+import appier
+
+import budy
+
+
+class JobRunTest(unittest.TestCase):
+    def setUp(self):
+        self.app = budy.BudyApp(level=logging.ERROR)
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+
+    def test_lease(self):
+        result = budy.JobRun.acquire_lease("job", "node_1", 60.0)
+        self.assertEqual(result, True)
+
+        result = budy.JobRun.acquire_lease("job", "node_2", 60.0)
+        self.assertEqual(result, False)
+
+        result = budy.JobRun.acquire_lease("job", "node_2", 60.0, slot=1)
+        self.assertEqual(result, True)
+
+        budy.JobRun.release_lease("job", "node_2", 60.0)
+
+        result = budy.JobRun.acquire_lease("job", "node_2", 60.0)
+        self.assertEqual(result, False)
+
+        budy.JobRun.release_lease("job", "node_1", 0.0)
+
+        result = budy.JobRun.acquire_lease("job", "node_2", 60.0)
+        self.assertEqual(result, True)
+
+        budy.JobRun.release_lease("job", "node_2", 60.0)
+
+        result = budy.JobRun.acquire_lease("job", "node_1", 60.0)
+        self.assertEqual(result, False)
+
+    def test_finish(self):
+        run = budy.JobRun(name="job", node="node_1", start=time.time())
+        run.save()
+
+        self.assertEqual(run.status, "running")
+
+        run.finish_s()
+        run = run.reload()
+
+        self.assertEqual(run.status, "success")
+        self.assertEqual(run.message, None)
+        self.assertEqual(run.duration >= 0.0, True)
+
+        run = budy.JobRun(name="job", node="node_1", start=time.time() - 10.0)
+        run.save()
+        run.finish_s(timeout=5.0)
+
+        self.assertEqual(run.reload().status, "timeout")
+
+        run = budy.JobRun(name="job", node="node_1", start=time.time())
+        run.save()
+        run.finish_s(status="failed", message="error")
+        run = run.reload()
+
+        self.assertEqual(run.status, "failed")
+        self.assertEqual(run.message, "error")
+
+    def test_omni_phases(self):
+        scheduler = self.app.scheduler
+        calls = []
+        scheduler.omni_bot.sync_products = lambda: calls.append("sync")
+        scheduler.omni_bot.fix_products = lambda: calls.append("fix")
+        scheduler.omni_bot.gc_products = lambda: calls.append("gc")
+
+        self.assertEqual(
+            [job["name"] for job in scheduler.jobs],
+            ["reservations", "omni", "tracking"],
+        )
+
+        scheduler.run_omni()
+
+        self.assertEqual(calls, ["sync", "fix", "gc"])
+
+        scheduler.run_omni()
+
+        self.assertEqual(calls, ["sync", "fix", "gc"])
+
+        budy.JobRun.release_lease("omni_sync", None, 0.0)
+        scheduler.run_omni()
+
+        self.assertEqual(calls, ["sync", "fix", "gc", "sync"])
+
+    def test_prune(self):
+        runs = []
+        for _index in range(5):
+            run = budy.JobRun(name="job", node="node_1", start=time.time())
+            run.save()
+            runs.append(run)
+
+        other = budy.JobRun(name="other", node="node_1", start=time.time())
+        other.save()
+
+        self.assertEqual(budy.JobRun.prune_s("job", keep=2), 3)
+        self.assertEqual(len(budy.JobRun.find(name="job")), 2)
+        self.assertEqual(len(budy.JobRun.find(name="other")), 1)
+        self.assertEqual(
+            sorted(run.id for run in budy.JobRun.find(name="job")),
+            [runs[3].id, runs[4].id],
+        )
+        self.assertEqual(budy.JobRun.prune_s("job", keep=2), 0)
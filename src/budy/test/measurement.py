@@ -149,3 +149,67 @@ class MeasurementTest(unittest.TestCase):
         self.assertEqual(measurement.name, "measurement")
         self.assertEqual(measurement.value, 7089056562649719393)
         self.assertEqual(measurement.value_s, "2")
+
+    def test_dedupe(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=None
+        )
+        product.save()
+
+        for value, object_id, modify_date in ((1, 10, 100), (2, 10, 200), (3, 20, 100)):
+            measurement = budy.Measurement(
+                product=product,
+                name="size",
+                value=value,
+                quantity_hand=1.0,
+                meta=dict(object_id=object_id, modify_date=modify_date),
+            )
+            measurement.save()
+            product.measurements.append(measurement)
+        product.save()
+
+        measurement = budy.Measurement(product=product, name="size", value=4)
+        measurement.save()
+
+        product = product.reload()
+
+        self.assertEqual(budy.Measurement.count(), 4)
+        self.assertEqual(len(product.measurements), 3)
+        self.assertEqual(product.quantity_hand, 3.0)
+
+        report = budy.Measurement.dedupe_s()
+
+        self.assertEqual(report, dict(groups=1, removed=1, products=1))
+        self.assertEqual(budy.Measurement.count(), 3)
+        self.assertEqual(budy.Measurement.get(value=1, raise_e=False), None)
+        self.assertNotEqual(budy.Measurement.get(value=2, raise_e=False), None)
+        self.assertNotEqual(budy.Measurement.get(value=4, raise_e=False), None)
+
+        product = product.reload()
+
+        self.assertEqual(len(product.measurements), 2)
+        self.assertEqual(product.quantity_hand, 2.0)
+
+        report = budy.Measurement.dedupe_s()
+
+        self.assertEqual(report, dict(groups=0, removed=0, products=0))
+
+    def test_fix(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=None
+        )
+        product.save()
+
+        measurement = budy.Measurement(
+            product=product, name="measurement", value=2, value_s="2"
+        )
+        measurement.save()
+        modified = measurement.modified
+
+        self.assertEqual(measurement.fix_s(), False)
+        self.assertEqual(measurement.reload().modified, modified)
+
+        measurement.value = "a"
+
+        self.assertEqual(measurement.fix_s(), True)
+        self.assertEqual(measurement.reload().value, 97)
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Hive Budy
+# Copyright (c) 2008-2024 Hive Solutions Lda.
+#
+# This file is part of Hive Budy.
+#
+# Hive Budy is free software: you can redistribute it and/or modify
+# it under the terms of the Apache License as published by the Apache
+# Foundation, either version 2.0 of the License, or (at your option) any
+# later version.
+#
+# Hive Budy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# Apache License for more details.
+#
+# You should have received a copy of the Apache License along with
+# Hive Budy. If not, see <http://www.apache.org/licenses/>.
+
+__author__ = "João Magalhães <joamag@hive.pt>"
+""" The author(s) of the module """
+
+__copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
+""" The copyright for the module """
+
+__license__ = "Apache License, Version 2.0"
+""" The license for the module """
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+import appier
+
+import budy
+
+
+class MediaTest(unittest.TestCase):
+    def setUp(self):
+        self.app = budy.BudyApp(level=logging.ERROR)
+        self.path = tempfile.mkdtemp()
+        appier.conf_s("BUDY_RENDITIONS_PATH", self.path)
+
+    def tearDown(self):
+        appier.conf_r("BUDY_RENDITIONS_PATH")
+        appier.conf_r("BUDY_RENDITIONS_SIZE")
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+
+    def test_rendition(self):
+        import PIL.Image
+
+        buffer = appier.legacy.BytesIO()
+        image = PIL.Image.new("RGBA", (32, 32), color=(255, 0, 0, 128))
+        image.save(buffer, format="png")
+
+        media = budy.Media(
+            description="description",
+            label="label",
+            order=1,
+            file=appier.File(("image.png", "image/png", buffer.getvalue())),
+        )
+        media.save()
+
+        self.assertEqual(len(os.listdir(self.path)), 0)
+
+        data = media.get_rendition("webp")
+
+        self.assertEqual(data[:4], b"RIFF")
+        self.assertEqual(len(os.listdir(self.path)), 1)
+
+        data = media.get_rendition("webp")
+
+        self.assertEqual(data[:4], b"RIFF")
+        self.assertEqual(len(os.listdir(self.path)), 1)
+
+        media.fill_renditions()
+
+        self.assertEqual(len(os.listdir(self.path)), 2)
+
+        data = media.get_rendition("jpeg", quality=50, background="000000")
+
+        self.assertEqual(data[:2], b"\xff\xd8")
+        self.assertEqual(len(os.listdir(self.path)), 3)
+
+        path_t = os.path.join(self.path, "rendition.tmp")
+        with open(path_t, "wb") as file:
+            file.write(b"partial")
+
+        appier.conf_s("BUDY_RENDITIONS_SIZE", 0)
+        media.get_rendition("jpeg", quality=40)
+
+        self.assertEqual(os.listdir(self.path), ["rendition.tmp"])
+
+    def test_rendition_jpeg(self):
+        import PIL.Image
+
+        buffer = appier.legacy.BytesIO()
+        image = PIL.Image.new("RGB", (32, 32), color=(255, 0, 0))
+        image.save(buffer, format="jpeg")
+
+        media = budy.Media(
+            description="description",
+            label="label",
+            order=1,
+            file=appier.File(("image.jpg", "image/jpeg", buffer.getvalue())),
+        )
+        media.save()
+
+        self.assertEqual(len(os.listdir(self.path)), 0)
+
+        media = budy.Media.get(id=media.id)
+        media.fill_renditions()
+
+        self.assertEqual(len(os.listdir(self.path)), 1)
+
+    def test_thumbnails(self):
+        import PIL.Image
+
+        buffer = appier.legacy.BytesIO()
+        image = PIL.Image.new("RGB", (400, 300), color=(255, 0, 0))
+        image.save(buffer, format="png")
+
+        media = budy.Media(
+            description="description",
+            label="label",
+            order=1,
+            unique="unique",
+            file=appier.File(("image.png", "image/png", buffer.getvalue())),
+        )
+        media.save()
+
+        renditions = len(os.listdir(self.path))
+
+        media = budy.Media.get(unique="unique")
+        thumbnails = media.thumbnails_s(sizes=(("thumbnail", 100), ("large", 200)))
+
+        self.assertEqual(len(thumbnails), 2)
+        self.assertEqual(len(os.listdir(self.path)), renditions)
+        self.assertEqual(thumbnails[0].label, "thumbnail")
+        self.assertEqual(thumbnails[0].unique, "unique-thumbnail")
+        self.assertEqual(thumbnails[1].label, "large")
+        self.assertEqual(thumbnails[1].unique, "unique-large")
+
+        thumbnail = thumbnails[0].reload(rules=False)
+        image = PIL.Image.open(appier.legacy.BytesIO(thumbnail.file.data))
+
+        self.assertEqual(image.size, (100, 100))
+        self.assertEqual(thumbnail.file.mime, "image/png")
+
+    def test_thumbnails_pool(self):
+        import PIL.Image
+
+        buffer = appier.legacy.BytesIO()
+        image = PIL.Image.new("RGB", (400, 300), color=(255, 0, 0))
+        image.save(buffer, format="png")
+
+        media = budy.Media(
+            description="description",
+            label="label",
+            order=1,
+            unique="unique",
+            file=appier.File(("image.png", "image/png", buffer.getvalue())),
+        )
+        media.save()
+
+        bot = budy.OmniBot(processes=2)
+        try:
+            thumbnails = media.thumbnails_s(
+                sizes=(("thumbnail", 100),), pool=bot.get_process_pool()
+            )
+        finally:
+            bot.destroy()
+
+        self.assertEqual(len(thumbnails), 1)
+        self.assertEqual(thumbnails[0].unique, "unique-thumbnail")
+        self.assertEqual(bot.process_pool, None)
@@ -29,6 +29,7 @@ __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
 import json
+import time
 import commons
 import logging
 import unittest
@@ -972,6 +973,29 @@ class OrderTest(unittest.TestCase):
         self.assertEqual(order.is_open(), False)
         self.assertEqual(order.is_closed(), True)
 
+        product.quantity_hand = 1.0
+        product.save()
+
+        order = order.reload()
+        order.status = "created"
+
+        self.assertEqual(order.is_open(), True)
+        self.assertEqual(order.is_valid(), True)
+
+        order = budy.Order()
+        order.save()
+
+        order_line = budy.OrderLine(quantity=1.0)
+        order_line.product = product
+        order_line.save()
+        order.lines.append(order_line)
+
+        self.assertEqual(order.is_valid(), True)
+
+        order.lines[0].quantity = 2.0
+
+        self.assertEqual(order.is_valid(), False)
+
     def test_payment_method(self):
         product = budy.Product(
             short_description="product", gender="Male", price=10.0, quantity_hand=5.0
@@ -1104,3 +1128,163 @@ class OrderTest(unittest.TestCase):
         notes = order._build_notes()
 
         self.assertEqual(notes, "Budy order - BD-000001")
+
+    def test_find_chunks(self):
+        for _index in range(5):
+            order = budy.Order()
+            order.save()
+
+        chunks = list(budy.Order.find_chunks(size=2, sort=[("id", -1)], limit=0))
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual([order.id for order in chunks[0]], [5, 4])
+        self.assertEqual([order.id for order in chunks[1]], [3, 2])
+        self.assertEqual([order.id for order in chunks[2]], [1])
+
+        chunks = list(budy.Order.find_chunks(size=5))
+
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual([order.id for order in chunks[0]], [1, 2, 3, 4, 5])
+
+        chunks = list(budy.Order.find_chunks(size=2, skip=1, limit=3))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([order.id for order in chunks[0]], [2, 3])
+        self.assertEqual([order.id for order in chunks[1]], [4])
+
+    def test_prefetch(self):
+        for index in range(3):
+            address = budy.Address(
+                first_name="first name %d" % index,
+                last_name="last name",
+                address="address",
+                city="city",
+            )
+            address.save()
+
+            order = budy.Order()
+            order.shipping_address = address
+            order.save()
+
+        other = budy.Order()
+        other.save()
+
+        orders = budy.Order.find(sort=[("id", 1)])
+        result, queries = self._count_queries(
+            budy.Order.prefetch, orders, ("shipping_address", "store")
+        )
+
+        self.assertEqual(result, orders)
+        self.assertEqual(queries, {"address": 1})
+
+        result, queries = self._count_queries(
+            lambda: [order.shipping_address for order in orders]
+        )
+
+        self.assertEqual(queries, {})
+        self.assertEqual(result[0].is_resolved(), True)
+        self.assertEqual(result[0].first_name, "first name 0")
+        self.assertEqual(result[2].first_name, "first name 2")
+        self.assertEqual(result[3], None)
+
+    def test_prefetch_lines(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=5.0
+        )
+        product.save()
+
+        order = budy.Order()
+        order.save()
+
+        order_line = budy.OrderLine(quantity=2.0)
+        order_line.product = product
+        order_line.save()
+        order.add_line_s(order_line)
+
+        other = budy.Product(
+            short_description="other", gender="Male", price=20.0, quantity_hand=5.0
+        )
+        other.save()
+
+        for _index in range(3):
+            order = budy.Order()
+            order.save()
+
+            for _product in (product, other):
+                order_line = budy.OrderLine(quantity=1.0)
+                order_line.product = _product
+                order_line.save()
+                order.add_line_s(order_line)
+
+        orders = budy.Order.find(sort=[("id", 1)])
+        _result, queries = self._count_queries(budy.Order.prefetch, orders)
+
+        self.assertEqual(queries, {"orderline": 1, "product": 1})
+
+        _result, queries = self._count_queries(
+            lambda: [
+                line.product.short_description
+                for order in orders
+                for line in order.lines
+            ]
+        )
+
+        self.assertEqual(queries, {})
+        self.assertEqual(len(orders), 4)
+        self.assertEqual(len(orders[0].lines), 1)
+        self.assertEqual(len(orders[3].lines), 2)
+        self.assertEqual(orders[0].lines.objects[0].is_resolved(), True)
+        self.assertEqual(orders[0].lines[0].product.is_resolved(), True)
+        self.assertEqual(orders[0].lines[0].product.short_description, "product")
+        self.assertEqual(orders[3].lines[1].product.short_description, "other")
+        self.assertEqual(orders[0].account, None)
+
+    def test_schedule_tracking(self):
+        order = budy.Order()
+        order.save()
+
+        self.assertEqual(order.tracking_failures, 0)
+
+        next_check = time.time() + 3600
+        order.schedule_tracking_s(next_check, failures=2)
+
+        self.assertEqual(order.tracking_next, int(next_check))
+        self.assertEqual(order.tracking_failures, 2)
+
+        order = order.reload()
+
+        self.assertEqual(order.tracking_next, int(next_check))
+        self.assertEqual(order.tracking_failures, 2)
+        self.assertEqual(order.status, "created")
+        self.assertNotEqual(order.tracking_checked, None)
+
+        bot = budy.TrackingBot(window=86400, interval=60, max_interval=600)
+
+        self.assertEqual(bot.get_backoff(1), 60)
+        self.assertEqual(bot.get_backoff(3), 240)
+        self.assertEqual(bot.get_backoff(8), 600)
+
+        order.set_tracking_s("tracking", "https://tracking.com/tracking")
+        order = order.reload()
+
+        self.assertEqual(order.tracking_number, "tracking")
+        self.assertEqual(order.tracking_next, 0)
+        self.assertEqual(order.tracking_failures, 0)
+
+    def _count_queries(self, method, *args, **kwargs):
+        # wraps the logging of the data source collections (called by every
+        # operation they run) so that the queries run by the method are
+        # counted per collection name
+        queries = dict()
+        log = appier.data.Collection.log
+
+        def _log(collection, operation, *args, **kwargs):
+            queries[collection.name] = queries.get(collection.name, 0) + 1
+            return log(collection, operation, *args, **kwargs)
+
+        appier.data.Collection.log = _log
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            appier.data.Collection.log = log
+        return result, queries
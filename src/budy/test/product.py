@@ -28,8 +28,11 @@ __copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
 __license__ = "Apache License, Version 2.0"
 """ The license for the module """
 
+import json
+import time
 import logging
 import unittest
+import threading
 
 import appier
 
@@ -256,3 +259,831 @@ class ProductTest(unittest.TestCase):
         self.assertEqual(product.discount, 10.0)
         self.assertEqual(product.discount_percent, 50.0)
         self.assertEqual(product.is_discounted, True)
+
+    def test_related(self):
+        collection = budy.Collection(name="collection")
+        collection.save()
+
+        other = budy.Collection(name="other")
+        other.save()
+
+        products = []
+        for index in range(4):
+            product = budy.Product(
+                short_description="product %d" % index,
+                gender="Male",
+                price=10.0,
+                quantity_hand=0.0 if index == 2 else 1.0,
+            )
+            product.save()
+            product.add_collection_s(collection)
+            products.append(product)
+
+        related = products[1].related(limit=2)
+
+        self.assertEqual(len(related), 2)
+        self.assertEqual(related[0]["id"], products[0].id)
+        self.assertEqual(related[1]["id"], products[3].id)
+
+        related = products[1].related(limit=2, available=False)
+
+        self.assertEqual(len(related), 2)
+        self.assertEqual(related[0]["id"], products[2].id)
+        self.assertEqual(related[1]["id"], products[3].id)
+
+        products[2].advance_s("quantity_hand", 2.0)
+        related = products[1].related(limit=2)
+
+        self.assertEqual(related[0]["id"], products[2].id)
+        self.assertEqual(related[1]["id"], products[3].id)
+
+        products[2].remove_collection_s(collection)
+        products[2].add_collection_s(other)
+        products[3].delete()
+        related = products[1].related(limit=3)
+
+        self.assertEqual(len(related), 1)
+        self.assertEqual(related[0]["id"], products[0].id)
+
+        budy.Product.index_related_s()
+        related = products[1].related(limit=3)
+
+        self.assertEqual(len(related), 1)
+        self.assertEqual(related[0]["id"], products[0].id)
+
+    def test_related_groups(self):
+        collection = budy.Collection(name="collection")
+        collection.save()
+
+        other = budy.Collection(name="other")
+        other.save()
+
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=1.0
+        )
+        product.save()
+        product.add_collection_s(collection)
+
+        shared = budy.Product(
+            short_description="shared", gender="Male", price=10.0, quantity_hand=1.0
+        )
+        shared.save()
+        shared.add_collection_s(other)
+        shared.add_collection_s(collection)
+
+        disabled = budy.Product(
+            short_description="disabled",
+            gender="Male",
+            price=10.0,
+            quantity_hand=1.0,
+            enabled=False,
+        )
+        disabled.save()
+        disabled.add_collection_s(collection)
+
+        last = budy.Product(
+            short_description="last", gender="Male", price=10.0, quantity_hand=1.0
+        )
+        last.save()
+        last.add_collection_s(collection)
+
+        related = product.related(limit=2)
+
+        self.assertEqual(len(related), 2)
+        self.assertEqual(related[0]["id"], shared.id)
+        self.assertEqual(related[1]["id"], last.id)
+
+        budy.Product.index_related_s()
+        related = product.related(limit=2)
+
+        self.assertEqual(len(related), 2)
+        self.assertEqual(related[0]["id"], shared.id)
+        self.assertEqual(related[1]["id"], last.id)
+
+    def test_related_index(self):
+        collection = budy.Collection(name="collection")
+        collection.save()
+
+        products = []
+        for index in range(30):
+            product = budy.Product(
+                short_description="product %d" % index,
+                gender="Male",
+                price=10.0,
+                quantity_hand=1.0,
+            )
+            product.collections.append(collection)
+            product.save()
+            products.append(product)
+
+        store = budy.Product._collection(name="related")
+        model = store.find_one({"_id": products[0].id})
+
+        self.assertEqual(model["key"], "collections:%d" % collection.id)
+        self.assertEqual(
+            len(model["available"]["after"]), budy.models.product.RELATED_SIZE
+        )
+        self.assertEqual(model["available"]["head"], [])
+
+        related = products[29].related(limit=4)
+
+        self.assertEqual(
+            [value["id"] for value in related], [product.id for product in products[:4]]
+        )
+
+        related = products[27].related(limit=3)
+
+        self.assertEqual(
+            [value["id"] for value in related],
+            [product.id for product in products[1:4]],
+        )
+
+        related = products[8].related(limit=2)
+
+        self.assertEqual(
+            [value["id"] for value in related], [products[9].id, products[10].id]
+        )
+
+        queries = []
+        log = appier.data.Collection.log
+        appier.data.Collection.log = lambda collection, operation, *args, **kwargs: (
+            queries.append(collection.name)
+            or log(collection, operation, *args, **kwargs)
+        )
+        try:
+            products[9].advance_s("quantity_hand", -0.5)
+        finally:
+            appier.data.Collection.log = log
+
+        self.assertEqual(queries.count("related"), 0)
+
+        products[9].advance_s("quantity_hand", -0.5)
+        related = products[8].related(limit=2)
+
+        self.assertEqual(
+            [value["id"] for value in related], [products[10].id, products[11].id]
+        )
+
+        related = products[8].related(limit=2, available=False)
+
+        self.assertEqual(
+            [value["id"] for value in related], [products[9].id, products[10].id]
+        )
+
+        products[9].delete()
+        related = products[8].related(limit=2, available=False)
+
+        self.assertEqual(
+            [value["id"] for value in related], [products[10].id, products[11].id]
+        )
+        self.assertEqual(store.find_one({"_id": products[9].id}), None)
+
+    def test_search(self):
+        names = ("Blue Shirt", "Red Shirt", "Red Shoes", "Blue Jeans")
+        products = []
+        for index, name in enumerate(names):
+            product = budy.Product(
+                short_description=name,
+                gender="Male",
+                price=10.0,
+                order=len(names) - index,
+            )
+            product.save()
+            products.append(product)
+
+        self.assertEqual(budy.Product.is_search_indexed(), False)
+
+        ids = budy.Product.search_ids("shirt")
+
+        self.assertEqual(ids, [products[1].id, products[0].id])
+
+        ids = budy.Product.search_ids("red sh")
+
+        self.assertEqual(ids, [products[2].id, products[1].id])
+
+        ids = budy.Product.search_ids("red sh", prefix=False)
+
+        self.assertEqual(ids, [])
+
+        ids = budy.Product.search_ids("blue red", operator="or")
+
+        self.assertEqual(len(ids), 4)
+
+        products[2].short_description = "Green Shoes"
+        products[2].save()
+
+        ids = budy.Product.search_ids("red")
+
+        self.assertEqual(ids, [products[1].id])
+
+        products[1].delete()
+
+        ids = budy.Product.search_ids("red")
+
+        self.assertEqual(ids, [])
+
+        budy.Product.index_search()
+
+        self.assertEqual(budy.Product.is_search_indexed(), True)
+
+        ids = budy.Product.search_ids("shirt")
+
+        self.assertEqual(ids, [products[0].id])
+
+        ids = budy.Product.search_ids("jeans blue")
+
+        self.assertEqual(ids, [products[3].id])
+
+        product = budy.Product.get(id=products[3].id)
+        product.tokens = None
+        product.short_description = "Green Jeans"
+        product.save()
+
+        ids = budy.Product.search_ids("blue")
+
+        self.assertEqual(ids, [products[0].id])
+
+        store = budy.Product._collection()
+        store.remove({"_id": products[0]._id})
+        generation = budy.Product.get_generation()
+        budy.Product._removed([products[0].id])
+
+        ids = budy.Product.search_ids("blue")
+
+        self.assertEqual(ids, [])
+        self.assertEqual(budy.Product.get_generation(), generation + 1)
+
+    def test_search_enabled(self):
+        product = budy.Product(
+            short_description="Blue Shirt", gender="Male", price=10.0
+        )
+        product.save()
+
+        disabled = budy.Product(
+            short_description="Blue Jeans", gender="Male", price=10.0, enabled=False
+        )
+        disabled.save()
+
+        budy.Product.index_search()
+
+        status, _headers, data = self._request(
+            "/api/products/search", query="find_s=blue"
+        )
+        products = json.loads(data)
+
+        self.assertEqual(status, 200)
+        self.assertEqual([value["id"] for value in products], [product.id])
+
+        status, _headers, data = self._request(
+            "/api/products/search", query="find_s=blue&limit=1"
+        )
+        products = json.loads(data)
+
+        self.assertEqual([value["id"] for value in products], [product.id])
+
+    def test_search_filters(self):
+        brand = budy.Brand(name="brand")
+        brand.save()
+
+        other = budy.Brand(name="other")
+        other.save()
+
+        products = []
+        for name, _brand, price in (
+            ("Blue Shirt", brand, 30.0),
+            ("Blue Jeans", other, 10.0),
+            ("Blue Hat", brand, 20.0),
+            ("Blue Blue Hat", brand, 40.0),
+        ):
+            product = budy.Product(
+                short_description=name, gender="Male", price=price, brand=_brand
+            )
+            product.save()
+            products.append(product)
+
+        budy.Product.index_search()
+
+        status, _headers, data = self._request(
+            "/api/products/search", query="find_s=blue&find_d=brand_s:equals:brand"
+        )
+        result = json.loads(data)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            [value["id"] for value in result],
+            [products[0].id, products[2].id, products[3].id],
+        )
+
+        status, _headers, data = self._request(
+            "/api/products/search",
+            query="find_s=blue&find_d=brand_s:equals:brand&sort=price:ascending",
+        )
+        result = json.loads(data)
+
+        self.assertEqual(
+            [value["id"] for value in result],
+            [products[2].id, products[0].id, products[3].id],
+        )
+
+        status, _headers, data = self._request(
+            "/api/products/search",
+            query="find_s=blue&find_d=brand_s:equals:brand&sort=price:descending&skip=1&limit=1",
+        )
+        result = json.loads(data)
+
+        self.assertEqual([value["id"] for value in result], [products[0].id])
+
+        status, _headers, data = self._request(
+            "/api/products/search", query="find_s=blue&skip=1&limit=2"
+        )
+        result = json.loads(data)
+
+        self.assertEqual(
+            [value["id"] for value in result], [products[1].id, products[2].id]
+        )
+
+    def test_quote(self):
+        calls = []
+
+        def builder():
+            calls.append(1)
+            time.sleep(0.1)
+            return dict(total=dict(price_final=10.0, ddp=1.0, vat=2.0))
+
+        threads = [
+            threading.Thread(
+                target=lambda: budy.Product._get_quote(("quote", 1), builder)
+            )
+            for _index in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+
+        quote = budy.Product._get_quote(("quote", 1), builder)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(quote["total"]["price_final"], 10.0)
+
+        quote = budy.Product._get_quote(("quote", 2), builder)
+
+        self.assertEqual(len(calls), 2)
+
+        def failer():
+            raise appier.OperationalError(message="Remote failure")
+
+        self.assertRaises(
+            appier.OperationalError,
+            lambda: budy.Product._get_quote(("quote", 3), failer),
+        )
+        self.assertEqual(budy.Product._get_quote(("quote", 3), builder), quote)
+        self.assertEqual(len(calls), 3)
+
+    def test_lookups(self):
+        file = appier.typesf.ImageFile(dict(name="name", data="data", mime="mime"))
+
+        product = budy.Product(short_description="product", gender="Male", price=10.0)
+        product.save()
+
+        self.assertEqual(product.get_measurement(12, name="size"), None)
+        self.assertEqual(product.get_image(size="large"), None)
+
+        for value in (12, 14):
+            measurement = budy.Measurement(
+                name="size", value=value, quantity_hand=1.0, product=product
+            )
+            measurement.save()
+            product.add_measurement_s(measurement)
+
+        media_1 = budy.Media(
+            description="description", label="label", size="large", order=2, file=file
+        )
+        media_1.save()
+        media_2 = budy.Media(
+            description="description", label="label", size="large", order=1, file=file
+        )
+        media_2.save()
+        media_3 = budy.Media(
+            description="description",
+            label="label",
+            size="thumbnail",
+            order=1,
+            file=file,
+        )
+        media_3.save()
+
+        product.add_image_s(media_1)
+        product.add_image_s(media_2)
+
+        self.assertEqual(product.get_measurement(12, name="size").value, 12)
+        self.assertEqual(product.get_measurement(14, name="size").value, 14)
+        self.assertEqual(product.get_measurement(14), None)
+        self.assertEqual(product.get_measurement(16, name="size"), None)
+        self.assertEqual(product.get_image().id, media_1.id)
+        self.assertEqual(product.get_image(size="large").id, media_1.id)
+        self.assertEqual(product.get_image(size="large", order=1).id, media_2.id)
+        self.assertEqual(product.get_image(order=1).id, media_2.id)
+        self.assertEqual(product.get_image(size="thumbnail"), None)
+
+        product.add_image_s(media_3)
+
+        self.assertEqual(product.get_image(size="thumbnail").id, media_3.id)
+        self.assertEqual(product.get_image(order=1).id, media_2.id)
+
+        product.remove_measurement_s(product.get_measurement(12, name="size"))
+        measurement = budy.Measurement(
+            name="size", value=16, quantity_hand=1.0, product=product
+        )
+        measurement.save()
+        product.add_measurement_s(measurement)
+
+        self.assertEqual(product.get_measurement(12, name="size"), None)
+        self.assertEqual(product.get_measurement(16, name="size").value, 16)
+
+        product.images = [media_3]
+
+        self.assertEqual(product.get_image(size="large"), None)
+        self.assertEqual(product.get_image().id, media_3.id)
+
+    def test_aggregates(self):
+        product = budy.Product(short_description="product", gender="Male", price=10.0)
+        product.save()
+
+        measurements = []
+        for value, price in ((12, 10.0), (14, 12.0)):
+            measurement = budy.Measurement(
+                name="size",
+                value=value,
+                price=price,
+                quantity_hand=2.0,
+                product=product,
+            )
+            measurement.save()
+            measurements.append(measurement)
+            product.measurements.append(measurement)
+        product.save()
+
+        self.assertEqual(product.quantity_hand, 4.0)
+        self.assertEqual(product.price, 12.0)
+
+        measurement = measurements[1]
+        measurement.price = 8.0
+        measurement.save()
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 4.0)
+        self.assertEqual(product.price, 10.0)
+
+        measurement.advance_s("quantity_hand", -1.0)
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 3.0)
+        self.assertEqual(product.price, 10.0)
+
+        product.short_description = "other"
+        product.save()
+
+        product = product.reload()
+
+        self.assertEqual(product.short_description, "other")
+        self.assertEqual(product.quantity_hand, 3.0)
+
+        store = budy.Product._collection()
+        store.update({"_id": product._id}, {"$set": {"quantity_hand": 0.0}})
+
+        product = product.reload()
+        product.aggregate_s()
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 3.0)
+        self.assertEqual(product.price, 10.0)
+
+        calls = []
+        find_ids = budy.Measurement.find_ids
+        budy.Measurement.find_ids = classmethod(
+            lambda cls, *args, **kwargs: calls.append(args) or find_ids(*args, **kwargs)
+        )
+        try:
+            measurement = measurements[0].reload()
+            measurement.price = 15.0
+            measurement.save()
+            measurement.advance_s("quantity_hand", 2.0)
+            measurement.save()
+        finally:
+            del budy.Measurement.find_ids
+
+        product = product.reload()
+
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(product.quantity_hand, 5.0)
+        self.assertEqual(product.price, 15.0)
+
+        measurement.price = 9.0
+        measurement.save()
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 5.0)
+        self.assertEqual(product.price, 9.0)
+
+    def test_aggregates_stale(self):
+        product = budy.Product(short_description="product", gender="Male", price=10.0)
+        product.save()
+
+        measurements = []
+        for value in (12, 14):
+            measurement = budy.Measurement(
+                name="size",
+                value=value,
+                price=10.0,
+                quantity_hand=2.0,
+                product=product,
+            )
+            measurement.save()
+            measurements.append(measurement)
+            product.measurements.append(measurement)
+        product.save()
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 4.0)
+
+        measurements[0].advance_s("quantity_hand", -1.0)
+
+        self.assertEqual(product.quantity_hand, 4.0)
+
+        product.short_description = "other"
+        product.save()
+
+        product = product.reload()
+
+        self.assertEqual(product.short_description, "other")
+        self.assertEqual(product.quantity_hand, 3.0)
+        self.assertEqual(product.price, 10.0)
+
+        product.measurements.remove(measurements[1])
+        product.save()
+
+        product = product.reload()
+
+        self.assertEqual(len(product.measurements), 1)
+        self.assertEqual(product.quantity_hand, 1.0)
+
+    def test_facets(self):
+        brand = budy.Brand(name="brand", labels=["premium"])
+        brand.save()
+
+        collection = budy.Collection(name="collection")
+        collection.save()
+
+        other = budy.Collection(name="other")
+        other.save()
+
+        for index in range(3):
+            product = budy.Product(
+                short_description="product %d" % index,
+                gender="Male",
+                price=10.0,
+                brand=brand,
+            )
+            product.save()
+            product.add_collection_s(other if index == 2 else collection)
+
+        facets = budy.Product.facets()
+
+        self.assertEqual(facets["total"], 3)
+        self.assertEqual(facets["brand"], [dict(value="brand", count=3)])
+        self.assertEqual(
+            facets["collection"],
+            [dict(value="collection", count=2), dict(value="other", count=1)],
+        )
+        self.assertEqual(facets["season"], [])
+        self.assertEqual(facets["labels"], [dict(value="premium", count=3)])
+
+        facets = budy.Product.facets(collection_s="other")
+
+        self.assertEqual(facets["total"], 1)
+        self.assertEqual(facets["collection"], [dict(value="other", count=1)])
+
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, brand=brand
+        )
+        product.save()
+
+        facets = budy.Product.facets()
+
+        self.assertEqual(facets["total"], 4)
+        self.assertEqual(facets["brand"], [dict(value="brand", count=4)])
+
+    def test_catalog(self):
+        generation = budy.BudyBase.get_catalog()
+
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=1.0
+        )
+        product.save()
+
+        self.assertEqual(budy.BudyBase.get_catalog() > generation, True)
+
+        generation = budy.BudyBase.get_catalog()
+        product.advance_s("quantity_hand", 1.0)
+
+        self.assertEqual(budy.BudyBase.get_catalog() > generation, True)
+
+        generation = budy.BudyBase.get_catalog()
+        referral = budy.Referral(name="name")
+        referral.save()
+
+        self.assertEqual(budy.BudyBase.get_catalog(), generation)
+
+        catalog = budy.BudyBase._get_counter("catalog", 0)
+        generation = budy.Product._get_counter("generation", 0)
+        budy.BudyBase.begin_batch()
+        try:
+            for index in range(3):
+                product = budy.Product(
+                    short_description="product %d" % index,
+                    gender="Male",
+                    price=10.0,
+                    quantity_hand=1.0,
+                )
+                product.save()
+                product.advance_s("quantity_hand", 1.0)
+
+            self.assertEqual(budy.BudyBase._get_counter("catalog", 0), catalog)
+            self.assertEqual(budy.Product._get_counter("generation", 0), generation)
+
+            thread = threading.Thread(
+                target=product.advance_s, args=("quantity_hand", 1.0)
+            )
+            thread.start()
+            thread.join()
+
+            self.assertEqual(budy.BudyBase._get_counter("catalog", 0), catalog + 1)
+            self.assertEqual(budy.Product._get_counter("generation", 0), generation)
+        finally:
+            budy.BudyBase.end_batch()
+
+        self.assertEqual(budy.BudyBase._get_counter("catalog", 0), catalog + 2)
+        self.assertEqual(budy.Product._get_counter("generation", 0), generation + 1)
+
+    def test_catalog_etag(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=1.0
+        )
+        product.save()
+
+        path = "/api/products/%d" % product.id
+        status, headers, data = self._request(path)
+        etag = headers["Etag"]
+
+        self.assertEqual(status, 200)
+        self.assertEqual(etag.startswith('"'), True)
+        self.assertEqual(etag.endswith('"'), True)
+        self.assertEqual(json.loads(data)["id"], product.id)
+
+        status, headers, data = self._request(path)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Etag"], etag)
+
+        status, headers, data = self._request(
+            path, headers={"If-None-Match": '"other", ' + etag}
+        )
+
+        self.assertEqual(status, 304)
+        self.assertEqual(headers["Etag"], etag)
+        self.assertEqual(data, b"")
+
+        status, headers, data = self._request(path, headers={"X-Budy-Country": "PT"})
+
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers["Etag"], etag)
+
+        status, headers, data = self._request(
+            path, headers={"X-Budy-Currency": "EUR", "If-None-Match": etag}
+        )
+
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers["Etag"], etag)
+
+        product.short_description = "other"
+        product.save()
+
+        status, headers, data = self._request(path, headers={"If-None-Match": etag})
+
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers["Etag"], etag)
+        self.assertEqual(json.loads(data)["short_description"], "other")
+
+    def test_omni_delta(self):
+        for object_id in (1, 2, 3):
+            product = budy.Product(
+                short_description="product",
+                gender="Male",
+                price=10.0,
+                meta=dict(object_id=object_id),
+            )
+            product.save()
+
+        class API(object):
+            def list_products(self, **kwargs):
+                self.kwargs = kwargs
+                if kwargs["start_record"] > 0:
+                    return []
+                return [
+                    dict(object_id=1, modify_date=100),
+                    dict(object_id=2, modify_date=200),
+                    dict(object_id=3, modify_date=300),
+                ]
+
+        failed = set([2])
+
+        bot = budy.OmniBot()
+        bot.api = API()
+        bot.sync_product_safe = lambda merchandise: not (
+            merchandise["object_id"] in failed
+        )
+        bot.sync_products_delta()
+
+        self.assertEqual(bot.api.kwargs["sort"], "modify_date:ascending")
+        self.assertEqual(budy.Product._get_counter("omni_modify_date"), 199)
+
+        failed.clear()
+        bot.sync_products_delta()
+
+        self.assertEqual(budy.Product._get_counter("omni_modify_date"), 300)
+
+    def test_omni_fix(self):
+        brand = budy.Brand(name="brand")
+        brand.save()
+
+        other = budy.Brand(name="other")
+        other.save()
+
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, brand=brand
+        )
+        product.save()
+
+        _product = budy.Product(
+            short_description="product", gender="Male", price=10.0, brand=other
+        )
+        _product.save()
+
+        self.assertEqual(product.brand_s, "brand")
+
+        modified = int(time.time()) - 10
+        store = budy.Brand._collection()
+        for _brand in (brand, other):
+            store.update({"_id": _brand._id}, {"$set": {"modified": modified}})
+        budy.Product._ensure_min("omni_fix", modified + 1)
+
+        brand.name = "renamed"
+        brand.save()
+
+        fixed = []
+        fix_s = budy.Product.fix_s
+        budy.Product.fix_s = lambda self: fixed.append(self.id) or fix_s(self)
+        try:
+            bot = budy.OmniBot()
+            bot.fix_products_db()
+        finally:
+            budy.Product.fix_s = fix_s
+
+        self.assertEqual(fixed, [product.id])
+
+        product = product.reload()
+        _product = _product.reload()
+
+        self.assertEqual(product.brand_s, "renamed")
+        self.assertEqual(_product.brand_s, "other")
+
+    def _request(self, path, query="", headers=None):
+        result = dict()
+
+        def start_response(status, headers):
+            result["status"] = int(status.split(" ", 1)[0])
+            result["headers"] = dict(headers)
+
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "SCRIPT_NAME": "",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "8080",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "wsgi.url_scheme": "http",
+            "wsgi.input": appier.legacy.BytesIO(b""),
+        }
+        for name, value in (headers or dict()).items():
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+        data = b"".join(self.app.application(environ, start_response))
+        return result["status"], result["headers"], data
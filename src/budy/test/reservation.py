@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Hive Budy
+# Copyright (c) 2008-2024 Hive Solutions Lda.
+#
+# This file is part of Hive Budy.
+#
+# Hive Budy is free software: you can redistribute it and/or modify
+# it under the terms of the Apache License as published by the Apache
+# Foundation, either version 2.0 of the License, or (at your option) any
+# later version.
+#
+# Hive Budy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# Apache License for more details.
+#
+# You should have received a copy of the Apache License along with
+# Hive Budy. If not, see <http://www.apache.org/licenses/>.
+
+__author__ = "João Magalhães <joamag@hive.pt>"
+""" The author(s) of the module """
+
+__copyright__ = "Copyright (c) 2008-2024 Hive Solutions Lda."
+""" The copyright for the module """
+
+__license__ = "Apache License, Version 2.0"
+""" The license for the module """
+
+import logging
+import unittest
+
+import appier
+
+import budy
+
+
+class ReservationTest(unittest.TestCase):
+    def setUp(self):
+        self.app = budy.BudyApp(level=logging.ERROR)
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+
+    def test_basic(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=5.0
+        )
+        product.save()
+
+        order = self._build_order(product, 2.0)
+        order.mark_waiting_payment_s()
+
+        product = product.reload()
+        reservations = order.reservations()
+
+        self.assertEqual(product.quantity_hand, 3.0)
+        self.assertEqual(len(reservations), 1)
+        self.assertEqual(reservations[0].status, "held")
+        self.assertEqual(reservations[0].quantity, 2.0)
+        self.assertEqual(reservations[0].product.id, product.id)
+        self.assertEqual(reservations[0].measurement, None)
+
+        order.mark_paid_s()
+
+        product = product.reload()
+        reservations = order.reservations()
+
+        self.assertEqual(product.quantity_hand, 3.0)
+        self.assertEqual(order.inventory_decremented, True)
+        self.assertEqual(reservations[0].status, "confirmed")
+        self.assertEqual(reservations[0].release_s(), False)
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 3.0)
+
+    def test_release(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=5.0
+        )
+        product.save()
+
+        order = self._build_order(product, 2.0)
+        order.mark_waiting_payment_s()
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 3.0)
+
+        order.mark_canceled_s()
+
+        product = product.reload()
+        reservations = order.reservations()
+
+        self.assertEqual(product.quantity_hand, 5.0)
+        self.assertEqual(reservations[0].status, "released")
+        self.assertEqual(reservations[0].release_s(), False)
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 5.0)
+
+    def test_expired(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=5.0
+        )
+        product.save()
+
+        order = self._build_order(product, 2.0)
+        order.mark_waiting_payment_s()
+
+        reservation = order.reservations()[0]
+        reservation.expiration = 1
+        reservation.save()
+
+        count = budy.Reservation.collect_expired_s()
+
+        product = product.reload()
+        reservation = reservation.reload()
+
+        self.assertEqual(count, 1)
+        self.assertEqual(product.quantity_hand, 5.0)
+        self.assertEqual(reservation.status, "expired")
+
+        order.mark_paid_s()
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 3.0)
+        self.assertEqual(order.inventory_decremented, True)
+
+    def test_insufficient(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=3.0
+        )
+        product.save()
+
+        order = self._build_order(product, 2.0)
+        other = self._build_order(product, 2.0)
+        order.mark_waiting_payment_s()
+
+        self.assertRaises(appier.OperationalError, other.mark_waiting_payment_s)
+        self.assertRaises(
+            appier.OperationalError, budy.Reservation.hold_s, other, other.lines[0]
+        )
+
+        product = product.reload()
+        other = other.reload()
+
+        self.assertEqual(product.quantity_hand, 1.0)
+        self.assertEqual(other.status, "created")
+        self.assertEqual(other.reservations(), [])
+
+    def test_advance(self):
+        product = budy.Product(
+            short_description="product", gender="Male", price=10.0, quantity_hand=3.0
+        )
+        product.save()
+
+        self.assertEqual(product.advance_s("quantity_hand", -2.0, floor=0.0), 1.0)
+        self.assertEqual(product.advance_s("quantity_hand", -2.0, floor=0.0), None)
+        self.assertEqual(product.quantity_hand, 1.0)
+        self.assertEqual(
+            product.advance_s("quantity_hand", -2.0, floor=0.0, clamp=True), 0.0
+        )
+        self.assertEqual(product.advance_s("quantity_hand", 4.0), 4.0)
+
+        product = product.reload()
+
+        self.assertEqual(product.quantity_hand, 4.0)
+
+    def _build_order(self, product, quantity):
+        address = budy.Address(
+            first_name="first name",
+            last_name="last name",
+            address="address",
+            city="city",
+        )
+        address.save()
+
+        order = budy.Order()
+        order.save()
+
+        order_line = budy.OrderLine(quantity=quantity)
+        order_line.product = product
+        order_line.save()
+        order.add_line_s(order_line)
+
+        order.shipping_address = address
+        order.billing_address = address
+        order.email = "username@email.com"
+        order.save()
+
+        return order